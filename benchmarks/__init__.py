@@ -0,0 +1,5 @@
+"""
+Benchmarks of the sync hot paths, against synthetic git repositories.
+
+Run them through `python -m benchmarks --help`.
+"""
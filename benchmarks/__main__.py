@@ -0,0 +1,249 @@
+import argparse
+import io
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import OrderedDict
+from unittest import mock
+
+from benchmarks.repo import (
+    RepoShape, add_shape_arguments, create_repo, get_shape)
+from s3git.core import S3GitSync
+from s3git.fileignore import REGEX_PARSER, compile_ignore_file
+from s3git.mime import MimeTypeDetector
+
+# the number of files whose mime type is detected
+MIME_TYPE_SAMPLE_SIZE = 500
+
+DEFAULT_TOLERANCE = 0.2
+
+# smaller differences are considered as noise
+MIN_SIGNIFICANT_CHANGES = {'seconds': 0.001, 'peak_memory': 64 * 1024}
+
+
+class Context:
+    """The data shared by the benchmarks, prepared once."""
+
+    def __init__(self, repo):
+        with mock.patch.object(
+                S3GitSync, '_get_s3_current_commit', return_value=None):
+            self.s3git = S3GitSync(None)
+        self.s3git.old_tree = self.s3git.get_tree('HEAD~1')
+
+        with open('.s3ignore') as fp:
+            self.ignore_rules = fp.read()
+
+        # the files of the target tree, as [(path, sha1)]
+        files = [
+            (entry.split('\t', 1)[1], entry.split()[2])
+            for entry in repo.git.ls_tree('-r', 'HEAD', '-z').split('\0')
+            if entry]
+        self.paths = [path for path, _ in files]
+        self.blob_shas = [sha1_hash for _, sha1_hash in files]
+
+        # the files whose mime type is detected, as [(path, content)]
+        rng = random.Random(0)
+        self.contents = [
+            (path, self.s3git._get_file_content(sha1_hash).read())
+            for path, sha1_hash in rng.sample(
+                files, min(MIME_TYPE_SAMPLE_SIZE, len(files)))]
+
+
+def bench_compile_ignore_file(context):
+    # otherwise the patterns are read from the cache of `re`
+    re.purge()
+    compile_ignore_file(io.StringIO(context.ignore_rules), REGEX_PARSER)
+
+
+def bench_is_ignored(context):
+    for path in context.paths:
+        context.s3git.is_ignored(path)
+
+
+def bench_get_diffs(context):
+    context.s3git._get_diffs()
+
+
+def bench_get_file_content(context):
+    for sha1_hash in context.blob_shas:
+        context.s3git._get_file_content(sha1_hash).close()
+
+
+def bench_get_mime_type(context):
+    s3_settings = context.s3git.s3_settings
+
+    for _, content in context.contents:
+        s3_settings._get_mime_type(io.BytesIO(content))
+
+
+def bench_detect_mime_type(context):
+    # without any cached mime type
+    detector = MimeTypeDetector()
+
+    for path, content in context.contents:
+        detector.detect(path, io.BytesIO(content))
+
+
+BENCHMARKS = OrderedDict((
+    ('fileignore.compile_ignore_file', bench_compile_ignore_file),
+    ('S3GitSync.is_ignored', bench_is_ignored),
+    ('S3GitSync._get_diffs', bench_get_diffs),
+    ('S3GitSync._get_file_content', bench_get_file_content),
+    ('S3Bucket._get_mime_type', bench_get_mime_type),
+    ('MimeTypeDetector.detect', bench_detect_mime_type)))
+
+
+def measure(function, context, repeat):
+    """
+    Gets the best duration of `repeat` runs, in seconds,
+    and the peak memory allocated by Python during a run, in bytes.
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(context)
+        durations.append(time.perf_counter() - start)
+
+    # tracing the allocations slows the code down, it is measured apart
+    tracemalloc.start()
+    try:
+        function(context)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {'seconds': min(durations), 'peak_memory': peak_memory}
+
+
+def run(shape: RepoShape, repeat, selected=None):
+    results = OrderedDict()
+    old_path = os.getcwd()
+
+    with tempfile.TemporaryDirectory(prefix='s3git-benchmark-') as path:
+        repo = create_repo(path, shape)
+        os.chdir(path)
+
+        try:
+            context = Context(repo)
+
+            for name, function in BENCHMARKS.items():
+                if selected and name not in selected:
+                    continue
+
+                results[name] = measure(function, context, repeat)
+                print_result(name, results[name])
+
+            context.s3git.blob_reader.close()
+        finally:
+            os.chdir(old_path)
+
+    return results
+
+
+def print_result(name, result, baseline=None):
+    line = '{name:<32} {seconds:>10.4f}s {memory:>10.1f} KiB'.format(
+        name=name, seconds=result['seconds'],
+        memory=result['peak_memory'] / 1024)
+
+    if baseline:
+        line += '  ({:+.1%} time, {:+.1%} memory)'.format(
+            _get_change(result, baseline, 'seconds'),
+            _get_change(result, baseline, 'peak_memory'))
+
+    print(line)
+
+
+def _get_change(result, baseline, key):
+    if not baseline[key]:
+        return 0
+    return result[key] / baseline[key] - 1
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares the results against a baseline,
+    and returns the names of the benchmarks that regressed.
+    """
+    regressions = []
+
+    print('\nCompared to the baseline:')
+    for name, result in results.items():
+        baseline_result = baseline.get(name)
+        if baseline_result is None:
+            continue
+
+        print_result(name, result, baseline_result)
+
+        if any(_get_change(result, baseline_result, key) > tolerance
+               and result[key] - baseline_result[key] > min_change
+               for key, min_change in MIN_SIGNIFICANT_CHANGES.items()):
+            regressions.append(name)
+
+    return regressions
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description='Benchmarks the sync hot paths '
+                    'against a synthetic git repository.')
+
+    add_shape_arguments(parser)
+
+    parser.add_argument(
+        '-n', '--repeat', type=int, default=5,
+        help='runs per benchmark, the best one is kept (default: %(default)s)')
+    parser.add_argument(
+        '-b', '--benchmark', action='append', choices=list(BENCHMARKS),
+        help='only run the given benchmarks')
+    parser.add_argument(
+        '--save', metavar='PATH', help='save the results as a JSON baseline')
+    parser.add_argument(
+        '--compare', metavar='PATH',
+        help='compare the results against a saved baseline, '
+             'failing on regressions')
+    parser.add_argument(
+        '--tolerance', type=float, default=DEFAULT_TOLERANCE,
+        help='relative slowdown or memory growth allowed '
+             'before failing a comparison (default: %(default)s)')
+
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(sys.argv[1:] if args is None else args)
+    shape = get_shape(args)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+
+        if baseline['shape'] != shape._asdict():
+            print('The baseline was run on another repository shape: %s'
+                  % baseline['shape'], file=sys.stderr)
+
+    print('Benchmarking on {}'.format(shape))
+    results = run(shape, args.repeat, args.benchmark)
+
+    if args.save:
+        with open(args.save, 'w') as fp:
+            json.dump(
+                {'shape': shape._asdict(), 'results': results}, fp, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline['results'], args.tolerance)
+
+        if regressions:
+            print('\nRegressions: %s' % ', '.join(regressions),
+                  file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+import argparse
+import os
+import random
+import string
+from collections import namedtuple
+
+import git
+
+RepoShape = namedtuple('RepoShape', (
+    'file_count', 'size_median', 'size_max', 'depth', 'ignore_rule_count',
+    'change_ratio'))
+
+DEFAULT_SHAPE = RepoShape(
+    file_count=2000, size_median=4 * 1024, size_max=1024 * 1024, depth=4,
+    ignore_rule_count=100, change_ratio=0.2)
+
+# the contents are picked from these kinds of files, to vary the mime types
+CONTENT_HEADERS = (
+    b'', b'', b'<!DOCTYPE html>\n<html>', b'GIF87a\x02\x00\x01\x00\x80',
+    b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR', b'%PDF-1.4\n')
+EXTENSIONS = ('', '.txt', '.html', '.css', '.js', '.gif', '.bin', '.dat')
+
+CONFIG = """\
+[default]
+S3_ACCESS_KEY_ID = id
+S3_SECRET_ACCESS_KEY = secret
+S3_BUCKET_NAME = benchmark
+"""
+
+
+def _random_size(rng: random.Random, shape: RepoShape):
+    # file sizes roughly follow a log-normal distribution
+    size = int(rng.lognormvariate(0, 1.5) * shape.size_median)
+    return max(0, min(size, shape.size_max))
+
+
+def _random_content(rng: random.Random, shape: RepoShape):
+    header = rng.choice(CONTENT_HEADERS)
+    size = max(0, _random_size(rng, shape) - len(header))
+    line = ''.join(rng.choice(string.ascii_letters) for _ in range(79))
+
+    body = (line + '\n') * (size // 80 + 1)
+    return header + body[:size].encode()
+
+
+def _random_path(rng: random.Random, shape: RepoShape, index):
+    depth = rng.randint(0, shape.depth)
+    directories = ['dir-%d' % rng.randint(0, 9) for _ in range(depth)]
+    file_name = 'file-%d%s' % (index, rng.choice(EXTENSIONS))
+    return '/'.join(directories + [file_name])
+
+
+def generate_ignore_rules(rng: random.Random, count):
+    """Generates ignore rules of the various shapes users write."""
+    rules = []
+
+    for index in range(count):
+        kind = index % 4
+
+        if kind == 0:
+            rules.append('dir-%d/dir-%d/' % (rng.randint(0, 9), index))
+        elif kind == 1:
+            rules.append(r'.*\.ext%d$' % index)
+        elif kind == 2:
+            rules.append(r'dir-\d/file-%d\d+' % index)
+        else:
+            rules.append(r'(?:build|dist)-%d/.*' % index)
+
+    return rules
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'wb') as fp:
+        fp.write(content)
+
+
+def create_repo(path, shape: RepoShape, seed=0) -> git.Repo:
+    """
+    Creates a git repository of the given shape at `path`, with two commits:
+    the initial files, and changes to a part of them.
+    """
+    rng = random.Random(seed)
+    repo = git.Repo.init(path)
+
+    with repo.config_writer() as config:
+        config.set_value('user', 'name', 'benchmark')
+        config.set_value('user', 'email', 'benchmark@localhost')
+
+    _write(os.path.join(repo.git_dir, 's3config.cfg'), CONFIG.encode())
+    _write(os.path.join(path, '.s3ignore'), '\n'.join(
+        generate_ignore_rules(rng, shape.ignore_rule_count)).encode())
+
+    paths = [
+        _random_path(rng, shape, index) for index in range(shape.file_count)]
+    for file_path in paths:
+        _write(os.path.join(path, file_path), _random_content(rng, shape))
+
+    repo.git.add(A=True)
+    repo.git.commit(m='Initial files')
+
+    # modify, delete and add a part of the files
+    change_count = int(shape.file_count * shape.change_ratio)
+    for file_path in rng.sample(paths, change_count):
+        action = rng.randint(0, 2)
+
+        if action == 0:
+            os.remove(os.path.join(path, file_path))
+        else:
+            _write(os.path.join(path, file_path), _random_content(rng, shape))
+
+        if action == 2:
+            new_path = _random_path(
+                rng, shape, shape.file_count + len(paths))
+            paths.append(new_path)
+            _write(os.path.join(path, new_path), _random_content(rng, shape))
+
+    repo.git.add(A=True)
+    repo.git.commit(m='Changes')
+    return repo
+
+
+def add_shape_arguments(parser: argparse.ArgumentParser):
+    shape = parser.add_argument_group('repository shape')
+    shape.add_argument(
+        '--files', type=int, default=DEFAULT_SHAPE.file_count,
+        help='number of files (default: %(default)s)')
+    shape.add_argument(
+        '--size-median', type=int, default=DEFAULT_SHAPE.size_median,
+        help='median size of the files, in bytes (default: %(default)s)')
+    shape.add_argument(
+        '--size-max', type=int, default=DEFAULT_SHAPE.size_max,
+        help='maximum size of the files, in bytes (default: %(default)s)')
+    shape.add_argument(
+        '--depth', type=int, default=DEFAULT_SHAPE.depth,
+        help='maximum depth of the directories (default: %(default)s)')
+    shape.add_argument(
+        '--ignore-rules', type=int, default=DEFAULT_SHAPE.ignore_rule_count,
+        help='number of ignore rules (default: %(default)s)')
+    shape.add_argument(
+        '--change-ratio', type=float, default=DEFAULT_SHAPE.change_ratio,
+        help='ratio of files changed by the second commit '
+             '(default: %(default)s)')
+
+
+def get_shape(args: argparse.Namespace) -> RepoShape:
+    return RepoShape(
+        file_count=args.files, size_median=args.size_median,
+        size_max=args.size_max, depth=args.depth,
+        ignore_rule_count=args.ignore_rules, change_ratio=args.change_ratio)
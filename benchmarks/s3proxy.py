@@ -0,0 +1,227 @@
+import http.client
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+
+ERROR_BODY = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<Error><Code>{code}</Code><Message>{message}</Message></Error>')
+
+INJECTED_ERRORS = {
+    503: ('SlowDown', 'Please reduce your request rate.'),
+    500: ('InternalError', 'We encountered an internal error.')}
+
+# headers that only concern a single connection
+HOP_BY_HOP_HEADERS = frozenset((
+    'connection', 'keep-alive', 'transfer-encoding', 'content-length'))
+
+
+def get_operation(method, path, query, headers):
+    """Gets the name of the S3 operation of a request, for the statistics."""
+    has_key = '/' in path.strip('/')
+
+    if method == 'PUT':
+        if 'partNumber' in query:
+            return 'UploadPartCopy' if 'x-amz-copy-source' in headers \
+                else 'UploadPart'
+        if 'x-amz-copy-source' in headers:
+            return 'CopyObject'
+        return 'PutObject' if has_key else 'CreateBucket'
+    if method == 'POST':
+        if 'uploads' in query:
+            return 'CreateMultipartUpload'
+        if 'uploadId' in query:
+            return 'CompleteMultipartUpload'
+        if 'delete' in query:
+            return 'DeleteObjects'
+    if method == 'GET':
+        return 'GetObject' if has_key else 'ListObjects'
+    if method == 'HEAD':
+        return 'HeadObject' if has_key else 'HeadBucket'
+    if method == 'DELETE':
+        return 'AbortMultipartUpload' if 'uploadId' in query \
+            else 'DeleteObject'
+    return method
+
+
+class Bandwidth:
+    """
+    Caps the bytes transferred per second, shared by every connection
+    as if they were going through the same link.
+    """
+
+    def __init__(self, bytes_per_second):
+        self.bytes_per_second = bytes_per_second
+        self._available_at = 0
+        self._lock = threading.Lock()
+
+    def transfer(self, size):
+        if not self.bytes_per_second or not size:
+            return
+
+        # the transfers are queued one after another
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._available_at)
+            self._available_at = end = start + size / self.bytes_per_second
+
+        time.sleep(end - now)
+
+
+class FaultInjectingProxy(ThreadingMixIn, HTTPServer):
+    """
+    An HTTP proxy to an S3-compatible server, slowing the requests down
+    and failing some of them, to behave like a remote S3 endpoint.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+            self, upstream_url, latency=0, jitter=0, bandwidth=0,
+            error_rates=None, seed=None):
+        super().__init__(('127.0.0.1', 0), ProxyRequestHandler)
+
+        upstream = urlsplit(upstream_url)
+        self.upstream = (upstream.hostname, upstream.port or 80)
+
+        # latencies are in seconds, the bandwidth in bytes per second,
+        # and the error rates as {status: probability}
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = Bandwidth(bandwidth)
+        self.error_rates = error_rates or {}
+
+        self.random = random.Random(seed)
+        self.requests = Counter()
+        self.injected_errors = Counter()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+    def reset_stats(self):
+        with self._lock:
+            self.requests.clear()
+            self.injected_errors.clear()
+            self.bytes_sent = self.bytes_received = 0
+
+    def _pick_error(self):
+        with self._lock:
+            draw = self.random.random()
+
+        for status, rate in sorted(self.error_rates.items()):
+            if draw < rate:
+                return status
+            draw -= rate
+        return None
+
+    def _get_latency(self):
+        with self._lock:
+            return max(0, self.latency + self.random.uniform(
+                -self.jitter, self.jitter))
+
+    def record(self, operation, error=None, received=0, sent=0):
+        with self._lock:
+            self.requests[operation] += 1
+            self.bytes_received += received
+            self.bytes_sent += sent
+
+            if error is not None:
+                self.injected_errors[error] += 1
+
+
+class ProxyRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                chunk = self.rfile.read(size)
+                self.rfile.readline()
+                if not size:
+                    break
+                chunks.append(chunk)
+            return b''.join(chunks)
+
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _respond(self, status, headers, body):
+        content_length = len(body)
+        self.send_response(status)
+
+        for name, value in headers:
+            if name.lower() not in HOP_BY_HOP_HEADERS:
+                self.send_header(name, value)
+
+            # the responses to HEAD requests describe the object
+            elif name.lower() == 'content-length' and self.command == 'HEAD':
+                content_length = value
+
+        self.send_header('Content-Length', str(content_length))
+        self.end_headers()
+
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _handle(self):
+        proxy = self.server
+        url = urlsplit(self.path)
+        operation = get_operation(
+            self.command, url.path, parse_qs(url.query, True),
+            {name.lower() for name in self.headers})
+
+        body = self._read_body()
+        time.sleep(proxy._get_latency())
+        proxy.bandwidth.transfer(len(body))
+
+        error = proxy._pick_error()
+        if error is not None:
+            proxy.record(operation, error=error, received=len(body))
+            code, message = INJECTED_ERRORS[error]
+            self._respond(
+                error, [('Content-Type', 'application/xml')],
+                ERROR_BODY.format(code=code, message=message).encode())
+            return
+
+        headers = {
+            name: value for name, value in self.headers.items()
+            if name.lower() not in HOP_BY_HOP_HEADERS}
+
+        connection = http.client.HTTPConnection(*proxy.upstream)
+        try:
+            connection.request(self.command, self.path, body, headers)
+            response = connection.getresponse()
+            response_body = response.read()
+        finally:
+            connection.close()
+
+        proxy.bandwidth.transfer(len(response_body))
+        proxy.record(
+            operation, received=len(body), sent=len(response_body))
+        self._respond(
+            response.status, response.getheaders(), response_body)
+
+    do_GET = do_PUT = do_POST = do_HEAD = do_DELETE = _handle
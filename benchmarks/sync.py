@@ -0,0 +1,181 @@
+"""
+Measures the throughput of whole synchronizations, against a local
+S3-compatible server behind a proxy injecting latency and errors.
+
+Run it through `python -m benchmarks.sync --help`.
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+from unittest import mock
+
+import boto3
+
+from benchmarks.repo import add_shape_arguments, create_repo, get_shape
+from benchmarks.s3proxy import FaultInjectingProxy
+from s3git.core import S3GitSync
+
+BUCKET_NAME = 'benchmark'
+MiB = 1024 * 1024
+
+
+def start_moto_server():
+    """Starts an in-memory S3 server, requires `moto[server]`."""
+    from moto.server import ThreadedMotoServer
+
+    # every request would be logged otherwise
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=0)
+    server.start()
+
+    host, port = server._server.server_address
+    return server, 'http://%s:%d' % (host, port)
+
+
+def create_bucket(endpoint_url):
+    s3 = boto3.resource(
+        's3', endpoint_url=endpoint_url,
+        aws_access_key_id='id', aws_secret_access_key='secret')
+    s3.create_bucket(Bucket=BUCKET_NAME)
+
+
+def run_sync(proxy, revision, **kwargs):
+    """
+    Syncs the given revision through the proxy,
+    and returns the statistics of the sync.
+    """
+    proxy.reset_stats()
+
+    s3git = S3GitSync(revision, **kwargs)
+
+    start = time.perf_counter()
+    s3git.synchronize()
+    duration = time.perf_counter() - start
+
+    # every synced file, but the deleted ones
+    files = sum(
+        count for status, count in s3git.stats.changes.items()
+        if status in ['A', 'M', 'C'])
+
+    return {
+        'files': files, 'seconds': duration,
+        'requests': dict(proxy.requests),
+        'injected_errors': dict(proxy.injected_errors),
+        'bytes_received': proxy.bytes_received,
+        'bytes_sent': proxy.bytes_sent,
+        'final_concurrency': s3git.throttle.concurrency}
+
+
+def print_stats(name, stats):
+    seconds = stats['seconds']
+    megabytes = stats['bytes_received'] / MiB
+
+    print('\n{}: {} files in {:.2f}s'.format(name, stats['files'], seconds))
+    print('  {:.1f} files/s, {:.2f} MB/s uploaded ({:.1f} MB)'.format(
+        stats['files'] / seconds, megabytes / seconds, megabytes))
+    print('  {} requests: {}'.format(
+        sum(stats['requests'].values()), ', '.join(
+            '%s=%d' % item for item in sorted(stats['requests'].items()))))
+
+    if stats['injected_errors']:
+        print('  injected errors: {}'.format(', '.join(
+            '%s=%d' % item
+            for item in sorted(stats['injected_errors'].items()))))
+    print('  concurrency at the end: {}'.format(stats['final_concurrency']))
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.sync',
+        description='Measures the throughput of a full sync and of an '
+                    'incremental sync of a synthetic git repository.')
+    add_shape_arguments(parser)
+
+    network = parser.add_argument_group('simulated network')
+    network.add_argument(
+        '--latency', type=float, default=30,
+        help='latency of every request, in milliseconds '
+             '(default: %(default)s)')
+    network.add_argument(
+        '--jitter', type=float, default=10,
+        help='random variation of the latency, in milliseconds '
+             '(default: %(default)s)')
+    network.add_argument(
+        '--bandwidth', type=float, default=0,
+        help='bandwidth shared by every request, in MB/s '
+             '(default: unlimited)')
+    network.add_argument(
+        '--error-503', type=float, default=0, metavar='RATE',
+        help='ratio of requests answered by 503 SlowDown '
+             '(default: %(default)s)')
+    network.add_argument(
+        '--error-500', type=float, default=0, metavar='RATE',
+        help='ratio of requests answered by 500 InternalError '
+             '(default: %(default)s)')
+    network.add_argument(
+        '--seed', type=int, default=0,
+        help='seed of the injected latencies and errors '
+             '(default: %(default)s)')
+
+    parser.add_argument(
+        '--upstream', metavar='URL',
+        help='S3-compatible server to proxy to, with a bucket named '
+             '"%s" (default: an in-memory moto server)' % BUCKET_NAME)
+    parser.add_argument(
+        '-j', '--jobs', type=int, help='number of concurrent uploads')
+    parser.add_argument(
+        '-v', '--verbose', action='store_true', help='show the sync logs')
+
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(sys.argv[1:] if args is None else args)
+    shape = get_shape(args)
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.ERROR)
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+    moto_server = None
+    upstream_url = args.upstream
+    if upstream_url is None:
+        moto_server, upstream_url = start_moto_server()
+        create_bucket(upstream_url)
+
+    proxy = FaultInjectingProxy(
+        upstream_url, latency=args.latency / 1000, jitter=args.jitter / 1000,
+        bandwidth=args.bandwidth * MiB, seed=args.seed,
+        error_rates={503: args.error_503, 500: args.error_500})
+    proxy.start()
+
+    old_path = os.getcwd()
+    print('Syncing {} through {} to {}'.format(shape, proxy.url, upstream_url))
+
+    try:
+        with tempfile.TemporaryDirectory(prefix='s3git-benchmark-') as path:
+            create_repo(path, shape)
+            os.chdir(path)
+
+            # the sync goes through the proxy, as if set in S3_ENDPOINT_URL
+            try:
+                with mock.patch('s3git.s3.S3_ENDPOINT_URL', proxy.url):
+                    print_stats('Full sync', run_sync(
+                        proxy, 'HEAD~1', force_reupload=True,
+                        concurrency=args.jobs))
+                    print_stats('Incremental sync', run_sync(
+                        proxy, 'HEAD', concurrency=args.jobs))
+            finally:
+                os.chdir(old_path)
+    finally:
+        proxy.stop()
+        if moto_server is not None:
+            moto_server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,14 +2,32 @@ import argparse
 import logging
 from sys import argv
 
-from s3git.core import S3GitSync
 from s3git.exceptions import BaseError
+from s3git.utils import parse_positive_int, parse_size
 
 logging.basicConfig(
     level=logging.INFO, format='%(levelname)s: %(message)s')
 
 logger = logging.getLogger(__name__)
 
+# the modes of --dirty-check, as in `s3git.core`, which is not imported
+# before the arguments are parsed
+DIRTY_CHECK_MODES = ('tracked', 'index', 'off')
+
+
+def _positive_int(value):
+    try:
+        return parse_positive_int(value)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(str(exc)) from exc
+
+
+def _size(value):
+    try:
+        return parse_size(value)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(str(exc)) from exc
+
 
 def _parse_arguments(*args):
     parser = argparse.ArgumentParser()
@@ -24,16 +42,128 @@ def _parse_arguments(*args):
     parser.add_argument(
         '-w', '--wildcard', dest='use_wildcard',
         default=False, action='store_true',
-        help='forces a whole reupload')
-    return parser.parse_args(args)
+        help='use wildcards instead of regexes in the ignore file')
+    parser.add_argument(
+        '-r', '--reconcile', dest='reconcile',
+        default=False, action='store_true',
+        help='reuploads every file that differs from the remote files')
+    parser.add_argument(
+        '-m', '--manifest', dest='use_manifest',
+        default=False, action='store_true',
+        help='keeps a manifest of the remote files, allowing to sync '
+             'without having the remote revision in the local repository')
+    parser.add_argument(
+        '-R', '--renames', dest='detect_renames',
+        default=False, action='store_true',
+        help='copies renamed and copied files server-side '
+             'instead of reuploading them')
+    parser.add_argument(
+        '-j', '--jobs', dest='concurrency',
+        default=None, type=_positive_int,
+        help='number of files to upload concurrently')
+    parser.add_argument(
+        '--dirty-check', dest='dirty_check',
+        default='tracked', choices=DIRTY_CHECK_MODES,
+        help='how to check the repository for uncommitted changes: '
+             'the index and the tracked files (default), only the index, '
+             'or not at all')
+    parser.add_argument(
+        '-s', '--section', dest='sections',
+        default=None, action='append', metavar='SECTION',
+        help='syncs to the location of the given configuration section, '
+             'can be repeated to sync to several locations at once')
+    parser.add_argument(
+        '--stats-json', dest='stats_path',
+        default=None, metavar='PATH',
+        help='writes the counters and timings of the sync '
+             'to PATH as JSON')
+    parser.add_argument(
+        '--trace', dest='trace_path',
+        default=None, metavar='PATH',
+        help='traces the sync to PATH, in the Chrome trace event format')
+
+    plan_group = parser.add_mutually_exclusive_group()
+    plan_group.add_argument(
+        '--plan', dest='plan_path',
+        default=None, metavar='PATH',
+        help='writes the changes to sync and their estimated cost '
+             'to PATH as JSON, without syncing them')
+    plan_group.add_argument(
+        '--apply', dest='apply_file',
+        default=None, type=argparse.FileType('r'), metavar='PATH',
+        help='syncs the changes planned in PATH by --plan')
+
+    transfer_group = parser.add_argument_group(
+        'transfer options', 'sizes are in bytes, or suffixed by K, M or G')
+    transfer_group.add_argument(
+        '--multipart-threshold', dest='multipart_threshold',
+        default=None, type=_size, metavar='SIZE',
+        help='size from which files are uploaded in multiple parts')
+    transfer_group.add_argument(
+        '--multipart-chunksize', dest='multipart_chunksize',
+        default=None, type=_size, metavar='SIZE',
+        help='size of the parts, picked from the file size if not set')
+    transfer_group.add_argument(
+        '--transfer-concurrency', dest='transfer_concurrency',
+        default=None, type=_positive_int, metavar='COUNT',
+        help='number of parts of a single file to transfer concurrently')
+    transfer_group.add_argument(
+        '--io-chunksize', dest='io_chunksize',
+        default=None, type=_size, metavar='SIZE',
+        help='size of the chunks read from the files')
+
+    parsed = parser.parse_args(args)
+    if parsed.reconcile and (parsed.plan_path or parsed.apply_file):
+        parser.error('--reconcile cannot be used with --plan or --apply')
+    if parsed.sections and (parsed.plan_path or parsed.apply_file):
+        parser.error('--section cannot be used with --plan or --apply')
+    return parsed
+
+
+def _write_plan(s3_sync, path):
+    plan = s3_sync.plan()
+
+    with open(path, 'w') as fp:
+        plan.dump(fp)
+
+    estimate = plan.estimate
+    logger.info(
+        'Planned %d uploads (%d bytes), %d copies and %d deletions, '
+        'in %d requests costing about $%.4f',
+        len(plan.uploads), estimate['upload_bytes'],
+        len(plan.copies) + len(plan.duplicates), len(plan.deletions),
+        sum(estimate['requests'].values()), estimate['cost_usd'])
 
 
 def main():
     parsed = vars(_parse_arguments(*argv[1:]))
+    plan_path = parsed.pop('plan_path')
+    apply_file = parsed.pop('apply_file')
+    sections = parsed.pop('sections')
+
+    # the sync modules import GitPython, they are only imported
+    # once the arguments are valid
+    from s3git.core import S3GitSync
+    from s3git.fanout import FanOutSync
+    from s3git.plan import SyncPlan
 
     try:
-        s3_sync = S3GitSync(**parsed)
-        s3_sync.synchronize()
+        plan = None
+        if apply_file:
+            with apply_file:
+                plan = SyncPlan.load(apply_file)
+
+        if sections:
+            s3_sync = FanOutSync(sections=sections, **parsed)
+        else:
+            s3_sync = S3GitSync(**parsed)
+
+        if plan_path:
+            _write_plan(s3_sync, plan_path)
+        elif plan:
+            s3_sync.apply(plan)
+        else:
+            s3_sync.synchronize()
     except BaseError as exc:
         logger.error(exc.msg)
         exit(1)
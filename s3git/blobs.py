@@ -0,0 +1,295 @@
+import os
+import threading
+from io import BytesIO, RawIOBase
+from subprocess import PIPE
+from tempfile import TemporaryFile
+
+from git import Repo
+from s3git.exceptions import MissingGitObject
+
+# blobs bigger than this size (in bytes) are spooled to a temporary file
+# instead of being held in memory
+BLOB_SPOOL_MAX_SIZE = int(os.getenv('BLOB_SPOOL_MAX_SIZE', 8 * 1024 * 1024))
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class BlobReader:
+    """
+    Reads git objects through a single long-lived `git cat-file --batch`
+    process, instead of spawning a new git process for every object.
+
+    A reader is not thread-safe, see `BlobReaderPool` for that.
+    """
+
+    def __init__(self, repo: Repo, spool_max_size=BLOB_SPOOL_MAX_SIZE):
+        self.repo = repo
+        self.spool_max_size = spool_max_size
+        self._process = None
+
+    def _get_process(self):
+        if self._process is None:
+            self._process = self.repo.git.cat_file(
+                '--batch', as_process=True, istream=PIPE)
+        return self._process
+
+    def _read_header(self, name: str):
+        process = self._get_process()
+        stdin, stdout = process.stdin, process.stdout
+
+        stdin.write(name.encode(errors='surrogateescape') + b'\n')
+        stdin.flush()
+
+        # the header is either `<sha> <type> <size>`
+        # or `<name> missing` (or `ambiguous`) if the object is not usable
+        header = stdout.readline().rstrip(b'\n')
+        if header.endswith((b' missing', b' ambiguous')) or not header:
+            raise MissingGitObject(name)
+
+        sha, object_type, size = header.split(b' ')
+        return sha.decode(), int(size)
+
+    def _copy_content(self, name, fp, size):
+        stdout = self._process.stdout
+
+        while size > 0:
+            chunk = stdout.read(min(size, COPY_BUFFER_SIZE))
+            if not chunk:
+                raise MissingGitObject(name)
+
+            fp.write(chunk)
+            size -= len(chunk)
+
+    def read(self, name: str):
+        """
+        Reads the raw content of the object `name`,
+        being either its hash or a `tree-ish:path` reference.
+
+        The content is returned as a file object, small objects are kept
+        in memory while bigger ones are streamed into a temporary file.
+        """
+        sha, size = self._read_header(name)
+
+        if size <= self.spool_max_size:
+            fp = BytesIO()
+        else:
+            fp = TemporaryFile(suffix='-s3git')
+
+        try:
+            self._copy_content(name, fp, size)
+
+            # every object's content is followed by a line feed
+            self._process.stdout.read(1)
+        except BaseException:
+            fp.close()
+
+            # the rest of the object is still pending in the pipe,
+            # the process cannot be reused
+            self.close()
+            raise
+
+        fp.seek(0)
+        return fp
+
+    def close(self):
+        process, self._process = self._process, None
+
+        if process is not None:
+            process.stdin.close()
+            process.proc.kill()
+            process.proc.wait()
+            process.stdout.close()
+
+
+class BlobReaderPool:
+    """Lazily gives every thread its own `BlobReader`."""
+
+    def __init__(self, repo: Repo):
+        self.repo = repo
+        self._local = threading.local()
+        self._readers = []
+        self._lock = threading.Lock()
+
+    def get(self) -> BlobReader:
+        reader = getattr(self._local, 'reader', None)
+
+        if reader is None:
+            reader = self._local.reader = BlobReader(self.repo)
+            with self._lock:
+                self._readers.append(reader)
+
+        return reader
+
+    def read(self, name: str):
+        return self.get().read(name)
+
+    def release(self, name: str):
+        # the objects are read on demand, there is nothing to release
+        pass
+
+    def close(self):
+        """Terminates every reader that was started by the pool."""
+        with self._lock:
+            readers, self._readers = self._readers, []
+            self._local = threading.local()
+
+        for reader in readers:
+            reader.close()
+
+
+class _SharedBlob:
+    __slots__ = ('uses', 'size', 'content', 'fp', 'views', 'lock')
+
+    def __init__(self):
+        # the consumers expected to read the blob, and reading it
+        self.uses = 0
+        self.views = 0
+
+        # small contents are kept in memory, bigger ones in the
+        # temporary file they were spooled to
+        self.size = None
+        self.content = None
+        self.fp = None
+        self.lock = threading.Lock()
+
+    def release(self):
+        if self.fp is not None and self.uses <= 0 and self.views <= 0:
+            self.fp.close()
+            self.fp = None
+
+
+class _SharedBlobView(RawIOBase):
+    """Reads a spooled blob shared between threads, at its own position."""
+
+    def __init__(self, blob: _SharedBlob):
+        super().__init__()
+        self._blob = blob
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        with self._blob.lock:
+            self._blob.fp.seek(self._position)
+            size = self._blob.fp.readinto(buffer)
+
+        self._position += size
+        return size
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self._blob.size
+
+        self._position = offset
+        return offset
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        if not self.closed:
+            with self._blob.lock:
+                self._blob.views -= 1
+                self._blob.release()
+        super().close()
+
+
+class SharedBlobCache:
+    """
+    Reads every blob once for several consumers, e.g. the syncs of
+    a revision to several buckets. The consumers of every blob
+    are announced beforehand through `expect`, and every one of them
+    gets its own file object; the blob is released once they all read it,
+    the consumers skipping the blob `release` it instead.
+
+    Unexpected blobs are read from the reader as they are requested.
+
+    The cache can be shared between threads.
+    """
+
+    def __init__(self, reader: BlobReaderPool):
+        self.reader = reader
+        self._blobs = {}
+        self._lock = threading.Lock()
+
+    def expect(self, name: str):
+        """Announces a consumer of the object `name`."""
+        with self._lock:
+            blob = self._blobs.get(name)
+            if blob is None:
+                blob = self._blobs[name] = _SharedBlob()
+            blob.uses += 1
+
+    def _load(self, name, blob: _SharedBlob):
+        fp = self.reader.read(name)
+        blob.size = fp.seek(0, os.SEEK_END)
+        fp.seek(0)
+
+        if isinstance(fp, BytesIO):
+            blob.content = fp.getvalue()
+            fp.close()
+        else:
+            blob.fp = fp
+
+    def read(self, name: str):
+        with self._lock:
+            blob = self._blobs.get(name)
+
+        if blob is None:
+            return self.reader.read(name)
+
+        with blob.lock:
+            if blob.size is None:
+                self._load(name, blob)
+
+            if blob.content is not None:
+                # the buffer is shared until the file object is written to
+                fp = BytesIO(blob.content)
+            else:
+                blob.views += 1
+                fp = _SharedBlobView(blob)
+
+            self._drop_use(name, blob)
+
+        return fp
+
+    def release(self, name: str):
+        """Withdraws a consumer of the object `name` which won't read it."""
+        with self._lock:
+            blob = self._blobs.get(name)
+
+        if blob is not None:
+            with blob.lock:
+                self._drop_use(name, blob)
+
+    def _drop_use(self, name, blob: _SharedBlob):
+        # the blob lock is held by the caller
+        blob.uses -= 1
+
+        if blob.uses <= 0:
+            with self._lock:
+                self._blobs.pop(name, None)
+            blob.content = None
+            blob.release()
+
+    def close(self):
+        # the consumers close the cache once they are done,
+        # it is cleared by its owner once every consumer is done
+        pass
+
+    def clear(self):
+        """Releases the blobs that were not read by all of their consumers."""
+        with self._lock:
+            blobs, self._blobs = self._blobs, {}
+
+        for blob in blobs.values():
+            with blob.lock:
+                blob.uses = 0
+                blob.content = None
+                blob.release()
@@ -0,0 +1,117 @@
+import fnmatch
+import gzip
+import os
+import shutil
+from tempfile import NamedTemporaryFile
+from typing import BinaryIO, Sequence, Union
+
+from s3git.exceptions import MissingDependency
+from s3git.tracing import tracer
+
+ENCODING_GZIP = 'gzip'
+ENCODING_BROTLI = 'br'
+COMPRESSION_ENCODINGS = (ENCODING_GZIP, ENCODING_BROTLI)
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+# contents are only uploaded compressed if it saves at least 10% of their size
+MAX_COMPRESSION_RATIO = 0.9
+
+# the cache marks the contents not worth compressing by this suffix
+SKIPPED_SUFFIX = '.skip'
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def _import_brotli():
+    try:
+        import brotli
+    except ImportError as exc:
+        raise MissingDependency(('brotli compression', 'brotli')) from exc
+    return brotli
+
+
+class Compressor:
+    """
+    Compresses the contents of the files matching any of `patterns`,
+    which are matched against both their path and their mime type
+    (e.g. `*.html` or `text/*`), to be uploaded with a `Content-Encoding`.
+
+    The compressed contents are cached on disk by blob hash and
+    compression settings, along with the contents not worth compressing,
+    so a content is only ever compressed once.
+    """
+
+    def __init__(
+            self, cache_dir: str, patterns: Sequence[str],
+            encoding=ENCODING_GZIP):
+        self.patterns = tuple(patterns)
+        self.encoding = encoding
+        self._brotli = None
+
+        if encoding == ENCODING_BROTLI:
+            self._brotli = _import_brotli()
+            level = BROTLI_QUALITY
+        else:
+            level = GZIP_LEVEL
+
+        # changing the settings starts a new cache
+        self.cache_dir = os.path.join(cache_dir, '%s-%d-%d' % (
+            encoding, level, MAX_COMPRESSION_RATIO * 100))
+
+    def match(self, path: str, mime_type: Union[str, None]=None):
+        return any(
+            fnmatch.fnmatch(path, pattern)
+            or (mime_type and fnmatch.fnmatch(mime_type, pattern))
+            for pattern in self.patterns)
+
+    def _compress_to(self, fp: BinaryIO, out: BinaryIO):
+        if self._brotli is None:
+            with gzip.GzipFile(
+                    filename='', mode='wb', fileobj=out,
+                    compresslevel=GZIP_LEVEL, mtime=0) as gzip_fp:
+                shutil.copyfileobj(fp, gzip_fp, COPY_BUFFER_SIZE)
+            return
+
+        compressor = self._brotli.Compressor(quality=BROTLI_QUALITY)
+        for chunk in iter(lambda: fp.read(COPY_BUFFER_SIZE), b''):
+            out.write(compressor.process(chunk))
+        out.write(compressor.finish())
+
+    def compress(self, sha1_hash: str, fp: BinaryIO) -> Union[BinaryIO, None]:
+        """
+        Gets the compressed content of a blob, or `None`
+        if it is not worth compressing; `fp` is then rewound.
+        """
+        path = os.path.join(self.cache_dir, sha1_hash)
+
+        try:
+            return open(path, 'rb')
+        except FileNotFoundError:
+            if os.path.exists(path + SKIPPED_SUFFIX):
+                return None
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # the content is compressed to a temporary file of the cache,
+        # which is moved at once, for the cache to be shared between threads
+        tmp_file = NamedTemporaryFile(
+            dir=self.cache_dir, prefix='.tmp-', delete=False)
+
+        try:
+            with tracer.span('compress', blob=sha1_hash), tmp_file:
+                self._compress_to(fp, tmp_file)
+                size, compressed_size = fp.tell(), tmp_file.tell()
+            fp.seek(0)
+
+            if not size or compressed_size / size > MAX_COMPRESSION_RATIO:
+                open(path + SKIPPED_SUFFIX, 'w').close()
+                return None
+
+            os.replace(tmp_file.name, path)
+        finally:
+            if os.path.exists(tmp_file.name):
+                os.remove(tmp_file.name)
+
+        return open(path, 'rb')
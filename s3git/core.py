@@ -1,16 +1,71 @@
+import itertools
+import json
 import logging
 import os
 import os.path
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait)
 from io import BytesIO
-from typing import Pattern, Union
+from queue import Queue
+from typing import Union
 
 from git import InvalidGitRepositoryError, Repo, Tree
+from s3git.blobs import BlobReaderPool
+from s3git.compression import ENCODING_GZIP, Compressor
 from s3git.exceptions import *
-from s3git.fileignore import get_parser, retrieve_ignore_patterns
-from s3git.s3 import S3Bucket
+from s3git.fileignore import (
+    IgnoreMatcher, get_parser, retrieve_ignore_patterns)
+from s3git.journal import SyncJournal
+from s3git.manifest import MANIFEST_FILE_NAME, Manifest, ManifestEntry
+from s3git.mime import MimeTypeDetector
+from s3git.plan import (
+    PlannedCopy, PlannedUpload, SyncPlan, estimate_plan)
+from s3git.s3 import (
+    S3_ENDPOINT_URL, DEFAULT_MAX_POOL_CONNECTIONS,
+    DEFAULT_TRANSFER_CONCURRENCY, RESOURCE_POOL, S3Bucket)
+from s3git.stats import SyncStats
+from s3git.throttle import AdaptiveThrottle, get_retry_delay
+from s3git.tracing import tracer
 
 REV_FILE_NAME = '.s3git-rev'
 
+# the local caches are stored in this directory of the git directory
+CACHE_DIR_NAME = 's3git-cache'
+MIME_TYPES_CACHE_FILE_NAME = 'mime-types'
+JOURNAL_FILE_NAME = 'sync-journal'
+REVISIONS_CACHE_FILE_NAME = 'remote-revisions'
+COMPRESSED_CACHE_DIR_NAME = 'compressed'
+
+DEFAULT_UPLOAD_CONCURRENCY = 8
+
+# how the repository is checked for uncommitted changes: `tracked` checks
+# the index and the tracked files of the worktree, `index` only checks the
+# index, which avoids scanning the worktree, and `off` skips the check
+DIRTY_CHECK_TRACKED = 'tracked'
+DIRTY_CHECK_INDEX = 'index'
+DIRTY_CHECK_OFF = 'off'
+DIRTY_CHECK_MODES = (DIRTY_CHECK_TRACKED, DIRTY_CHECK_INDEX, DIRTY_CHECK_OFF)
+
+# copies need their source, thus must happen before the deletions
+DIFF_STATUS_ORDER = ('C', 'A', 'M', 'D')
+
+# the diff is read from git by chunks of this size (in bytes)
+DIFF_READ_SIZE = 64 * 1024
+
+# the number of tasks that can wait for a worker, per worker,
+# to bound the tasks held in memory while the diff is being read
+PENDING_TASKS_PER_WORKER = 2
+
+# the number of batches of deletions sent concurrently,
+# and that can wait to be sent per worker
+DELETE_CONCURRENCY = 4
+PENDING_DELETE_BATCHES = 2
+
+
+# every sync has its own S3 client, for its statistics and throttling
+# to only account for its own requests
+_sync_ids = itertools.count()
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +74,10 @@ IGNORE_FILE_PATH = os.getenv('IGNORE_FILE_PATH', '.s3ignore')
 W_INEXISTING_IGNORE_FILE = 'Ignore file %s does not exist.'
 W_DIRTY_REPO_MSG = 'The repository contains uncommitted ' \
                    'changes that will not be synced.'
+W_MISSING_REMOTE_REVISION = 'The remote revision %s is not in the local ' \
+                            'repository, every file will be reuploaded.'
+W_UNUSABLE_MANIFEST = 'The remote manifest is missing or outdated, ' \
+                      'it will be rebuilt.'
 
 
 def _retrieve_ignore_list(use_wildcard):
@@ -34,7 +93,20 @@ def _retrieve_ignore_list(use_wildcard):
     return ignore_list
 
 
-def get_repo():
+def get_cache_path(repo: Repo, file_name):
+    return os.path.join(repo.git_dir, CACHE_DIR_NAME, file_name)
+
+
+def check_dirty(repo: Repo, dirty_check=DIRTY_CHECK_TRACKED):
+    """Warns if the repository contains uncommitted changes."""
+    if dirty_check == DIRTY_CHECK_OFF:
+        return
+
+    if repo.is_dirty(working_tree=dirty_check == DIRTY_CHECK_TRACKED):
+        logger.warn(W_DIRTY_REPO_MSG)
+
+
+def get_repo(dirty_check=DIRTY_CHECK_TRACKED):
     path = os.getcwd()
 
     try:
@@ -42,9 +114,7 @@ def get_repo():
     except InvalidGitRepositoryError as exc:
         raise InvalidRepository(path) from exc
 
-    if repo.is_dirty():
-        logger.warn(W_DIRTY_REPO_MSG)
-
+    check_dirty(repo, dirty_check)
     return repo
 
 
@@ -52,9 +122,14 @@ class S3GitSync:
     def __init__(
             self,
             branch: Union[str, None],
-            force_reupload=False, use_wildcard=False):
+            force_reupload=False, use_wildcard=False, concurrency=None,
+            reconcile=False, use_manifest=False, detect_renames=False,
+            multipart_threshold=None, multipart_chunksize=None,
+            transfer_concurrency=None, io_chunksize=None, stats_path=None,
+            trace_path=None, section=None, dirty_check=DIRTY_CHECK_TRACKED):
 
-        self.repo = get_repo()
+        # the repository is checked for changes in the background
+        self.repo = get_repo(DIRTY_CHECK_OFF)
 
         # if no branch or revision to sync from was passed,
         # we set to sync from the current branch
@@ -64,26 +139,180 @@ class S3GitSync:
         # TODO: remove this, it is unused
         self.branch = branch
 
-        self.s3_settings = S3Bucket.read_config(branch)
+        # the settings are read from the section named after the branch,
+        # unless a section is given explicitly
+        if section:
+            self.s3_settings = S3Bucket.read_config(section, use_default=False)
+        else:
+            self.s3_settings = S3Bucket.read_config(branch)
+
+        # the transfer settings given from the command line
+        # take precedence over the configuration file
+        transfer_settings = {
+            'S3_MULTIPART_THRESHOLD': multipart_threshold,
+            'S3_MULTIPART_CHUNKSIZE': multipart_chunksize,
+            'S3_TRANSFER_CONCURRENCY': transfer_concurrency,
+            'S3_IO_CHUNKSIZE': io_chunksize}
+
+        for key, value in transfer_settings.items():
+            if value is not None:
+                setattr(self.s3_settings, key, value)
+
+        self.concurrency = (
+            concurrency or self.s3_settings.S3_UPLOAD_CONCURRENCY
+            or DEFAULT_UPLOAD_CONCURRENCY)
+
+        self.s3_settings.pool_scope = next(_sync_ids)
+
+        # keep a connection open for every part transferred concurrently
+        # by the upload workers, and for every deletion worker,
+        # unless the pool size is configured
+        if not self.s3_settings.S3_MAX_POOL_CONNECTIONS:
+            transfer_concurrency = (
+                self.s3_settings.S3_TRANSFER_CONCURRENCY
+                or DEFAULT_TRANSFER_CONCURRENCY)
+            self.s3_settings.S3_MAX_POOL_CONNECTIONS = max(
+                DEFAULT_MAX_POOL_CONNECTIONS,
+                self.concurrency * transfer_concurrency + DELETE_CONCURRENCY)
+
+        # the remote revision is fetched, and the repository checked for
+        # uncommitted changes, while the local settings and trees are prepared
+        preflight = ThreadPoolExecutor(max_workers=2)
+        dirty_check_future = preflight.submit(
+            check_dirty, self.repo, dirty_check)
+        remote_commit_future = None
+        self.force_reupload = force_reupload
+        if not (force_reupload or reconcile):
+            remote_commit_future = preflight.submit(
+                self._get_s3_current_commit)
+        preflight.shutdown(wait=False)
+
+        # lowers the concurrency when S3 throttles the requests
+        self.throttle = AdaptiveThrottle(self.concurrency)
         self.ignore_list = _retrieve_ignore_list(use_wildcard)
+        self.ignore_matcher = IgnoreMatcher(self.ignore_list)
 
-        self.old_tree = self.get_empty_tree() \
-            if force_reupload else self.get_remote_tree()
+        self.blob_reader = BlobReaderPool(self.repo)
+
+        # the blob hashes of the files listed beforehand or copied,
+        # as {path: sha1}, the streamed diffs carry their own blob hashes
+        self.blob_shas = {}
+
+        # the mime types of the synced files, as {path: mime type},
+        # only kept to build the manifest
+        self.mime_types = {}
+        self.mime_detector = MimeTypeDetector(
+            get_cache_path(self.repo, MIME_TYPES_CACHE_FILE_NAME))
+
+        # the contents matching `S3_COMPRESS` are uploaded compressed,
+        # the content encoding of the uploaded contents is kept
+        # as {sha1: encoding} for their duplicates to be copied with it
+        self.compressor = None  # type: Compressor
+        if self.s3_settings.S3_COMPRESS:
+            self.compressor = Compressor(
+                get_cache_path(self.repo, COMPRESSED_CACHE_DIR_NAME),
+                self.s3_settings.S3_COMPRESS,
+                self.s3_settings.S3_COMPRESSION or ENCODING_GZIP)
+        self.content_encodings = {}
+
+        # renamed or copied files are copied from their remote source
+        # instead of being reuploaded, sources are stored as {path: source}
+        self.detect_renames = detect_renames
+        self.copy_sources = {}
+
+        # the files uploaded by this sync, as {sha1: path}, contents shared
+        # by several files are only uploaded once and then copied
+        self.uploaded_blobs = {}
+
+        # when reconciling, every file is compared against the remote
+        # files' metadata instead of the remote revision
+        self.reconcile = reconcile
+        self.remote_paths = None
+        self.up_to_date_paths = []
+
+        # the files synced so far, to resume interrupted syncs
+        self.journal = None  # type: SyncJournal
+        self.journal_name = JOURNAL_FILE_NAME
+
+        # the counters and timings of the sync, written as JSON
+        # to `stats_path` once the sync is over
+        self.stats = SyncStats()
+        self.stats_path = stats_path
+
+        # the spans of the sync are traced to `trace_path` if given
+        self.trace_path = trace_path
+
+        self.use_manifest = use_manifest or self.s3_settings.S3_USE_MANIFEST
+        self.remote_manifest = None  # type: Manifest
+
+        # the remote revision the changes are computed against
+        self.remote_revision = None
+
+        # the target is resolved first, for the remote revision
+        # to be compared against it before any other work
         self.target_tree = self.get_tree(self.repo.commit(branch))
+        self.old_tree = self.get_empty_tree() \
+            if remote_commit_future is None \
+            else self._get_remote_tree(remote_commit_future.result())
+
+        dirty_check_future.result()
+
+    def _get_revisions_cache_key(self):
+        return '{endpoint}/{bucket}/{path}'.format(
+            endpoint=S3_ENDPOINT_URL or '',
+            bucket=self.s3_settings.S3_BUCKET_NAME,
+            path=self.s3_settings.get_target_path(REV_FILE_NAME))
+
+    def _read_revisions_cache(self):
+        """
+        Reads the last seen remote revisions of every location,
+        as {location: [etag, revision]}.
+        """
+        path = get_cache_path(self.repo, REVISIONS_CACHE_FILE_NAME)
+
+        try:
+            with open(path) as fp:
+                cache = json.load(fp)
+        except (OSError, ValueError):
+            return {}
+
+        return cache if isinstance(cache, dict) else {}
+
+    def _write_revisions_cache(self, cache):
+        path = get_cache_path(self.repo, REVISIONS_CACHE_FILE_NAME)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # the cache is replaced at once, to never be left half written
+        with open(path + '.tmp', 'w') as fp:
+            json.dump(cache, fp)
+        os.replace(path + '.tmp', path)
 
     def _get_s3_current_commit(self):
-        fp = self.s3_settings.get_file(REV_FILE_NAME)
+        """
+        Reads the remote revision, which is only downloaded
+        if it changed since the last time it was read.
+        """
+        cache = self._read_revisions_cache()
+        key = self._get_revisions_cache_key()
+        etag, commit = cache.get(key) or (None, None)
 
-        if fp:
-            commit = fp.readline().decode()
+        modified, content, etag = self.s3_settings.get_file_if_modified(
+            REV_FILE_NAME, etag)
+        if not modified:
             return commit
-        return None
+
+        commit = content.splitlines()[0].decode() if content else None
+
+        if etag and commit:
+            cache[key] = [etag, commit]
+        else:
+            cache.pop(key, None)
+
+        self._write_revisions_cache(cache)
+        return commit
 
     def is_ignored(self, file):
-        for pattern in self.ignore_list:  # type: Pattern
-            if pattern.match(file):
-                return True
-        return False
+        return self.ignore_matcher.match(file)
 
     def get_empty_tree(self):
         return self.get_tree(
@@ -92,79 +321,892 @@ class S3GitSync:
     def get_tree(self, commit):
         return self.repo.tree(commit)
 
+    def _get_remote_manifest(self, revision):
+        fp = self.s3_settings.get_file(MANIFEST_FILE_NAME)
+        manifest = None
+
+        if fp:
+            try:
+                manifest = Manifest.load(fp)
+            finally:
+                fp.close()
+
+        if manifest is None or manifest.revision != revision:
+            logger.warn(W_UNUSABLE_MANIFEST)
+            return None
+        return manifest
+
     def get_remote_tree(self):
         """
-        Gets the SHA1 commit value of the S3 storage bucket
-        or `None` if the bucket doesn't have one
+        Gets the tree of the revision stored in the S3 storage bucket
+        or the empty tree if the bucket doesn't have one
         (implies we are starting on a clean tree).
+
+        If the revision is not in the local repository (e.g. shallow clones),
+        `None` is returned if the remote manifest can be used instead.
         """
-        current_s3_commit = self._get_s3_current_commit()
+        return self._get_remote_tree(self._get_s3_current_commit())
+
+    def _get_remote_tree(self, current_s3_commit):
+        self.remote_revision = current_s3_commit
+
+        if not current_s3_commit:
+            return self.get_empty_tree()
+
+        # the remote is up to date, there is nothing to compare
+        if current_s3_commit == self.target_tree.hexsha:
+            return self.target_tree
+
+        if self.use_manifest:
+            self.remote_manifest = self._get_remote_manifest(current_s3_commit)
 
-        if current_s3_commit:
+        try:
             return self.get_tree(current_s3_commit)
-        return self.get_empty_tree()
+        except ValueError:
+            if self.remote_manifest:
+                return None
 
-    def _get_file_content(self, sha1_hash, file):
-        content_str = self.repo.git.show('%s:%s' % (sha1_hash, file))
-        fp = BytesIO(content_str.encode(errors='surrogateescape'))
-        return fp
+            logger.warn(W_MISSING_REMOTE_REVISION, current_s3_commit)
+            return self.get_empty_tree()
 
-    def _get_diffs(self):
-        diffs = self.repo.git.diff(
-            '--name-status', '--no-renames', '-z',
-            self.old_tree.hexsha, self.target_tree.hexsha)
-        diffs = iter(diffs.split('\0'))
+    def _get_file_content(self, sha1_hash, file=None):
+        """
+        Reads a blob from git, `sha1_hash` being either the blob hash itself
+        or the tree-ish to read `file` from.
+        """
+        name = sha1_hash if file is None else '%s:%s' % (sha1_hash, file)
 
-        # Diffs will be stored as {status: [file1, ..., file_n]}
-        # The aim is to make bulk requests to the API
-        results = {}
+        with tracer.span('git.read_blob', blob=name):
+            return self.blob_reader.read(name)
+
+    def _record_diff(self, status, file, sha1_hash):
+        """
+        Records a change to sync, returned as `(status, file, sha1)`,
+        or `None` if the file is ignored.
+        """
+        with self.stats.measure('ignore'):
+            ignored = self.is_ignored(file)
+
+        if ignored:
+            return None
+
+        if status == 'C':
+            logger.info('[C] %s -> %s', self.copy_sources[file], file)
+        else:
+            logger.info('[%s] %s', status, file)
+
+        return status, file, sha1_hash
+
+    def _record_rename(self, status, header, source, file):
+        """
+        Records a rename (`R`) or copy (`C`) of `source` to `file`.
+
+        Unchanged contents are copied server-side, other contents
+        are uploaded. Sources of renames are deleted afterwards.
+        """
+        old_sha1_hash, sha1_hash = header.split(' ')[2:4]
+
+        if old_sha1_hash == sha1_hash and not self.is_ignored(source):
+            self.copy_sources[file] = source
+            yield self._record_diff('C', file, sha1_hash)
+        else:
+            yield self._record_diff('A', file, sha1_hash)
+
+        if status == 'R':
+            yield self._record_diff('D', source, None)
+
+    def _list_target_files(self):
+        """Lists every file of the target tree, as {path: (sha1, size)}."""
+        entries = self.repo.git.ls_tree(
+            '-r', '-l', '-z', self.target_tree.hexsha)
+        files = {}
+
+        for entry in entries.split('\0'):
+            if not entry:
+                continue
+
+            # entries are formatted as `mode type sha1 size\tpath`
+            info, path = entry.split('\t', 1)
+            mode, object_type, sha1_hash, size = info.split()
+
+            # skip submodules
+            if object_type == 'blob':
+                files[path] = (sha1_hash, int(size))
+
+        return files
+
+    def _iter_manifest_diffs(self):
+        """Diffs the target tree against the remote manifest."""
+        remote_files = self.remote_manifest.files
+        target_files = self._list_target_files()
+
+        for file, (sha1_hash, size) in target_files.items():
+            remote_entry = remote_files.get(file)
+
+            if remote_entry is None:
+                yield self._record_diff('A', file, sha1_hash)
+            elif remote_entry.sha1 != sha1_hash:
+                yield self._record_diff('M', file, sha1_hash)
+
+        for file in sorted(remote_files):
+            if file not in target_files:
+                yield self._record_diff('D', file, None)
+
+    def _iter_git_output(self, command, *args):
+        """
+        Runs a git command writing `\\0` separated fields (e.g. `-z`)
+        and yields every field as soon as git writes it.
+        """
+        process = getattr(self.repo.git, command)(*args, as_process=True)
+        stdout = process.stdout
+        remainder = b''
+
+        try:
+            while True:
+                # `read1` returns what is available instead of waiting
+                # for the whole chunk
+                with tracer.span('git.read_output', command=command):
+                    chunk = stdout.read1(DIFF_READ_SIZE)
+
+                if not chunk:
+                    break
+
+                fields = (remainder + chunk).split(b'\0')
+                remainder = fields.pop()
+
+                for field in fields:
+                    yield field.decode(errors='surrogateescape')
+
+            # raises if git failed
+            process.wait()
+        finally:
+            if process.proc.poll() is None:
+                process.proc.kill()
+                process.proc.wait()
+            stdout.close()
+
+    def _iter_git_diffs(self):
+        """Diffs the target tree against the remote tree."""
+        args = ['--raw', '--no-abbrev', '-z']
+        if self.detect_renames:
+            args += ['--find-renames', '--find-copies']
+        else:
+            args.append('--no-renames')
+
+        args += [self.old_tree.hexsha, self.target_tree.hexsha]
+
+        # let git skip the ignored paths it can, instead of listing
+        # every file of the ignored directories
+        pathspecs = self.ignore_matcher.get_git_pathspecs()
+        if pathspecs:
+            args += ['--'] + pathspecs
+
+        diffs = self._iter_git_output('diff', *args)
 
         for entry in diffs:
             if not entry:
                 continue
 
-            status, file = entry, next(diffs)
+            # entries are formatted as
+            # `:old_mode new_mode old_sha1 new_sha1 status\0path`
+            header = entry
+            status = header.rsplit(' ', 1)[-1]
+
+            # renames and copies have a similarity score appended
+            # to their status and are followed by both of their paths
+            if status[:1] in ['R', 'C']:
+                yield from self._record_rename(
+                    status[0], header, next(diffs), next(diffs))
+                continue
+
+            file = next(diffs)
 
             if status not in ['A', 'M', 'D']:
                 raise UnexpectedDiffStatus(status)
 
-            if self.is_ignored(file):
-                continue
+            yield self._record_diff(status, file, header.split(' ')[3])
 
-            results.setdefault(status, [])
-            results[status].append(file)
+    def _iter_diffs(self):
+        """
+        Yields the changes to sync as `(status, file, sha1)`,
+        while they are being read, `sha1` being `None` for deletions.
+        """
+        if self.old_tree is None:
+            diffs = self._iter_manifest_diffs()
+        else:
+            diffs = self._iter_git_diffs()
 
-            logger.info('[%s] %s', status, file)
+        # the time spent waiting for git, not for the consumer of the diffs
+        seconds = count = 0
+        start = time.monotonic()
+
+        try:
+            for diff in diffs:
+                seconds += time.monotonic() - start
+
+                if diff is not None:
+                    count += 1
+                    self.stats.record_change(diff[0])
+                    yield diff
+
+                start = time.monotonic()
+        finally:
+            self.stats.record_stage('diff', seconds, count)
+
+    def _get_diffs(self):
+        # Diffs will be stored as {status: [file1, ..., file_n]}
+        # The aim is to make bulk requests to the API
+        results = {}
+
+        with tracer.span('sync.diff'):
+            for status, file, sha1_hash in self._iter_diffs():
+                results.setdefault(status, [])
+                results[status].append(file)
+
+                if status != 'D':
+                    self.blob_shas[file] = sha1_hash
 
         return results
 
+    def _get_blob_sha(self, path):
+        return self.blob_shas.get(path) or self.target_tree[path].hexsha
+
+    def _is_remote_up_to_date(self, path, sha1_hash):
+        if path not in self.remote_paths:
+            return False
+
+        if self.s3_settings.get_blob_sha(path) != sha1_hash:
+            return False
+
+        self.up_to_date_paths.append(path)
+        return True
+
+    def _upload_file(self, path, sha1_hash, mime_type=None):
+        # when reconciling, files are only uploaded
+        # if they are outdated on the remote
+        if (self.reconcile and self._is_remote_up_to_date(path, sha1_hash)) \
+                or self._resume_from_journal(path, sha1_hash):
+            # the content won't be read, e.g. by this section of a fan-out
+            self.blob_reader.release(sha1_hash)
+            return
+
+        start = time.monotonic()
+        fp = self._get_file_content(sha1_hash)
+
+        try:
+            size = fp.seek(0, os.SEEK_END)
+            fp.seek(0)
+            self.stats.record_stage(
+                'blob_read', time.monotonic() - start, size=size)
+
+            # the mime type is given when applying a plan
+            if mime_type is None:
+                with self.stats.measure('mime'):
+                    mime_type = self.mime_detector.detect(
+                        path, fp, sha1_hash)
+
+            content_encoding = None
+            if self.compressor and self.compressor.match(path, mime_type):
+                with self.stats.measure('compress', size=size):
+                    compressed_fp = self.compressor.compress(sha1_hash, fp)
+
+                if compressed_fp is not None:
+                    fp.close()
+                    fp = compressed_fp
+                    compressed_size = fp.seek(0, os.SEEK_END)
+                    fp.seek(0)
+                    content_encoding = self.compressor.encoding
+
+                    self.stats.record_saving(
+                        'compress', size - compressed_size)
+                    size = compressed_size
+
+            with self.stats.measure('upload', size=size):
+                mime_type = self.s3_settings.upload(
+                    fp, path, blob_sha=sha1_hash, mime_type=mime_type,
+                    content_encoding=content_encoding)
+            self.content_encodings[sha1_hash] = content_encoding
+        finally:
+            fp.close()
+
+        self._record_mime_type(path, mime_type)
+        self._record_in_journal(path, sha1_hash, mime_type)
+
+    def _resume_from_journal(self, path, sha1_hash):
+        """
+        Checks whether an interrupted sync already synced
+        this content to this path, in which case it is skipped.
+        """
+        if self.journal is None or not self.journal.is_synced(
+                path, sha1_hash):
+            return False
+
+        self._record_mime_type(path, self.journal.get_mime_type(path))
+        return True
+
+    def _record_mime_type(self, path, mime_type):
+        # the mime types are only needed by the manifest
+        if mime_type and self.use_manifest:
+            self.mime_types[path] = mime_type
+
+    def _record_in_journal(self, path, sha1_hash, mime_type):
+        if self.journal is not None:
+            self.journal.record(path, sha1_hash, mime_type)
+
+    @staticmethod
+    def _collect_errors(action, futures, done, errors):
+        for future in done:
+            path = futures.pop(future)
+            exc = future.exception()
+
+            if exc is not None:
+                logger.error('Failed to %s %s: %s', action, path, exc)
+                errors[path] = exc
+
+    def _run_in_pool(self, action, function, calls_args):
+        """
+        Calls `function(path, *args)` for every `(path, *args)`
+        of `calls_args` using a pool of `self.concurrency` workers,
+        as many of them as the throttle allows.
+
+        `calls_args` is consumed lazily, only a few calls per worker
+        are waiting at once: the calls start while it is still being read.
+
+        Every call is attempted, even if some of them fail;
+        the failures are then returned as {path: exception}.
+        """
+        errors = {}
+        futures = {}
+        max_pending = self.concurrency * (PENDING_TASKS_PER_WORKER + 1)
+
+        # instantiate the bucket resource before sharing it with the workers
+        self.s3_settings.bucket
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for call_args in calls_args:
+                if len(futures) >= max_pending:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    self._collect_errors(action, futures, done, errors)
+
+                future = executor.submit(
+                    self.throttle.call, function, *call_args)
+                futures[future] = call_args[0]
+
+            self._collect_errors(
+                action, futures, list(as_completed(futures)), errors)
+
+        return errors
+
+    def _upload_files(self, target_paths):
+        """
+        Uploads the given paths concurrently,
+        failures are raised all at once as `UploadFailed`.
+        """
+        # resolve the blob hashes beforehand, as the repository
+        # object database cannot be shared between threads
+        self._upload_contents(
+            (path, self._get_blob_sha(path)) for path in target_paths)
+
+    def _upload_contents(self, uploads):
+        """
+        Uploads the given `(path, sha1)` concurrently,
+        failures are raised all at once as `UploadFailed`.
+
+        Files sharing the same content are only uploaded once,
+        the others are then copied server-side from the uploaded file.
+        """
+        duplicates = []
+        self.up_to_date_paths = []
+
+        if self.reconcile and self.remote_paths is None:
+            self.remote_paths = self.s3_settings.list_files()
+
+        errors = self._run_in_pool(
+            'upload', self._upload_file,
+            self._iter_unique_contents(uploads, duplicates))
+
+        if errors:
+            raise UploadFailed(errors)
+
+        if self.reconcile:
+            logger.info(
+                '%d files are already up to date', len(self.up_to_date_paths))
+
+        if duplicates:
+            self._copy_files(duplicates)
+
+            saved_size = sum(
+                self.target_tree[path].size for path in duplicates)
+            logger.info(
+                'Copied %d duplicate files instead of uploading them, '
+                'saving %d bytes', len(duplicates), saved_size)
+
+    def _iter_unique_contents(self, uploads, duplicates):
+        """
+        Yields the `(path, sha1)` of `uploads` for the first path
+        of every content that was not uploaded yet, the other paths
+        are appended to `duplicates` to be copied from it.
+        """
+        for path, sha1_hash in uploads:
+            source = self.uploaded_blobs.setdefault(sha1_hash, path)
+
+            if source != path:
+                self.copy_sources[path] = source
+                self.blob_shas[path] = sha1_hash
+                duplicates.append(path)
+            else:
+                yield path, sha1_hash
+
+    def _copy_file(self, path, size=None):
+        source = self.copy_sources[path]
+        sha1_hash = self.blob_shas.get(path)
+
+        if self._resume_from_journal(path, sha1_hash):
+            return
+
+        # the copy keeps the mime type of its source, unless
+        # the mime type of the new path can be known without reading it
+        mime_type = self.mime_detector.guess(path, sha1_hash)
+
+        # replacing the mime type drops the content encoding of the source
+        content_encoding = None
+        if mime_type:
+            content_encoding = self._get_content_encoding(source, sha1_hash)
+
+        with self.stats.measure('copy'):
+            self.s3_settings.copy(
+                source, path, blob_sha=sha1_hash, mime_type=mime_type,
+                content_encoding=content_encoding, size=size)
+
+        mime_type = mime_type or self.mime_types.get(source)
+        self._record_mime_type(path, mime_type)
+        self._record_in_journal(path, sha1_hash, mime_type)
+
+    def _get_content_encoding(self, path, sha1_hash):
+        # the copies of the contents uploaded by this sync
+        # are copied from their upload
+        if sha1_hash in self.content_encodings:
+            return self.content_encodings[sha1_hash]
+
+        # the files synced by previous syncs may have been compressed,
+        # even if the compression is now disabled
+        return self.s3_settings.get_content_encoding(path)
+
+    def _copy_files(self, target_paths):
+        """
+        Copies the given paths from their remote source concurrently,
+        failures are raised all at once as `CopyFailed`.
+        """
+        # the sizes pick the part size of the big copies, they are
+        # read beforehand, as the repository object database
+        # cannot be shared between threads
+        errors = self._run_in_pool('copy', self._copy_file, [
+            (path, self.target_tree[path].size) for path in target_paths])
+
+        if errors:
+            raise CopyFailed(errors)
+
     def _upload_diffs(self, status, target_paths):
         if status in ['A', 'M']:
-            for path in target_paths:
-                fp = self._get_file_content(self.target_tree, path)
-                try:
-                    self.s3_settings.upload(fp, path)
-                finally:
-                    fp.close()
+            self._upload_files(target_paths)
+        elif status == 'C':
+            self._copy_files(target_paths)
         elif status == 'D':
             logger.info('Instructing to delete %d files', len(target_paths))
-            self.s3_settings.delete_files(target_paths)
+            self._delete_files(self._iter_delete_batches(target_paths))
         else:
             raise UnexpectedDiffStatus(status)
 
+    def _iter_delete_batches(self, paths):
+        batch_size = self.s3_settings.DELETE_MAX_COUNT_PER_REQUEST
+        batch = []
+
+        for path in paths:
+            batch.append(path)
+
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+
+    def _delete_batch(self, paths):
+        """
+        Deletes a batch of paths, retrying the keys S3 failed to delete.
+        The keys that still failed are returned as {path: error}.
+        """
+        attempt = 1
+
+        while True:
+            try:
+                with self.stats.measure('delete', count=len(paths)):
+                    errors = self.throttle.call(
+                        self.s3_settings.delete_files, paths)
+            except Exception as exc:
+                errors = dict.fromkeys(paths, exc)
+                break
+
+            if not errors or attempt >= self.throttle.max_attempts:
+                break
+
+            delay = get_retry_delay(attempt)
+            attempt += 1
+            logger.info(
+                'Retrying to delete %d files in %.2fs (attempt %d of %d)',
+                len(errors), delay, attempt, self.throttle.max_attempts)
+
+            time.sleep(delay)
+            paths = sorted(errors)
+
+        for path, error in sorted(errors.items()):
+            logger.error('Failed to delete %s: %s', path, error)
+        return errors
+
+    def _delete_files(self, batches):
+        """
+        Deletes the given batches of paths concurrently,
+        failures are raised all at once as `DeleteFailed`.
+
+        `batches` is consumed lazily, only a few batches
+        per worker are waiting at once.
+        """
+        errors = {}
+        pending = []
+        max_pending = DELETE_CONCURRENCY * PENDING_DELETE_BATCHES
+
+        with ThreadPoolExecutor(max_workers=DELETE_CONCURRENCY) as executor:
+            for batch in batches:
+                if len(pending) >= max_pending:
+                    errors.update(pending.pop(0).result())
+                pending.append(executor.submit(self._delete_batch, batch))
+
+            for future in pending:
+                errors.update(future.result())
+
+        if errors:
+            raise DeleteFailed(errors)
+
+    def _iter_uploads(self, diffs, deletions: Queue):
+        """
+        Yields the `(path, sha1)` to upload from the given diffs,
+        the deleted paths are put by batches in `deletions` meanwhile.
+        """
+        deleted_paths = []
+
+        # the diff stage lasts until the whole diff is read,
+        # while the uploads and deletions are going on
+        with tracer.span('sync.diff'):
+            for status, path, sha1_hash in diffs:
+                if status in ['A', 'M']:
+                    yield path, sha1_hash
+                    continue
+
+                if status != 'D':
+                    raise UnexpectedDiffStatus(status)
+
+                deleted_paths.append(path)
+                if len(deleted_paths) >= \
+                        self.s3_settings.DELETE_MAX_COUNT_PER_REQUEST:
+                    # blocks while the previous batches are waiting
+                    deletions.put(deleted_paths)
+                    deleted_paths = []
+
+        if deleted_paths:
+            deletions.put(deleted_paths)
+
+    def _sync_diffs(self, diffs):
+        """
+        Syncs the given diffs while they are being read: files are uploaded
+        as soon as they are listed, and deleted by batches in background.
+        """
+        deletions = Queue(maxsize=DELETE_CONCURRENCY * PENDING_DELETE_BATCHES)
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            deleting = executor.submit(
+                self._delete_files, iter(deletions.get, None))
+
+            try:
+                self._upload_contents(self._iter_uploads(diffs, deletions))
+            finally:
+                # stops the deletions once every batch was sent
+                deletions.put(None)
+
+            deleting.result()
+
+    def _build_manifest(self):
+        old_files = self.remote_manifest.files if self.remote_manifest else {}
+        files = {}
+
+        for path, (sha1_hash, size) in self._list_target_files().items():
+            if self.is_ignored(path):
+                continue
+
+            mime_type = self.mime_types.get(path)
+
+            # the file was not uploaded, keep its previously known mime type
+            if mime_type is None:
+                old_entry = old_files.get(self.copy_sources.get(path, path))
+                if old_entry and old_entry.sha1 == sha1_hash:
+                    mime_type = old_entry.mime_type
+
+            files[path] = ManifestEntry(sha1_hash, size, mime_type)
+
+        return Manifest(self.target_tree.hexsha, files)
+
+    def _upload_manifest(self):
+        with self.stats.measure('manifest'), BytesIO() as fp:
+            self._build_manifest().dump(fp)
+            fp.seek(0)
+            self.s3_settings.upload(fp, MANIFEST_FILE_NAME)
+
     def _upload_new_commit_value(self):
-        with BytesIO(self.target_tree.hexsha.encode()) as fp:
+        with self.stats.measure('rev'), \
+                BytesIO(self.target_tree.hexsha.encode()) as fp:
             self.s3_settings.upload(fp, REV_FILE_NAME)
 
-    def synchronize(self):
+    def _is_up_to_date(self):
+        if self.old_tree is None:
+            return self.remote_manifest.revision == self.target_tree.hexsha
+        return self.old_tree == self.target_tree
+
+    def _open_journal(self, old_revision):
+        """
+        Opens the journal of the sync, identified by its location
+        and revisions so only the same sync can be resumed.
+        """
+        sync_id = '{bucket}/{location} {old}..{new}'.format(
+            bucket=self.s3_settings.S3_BUCKET_NAME,
+            location=self.s3_settings.get_target_path(''),
+            old=old_revision, new=self.target_tree.hexsha)
+
+        return SyncJournal.open(
+            get_cache_path(self.repo, self.journal_name), sync_id)
+
+    def _run(self, function, *args):
+        """
+        Runs a sync through `function(*args)`, the statistics and traces
+        of the sync are written to `stats_path` and `trace_path`
+        even if it fails.
+        """
+        self.stats.start(
+            bucket=self.s3_settings.S3_BUCKET_NAME,
+            location=self.s3_settings.get_target_path(''),
+            target_revision=self.target_tree.hexsha,
+            concurrency=self.concurrency)
+
+        # the requests sent by the transfers go through the bucket's client
+        client = self.s3_settings.bucket.meta.client
+        self.stats.watch_client(client)
+        self.throttle.watch_client(client)
+
+        if self.trace_path:
+            tracer.start()
+
+        try:
+            with tracer.span('sync'):
+                function(*args)
+        except BaseException as exc:
+            self.stats.stop(exc)
+            raise
+        else:
+            self.stats.stop()
+        finally:
+            self.stats.unwatch_client(client)
+            self.throttle.unwatch_client(client)
+
+            # the sync keeps its bucket, the pool can forget its client
+            RESOURCE_POOL.release(self.s3_settings.pool_scope)
+            if self.stats_path:
+                self.stats.dump(self.stats_path)
+
+            if self.trace_path:
+                tracer.stop()
+                tracer.dump(self.trace_path)
+
+    def synchronize(self, diffs=None):
+        """
+        Syncs the target revision, `diffs` being the changes
+        to sync as {status: [paths]} if they were computed beforehand.
+        """
+        self._run(self._synchronize, diffs)
+
+    def _synchronize(self, diffs=None):
+        old_revision = self._get_old_revision()
+        self.stats.info['old_revision'] = old_revision
+
         logger.info(
             'Starting to sync from {} to {}'.format(
-                self.old_tree, self.target_tree))
+                old_revision, self.target_tree))
+
+        if self._is_up_to_date():
+            raise RemoteUpToDate(())
 
-        if self.old_tree == self.target_tree:
+        self.journal = self._open_journal(old_revision)
+
+        try:
+            if diffs is None and self.detect_renames:
+                diffs = self._get_diffs()
+
+            if diffs is not None:
+                # the copies must happen before their source is
+                # changed or deleted, which can be listed first by git
+                for status, target_paths in sorted(
+                        diffs.items(),
+                        key=lambda item: DIFF_STATUS_ORDER.index(item[0])):
+                    self._upload_diffs(status, target_paths)
+            else:
+                self._sync_diffs(self._iter_diffs())
+
+            if self.use_manifest:
+                self._upload_manifest()
+
+            self._upload_new_commit_value()
+
+            # the sync is complete, there is nothing to resume anymore
+            self.journal.discard()
+        finally:
+            self.journal.close()
+            self.blob_reader.close()
+            self.mime_detector.save()
+
+    def _get_old_revision(self):
+        if self.old_tree is None:
+            return self.remote_manifest.revision
+        return self.old_tree.hexsha
+
+    def plan(self) -> SyncPlan:
+        """
+        Computes the requests of the sync without sending them,
+        the contents are read beforehand to get their mime type.
+        """
+        if self._is_up_to_date():
             raise RemoteUpToDate(())
 
-        for status, target_paths in self._get_diffs().items():
-            self._upload_diffs(status, target_paths)
+        # the plan is checked against the remote revision the changes
+        # were computed from, a forced reupload does not depend on it
+        remote_revision = self.remote_revision
+        if self.force_reupload:
+            remote_revision = self._get_s3_current_commit()
+
+        try:
+            diffs = self._get_diffs()
+            uploads = []
+            duplicates = []
+            sizes = {
+                sha1_hash: size
+                for sha1_hash, size in self._list_target_files().values()}
+
+            # the copies are planned from their source's content
+            copies = [
+                PlannedCopy(
+                    path, self.copy_sources[path], self.blob_shas[path],
+                    sizes[self.blob_shas[path]])
+                for path in diffs.get('C', [])]
+
+            for path in diffs.get('A', []) + diffs.get('M', []):
+                sha1_hash = self._get_blob_sha(path)
+                source = self.uploaded_blobs.setdefault(sha1_hash, path)
+
+                if source != path:
+                    duplicates.append(PlannedCopy(
+                        path, source, sha1_hash, sizes[sha1_hash]))
+                    continue
+
+                mime_type = self.mime_detector.guess(path, sha1_hash)
+                if mime_type is None:
+                    fp = self._get_file_content(sha1_hash)
+                    try:
+                        mime_type = self.mime_detector.detect(
+                            path, fp, sha1_hash)
+                    finally:
+                        fp.close()
+
+                uploads.append(PlannedUpload(
+                    path, sha1_hash, sizes[sha1_hash], mime_type))
+        finally:
+            self.blob_reader.close()
+            self.mime_detector.save()
+            RESOURCE_POOL.release(self.s3_settings.pool_scope)
+
+        plan = SyncPlan(
+            self.s3_settings.S3_BUCKET_NAME,
+            self.s3_settings.get_target_path(''),
+            remote_revision, self._get_old_revision(),
+            self.target_tree.hexsha, uploads=uploads, copies=copies,
+            duplicates=duplicates, deletions=diffs.get('D', []),
+            use_manifest=bool(self.use_manifest))
+
+        plan.estimate = estimate_plan(
+            plan, self.s3_settings.get_transfer_config,
+            self.s3_settings.DELETE_MAX_COUNT_PER_REQUEST)
+        return plan
+
+    def _check_plan(self, plan: SyncPlan):
+        location = (
+            self.s3_settings.S3_BUCKET_NAME,
+            self.s3_settings.get_target_path(''))
+
+        if (plan.bucket, plan.location) != location:
+            raise InvalidPlan(
+                'it was planned for another location (%s/%s)' % (
+                    plan.bucket, plan.location))
+
+        if self._get_s3_current_commit() != plan.remote_revision:
+            raise InvalidPlan(
+                'the remote revision changed since it was planned')
+
+    def apply(self, plan: SyncPlan):
+        """
+        Syncs the changes of a plan, as long as the remote revision
+        did not change since it was planned.
+        """
+        self._check_plan(plan)
+        self.target_tree = self.get_tree(plan.target_revision)
+        self.use_manifest = plan.use_manifest
+
+        # the manifest keeps the mime types of the files left untouched
+        if self.use_manifest and self.remote_manifest is None \
+                and plan.remote_revision:
+            self.remote_manifest = self._get_remote_manifest(
+                plan.remote_revision)
+
+        self._run(self._apply, plan)
+
+    def _apply(self, plan: SyncPlan):
+        logger.info(
+            'Applying the plan from {} to {}'.format(
+                plan.old_revision, plan.target_revision))
+
+        self.journal = self._open_journal(plan.old_revision)
+
+        for copy in plan.copies + plan.duplicates:
+            self.copy_sources[copy.path] = copy.source
+            self.blob_shas[copy.path] = copy.sha1
+
+        try:
+            if plan.copies:
+                self._copy_files([copy.path for copy in plan.copies])
+
+            errors = self._run_in_pool('upload', self._upload_file, [
+                (upload.path, upload.sha1, upload.mime_type)
+                for upload in plan.uploads])
+
+            if errors:
+                raise UploadFailed(errors)
+
+            if plan.duplicates:
+                self._copy_files([copy.path for copy in plan.duplicates])
+
+            if plan.deletions:
+                self._delete_files(self._iter_delete_batches(plan.deletions))
+
+            if self.use_manifest:
+                self._upload_manifest()
 
-        self._upload_new_commit_value()
+            self._upload_new_commit_value()
+            self.journal.discard()
+        finally:
+            self.journal.close()
+            self.blob_reader.close()
+            self.mime_detector.save()
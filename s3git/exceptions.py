@@ -18,10 +18,22 @@ class MissingSectionConfigurationFile(ConfigurationError):
     MSG = '%s is missing an usable section'
 
 
+class UnknownConfigurationSection(ConfigurationError):
+    MSG = '%s has no section named %s'
+
+
 class RequiredValueMissingInConfigurationFile(ConfigurationError):
     MSG = '%s is missing the required option %s'
 
 
+class InvalidValueInConfigurationFile(ConfigurationError):
+    MSG = '%s has an invalid value for the option %s: %s'
+
+
+class MissingDependency(ConfigurationError):
+    MSG = '%s requires the %s package, which is not installed.'
+
+
 class RepoError(BaseError):
     pass
 
@@ -38,3 +50,38 @@ class RemoteUpToDate(RepoError):
 class UnexpectedDiffStatus(RepoError):
     MSG = 'The program received an unexpected diff status (%s) from git. ' \
           'This may be a bug, please report it to us.'
+
+
+class MissingGitObject(RepoError):
+    MSG = 'Cannot read the git object %s.'
+
+
+class SyncError(BaseError):
+    pass
+
+
+class TransferFailed(SyncError):
+    def __init__(self, errors):
+        # errors are stored as {path: exception}
+        self.errors = errors
+        super().__init__((len(errors), ', '.join(sorted(errors))))
+
+
+class UploadFailed(TransferFailed):
+    MSG = 'Failed to upload %d file(s): %s'
+
+
+class CopyFailed(TransferFailed):
+    MSG = 'Failed to copy %d file(s): %s'
+
+
+class DeleteFailed(TransferFailed):
+    MSG = 'Failed to delete %d file(s): %s'
+
+
+class InvalidPlan(SyncError):
+    MSG = 'The sync plan cannot be applied: %s.'
+
+
+class FanOutFailed(TransferFailed):
+    MSG = 'Failed to sync to %d section(s): %s'
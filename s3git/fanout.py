@@ -0,0 +1,158 @@
+import json
+import logging
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Union
+
+from s3git.blobs import SharedBlobCache
+from s3git.core import (
+    DIRTY_CHECK_OFF, DIRTY_CHECK_TRACKED, JOURNAL_FILE_NAME, S3GitSync)
+from s3git.exceptions import *
+from s3git.s3 import RESOURCE_POOL
+from s3git.stats import REPORT_VERSION
+from s3git.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+def _get_journal_name(section):
+    # the section names may contain characters unsafe for file names
+    return '%s-%s' % (JOURNAL_FILE_NAME, re.sub(r'[^\w.-]', '_', section))
+
+
+class FanOutSync:
+    """
+    Syncs a revision to the locations of several sections
+    of the configuration file at once.
+
+    Every section is synced from its own remote revision, concurrently,
+    but the blobs are read from git and their mime type is detected
+    once for all the sections.
+    """
+
+    def __init__(
+            self, branch: Union[str, None], sections: List[str],
+            stats_path=None, trace_path=None,
+            dirty_check=DIRTY_CHECK_TRACKED, **kwargs):
+
+        # every section has its own sync, with its own settings,
+        # journal and statistics; the repository is only checked once
+        self.targets = OrderedDict(
+            (section, S3GitSync(
+                branch, section=section,
+                dirty_check=DIRTY_CHECK_OFF if index else dirty_check,
+                **kwargs))
+            for index, section in enumerate(sections))
+
+        first_target = next(iter(self.targets.values()))
+        self.blob_reader = first_target.blob_reader
+        self.blob_cache = SharedBlobCache(self.blob_reader)
+        self.mime_detector = first_target.mime_detector
+
+        for section, target in self.targets.items():
+            target.blob_reader = self.blob_cache
+            target.mime_detector = self.mime_detector
+            target.journal_name = _get_journal_name(section)
+
+        self.stats_path = stats_path
+        self.trace_path = trace_path
+        self.up_to_date_sections = []
+
+    def _get_outdated_targets(self):
+        targets = OrderedDict()
+
+        for section, target in self.targets.items():
+            if target._is_up_to_date():
+                logger.info('[%s] %s', section, RemoteUpToDate.MSG)
+                self.up_to_date_sections.append(section)
+            else:
+                targets[section] = target
+
+        return targets
+
+    def _get_diffs(self, targets):
+        """
+        Lists the changes to sync to every section, as
+        {section: {status: [paths]}}, and announces the contents
+        every section is going to read.
+        """
+        diffs = {}
+
+        for section, target in targets.items():
+            logger.info('Listing the changes to sync to %s', section)
+            diffs[section] = target._get_diffs()
+
+            # the contents are read once per section, even if duplicated
+            sha1_hashes = {
+                target._get_blob_sha(path)
+                for status in ('A', 'M')
+                for path in diffs[section].get(status, [])}
+
+            for sha1_hash in sha1_hashes:
+                self.blob_cache.expect(sha1_hash)
+
+        return diffs
+
+    def _synchronize(self):
+        targets = self._get_outdated_targets()
+        if not targets:
+            raise RemoteUpToDate(())
+
+        errors = {}
+
+        try:
+            diffs = self._get_diffs(targets)
+
+            with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+                futures = {
+                    executor.submit(target.synchronize, diffs[section]):
+                        section
+                    for section, target in targets.items()}
+
+                for future in as_completed(futures):
+                    section = futures[future]
+                    exc = future.exception()
+
+                    if exc is not None:
+                        logger.error('Failed to sync to %s: %s', section, exc)
+                        errors[section] = exc
+        finally:
+            self.blob_cache.clear()
+            self.blob_reader.close()
+            self.mime_detector.save()
+
+        if errors:
+            raise FanOutFailed(errors)
+
+    def synchronize(self):
+        if self.trace_path:
+            tracer.start()
+
+        try:
+            self._synchronize()
+        finally:
+            # the up to date sections never synced, thus never released
+            # their client from the pool
+            for target in self.targets.values():
+                RESOURCE_POOL.release(target.s3_settings.pool_scope)
+
+            if self.stats_path:
+                self._dump_stats(self.stats_path)
+
+            if self.trace_path:
+                tracer.stop()
+                tracer.dump(self.trace_path)
+
+    def _dump_stats(self, path):
+        # the statistics of every synced section
+        data = {
+            'version': REPORT_VERSION,
+            'up_to_date_sections': self.up_to_date_sections,
+            'sections': {
+                section: target.stats.as_dict()
+                for section, target in self.targets.items()
+                if section not in self.up_to_date_sections}}
+
+        with open(path, 'w') as fp:
+            json.dump(data, fp, indent=2)
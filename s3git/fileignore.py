@@ -2,7 +2,8 @@ import fnmatch
 import logging
 import re
 from os.path import isfile
-from typing import Callable, List, Pattern, Sequence, TextIO, Tuple
+from typing import (
+    Callable, Dict, List, Pattern, Sequence, TextIO, Tuple)
 
 T_PARSER_CALLABLE = Callable[[str], Pattern]
 REGEX_PARSER = re.compile
@@ -62,3 +63,250 @@ def retrieve_ignore_patterns(
     with open(path) as fp:
         patterns = compile_ignore_file(fp, parser)
         return patterns
+
+
+REGEX_SPECIAL_CHARS = frozenset('.^$*+?{}[]\\|()')
+REGEX_QUANTIFIERS = frozenset('*+?{')
+MATCH_ANYTHING = ('.*', '.*?')
+DEFAULT_REGEX_FLAGS = re.compile('').flags
+
+GIT_EXCLUDE_PATHSPEC = ':(top,exclude,glob)%s'
+GIT_GLOB_SPECIAL_CHARS = re.compile(r'([*?\[\\])')
+
+
+def _split_literal_prefix(source: str) -> Tuple[str, str]:
+    """
+    Splits a regex into the literal text every match starts with,
+    and the remaining regex.
+    """
+    literal = []
+    position = 0
+
+    while position < len(source):
+        char = source[position]
+        next_position = position + 1
+
+        if char == '\\':
+            # only escaped punctuation is literal, e.g. `\.` but not `\d`
+            if next_position == len(source) or source[next_position].isalnum():
+                break
+            char = source[next_position]
+            next_position += 1
+        elif char in REGEX_SPECIAL_CHARS:
+            break
+
+        # a quantified character is not always part of the match
+        if source[next_position:next_position + 1] in REGEX_QUANTIFIERS:
+            break
+
+        literal.append(char)
+        position = next_position
+
+    return ''.join(literal), source[position:]
+
+
+def _has_alternation(source: str) -> bool:
+    escaped = False
+
+    for char in source:
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == '|':
+            return True
+    return False
+
+
+def _escape_glob(text: str) -> str:
+    return GIT_GLOB_SPECIAL_CHARS.sub(r'\\\1', text)
+
+
+def _unwrap_pattern(source: str) -> Tuple[str, bool]:
+    """
+    Removes the end anchor of a regex,
+    including the wrapping added by `fnmatch.translate`.
+
+    Returns the unwrapped regex and whether it was anchored to the end.
+    """
+    # `(?s:...)\Z` since python 3.6 and `...\Z(?ms)` before
+    if source.startswith('(?s:') and source.endswith(')\\Z'):
+        return source[4:-3], True
+    if source.endswith('\\Z(?ms)'):
+        return source[:-7], True
+
+    if source.endswith('$') and not source.endswith('\\$'):
+        return source[:-1], True
+    if source.endswith('\\Z') and not source.endswith('\\\\Z'):
+        return source[:-2], True
+    return source, False
+
+
+class IgnoreMatcher:
+    """
+    Matches paths against a list of ignore patterns at once,
+    with the same results as trying `pattern.match` for every pattern.
+
+    Simple patterns are indexed: directories or prefixes
+    (e.g. `build/.*`), extensions (e.g. `*.pyc`) and exact paths.
+    The other patterns are combined into a single regex
+    per first literal character.
+
+    The indexed patterns, except exact paths, are also translated
+    to git pathspecs, see `get_git_pathspecs`.
+    """
+
+    def __init__(self, patterns: Sequence[Pattern]):
+        self.patterns = list(patterns)
+
+        self._exact_paths = set()
+        self._directories = set()
+        self._prefixes = set()
+        self._extensions = set()
+        self._suffixes = set()
+        self._pathspecs = []  # type: List[str]
+
+        # regexes of the other patterns, as {first character: patterns}
+        # and the patterns that can start by any character
+        self._regexes = {}  # type: Dict[str, List[Pattern]]
+        self._any_start_regexes = []  # type: List[Pattern]
+
+        for pattern in self.patterns:
+            self._index_pattern(pattern)
+
+        self._regexes = {
+            char: self._combine(patterns)
+            for char, patterns in self._regexes.items()}
+        self._any_start_regexes = self._combine(self._any_start_regexes)
+
+        self._prefixes = tuple(self._prefixes)
+        self._suffixes = tuple(self._suffixes)
+
+    def _index_pattern(self, pattern: Pattern):
+        source, is_anchored = _unwrap_pattern(pattern.pattern)
+
+        if pattern.flags & (re.IGNORECASE | re.VERBOSE) \
+                or _has_alternation(source):
+            self._any_start_regexes.append(pattern)
+            return
+
+        prefix, rest = _split_literal_prefix(source)
+
+        # as patterns only match from the start of the paths,
+        # `prefix.*` (or `prefix` if not anchored) matches every path
+        # starting by the prefix
+        if rest in MATCH_ANYTHING or (not rest and not is_anchored):
+            if prefix.endswith('/'):
+                self._directories.add(prefix)
+                self._add_pathspecs(_escape_glob(prefix) + '**')
+            else:
+                self._prefixes.add(prefix)
+                # `*` does not go through slashes in git globs
+                self._add_pathspecs(
+                    _escape_glob(prefix) + '*', _escape_glob(prefix) + '*/**')
+            return
+
+        if not rest:
+            self._exact_paths.add(prefix)
+            return
+
+        if not prefix and is_anchored:
+            for match_anything in MATCH_ANYTHING:
+                suffix, suffix_rest = _split_literal_prefix(
+                    rest[len(match_anything):])
+
+                if rest.startswith(match_anything) and not suffix_rest:
+                    self._index_suffix(suffix)
+                    return
+
+        if prefix:
+            self._regexes.setdefault(prefix[0], []).append(pattern)
+        else:
+            self._any_start_regexes.append(pattern)
+
+    def _index_suffix(self, suffix: str):
+        if suffix.startswith('.') and not any(c in suffix[1:] for c in './'):
+            self._extensions.add(suffix)
+        else:
+            self._suffixes.add(suffix)
+
+        # `**/` matches any leading directories, including none
+        self._add_pathspecs('**/*' + _escape_glob(suffix))
+
+    def _add_pathspecs(self, *globs: str):
+        self._pathspecs.extend(GIT_EXCLUDE_PATHSPEC % glob for glob in globs)
+
+    def get_git_pathspecs(self) -> List[str]:
+        """
+        Gets the pathspecs excluding the indexed patterns from git commands,
+        relative to the root of the repository.
+
+        Exact paths are left out, as git pathspecs also match
+        the content of the directories they name.
+        Paths containing line feeds may also be excluded by git
+        while some regexes would not match them: `match` is still
+        the reference for every path git returns.
+        """
+        return list(self._pathspecs)
+
+    @staticmethod
+    def _combine(patterns: List[Pattern]) -> List[Pattern]:
+        """
+        Combines patterns into a single regex. Patterns with flags or groups
+        are kept as they are, as they could change the other patterns
+        (e.g. inline flags or group references).
+        """
+        combinable = [
+            pattern for pattern in patterns
+            if pattern.flags == DEFAULT_REGEX_FLAGS and not pattern.groups]
+        others = [pattern for pattern in patterns if pattern not in combinable]
+
+        if len(combinable) < 2:
+            return patterns
+
+        try:
+            combined = re.compile('|'.join(
+                '(?:%s)' % pattern.pattern for pattern in combinable))
+        except re.error:
+            return patterns
+        return [combined] + others
+
+    def _match_indexes(self, path: str) -> bool:
+        if path in self._exact_paths or path.startswith(self._prefixes):
+            return True
+
+        if path.endswith(self._suffixes):
+            return True
+
+        extension_position = path.rfind('.')
+        if extension_position >= 0 and path[extension_position:] in \
+                self._extensions:
+            return True
+
+        # check every parent directory of the path, from the root
+        position = path.find('/')
+        while position >= 0:
+            if path[:position + 1] in self._directories:
+                return True
+            position = path.find('/', position + 1)
+
+        return False
+
+    def match(self, path: str) -> bool:
+        # the indexes do not handle the specific behaviors of line feeds
+        # (e.g. `.` does not match them), fallback to a complete check
+        if '\n' in path:
+            return any(pattern.match(path) for pattern in self.patterns)
+
+        if self._match_indexes(path):
+            return True
+
+        for pattern in self._regexes.get(path[:1], ()):
+            if pattern.match(path):
+                return True
+
+        for pattern in self._any_start_regexes:
+            if pattern.match(path):
+                return True
+
+        return False
@@ -0,0 +1,118 @@
+import json
+import logging
+import os
+import threading
+from typing import Union
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_VERSION = 1
+
+
+class SyncJournal:
+    """
+    Records the files synced to a bucket while syncing
+    from a revision to another, as {path: (blob sha1, mime type)}.
+
+    When a sync is interrupted, the next sync of the same revisions
+    to the same location reads the journal back and skips
+    the files that were already synced. Only these entries are kept
+    in memory, the new entries are written to the journal.
+
+    The journal can be shared between threads.
+    """
+
+    def __init__(self, path: str, sync_id: str):
+        self.path = path
+        self.sync_id = sync_id
+
+        self.entries = {}
+        self._fp = None
+
+        # the size of the complete lines of the loaded journal
+        self._loaded_size = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path: str, sync_id: str):
+        """
+        Opens the journal stored at `path`, resuming its entries
+        if it was written by the same sync, otherwise starting a new one.
+        """
+        journal = cls(path, sync_id)
+        journal._load()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        if journal.entries:
+            logger.info(
+                'Resuming the previous sync, %d files are already synced',
+                len(journal.entries))
+            journal._fp = open(path, 'a')
+
+            # drop a partially written last line,
+            # for the next entries not to be appended to it
+            journal._fp.truncate(journal._loaded_size)
+        else:
+            journal._fp = open(path, 'w')
+            journal._write({'version': JOURNAL_VERSION, 'sync': sync_id})
+
+        return journal
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return
+
+        with open(self.path, 'rb') as fp:
+            header = fp.readline()
+            try:
+                if json.loads(header.decode()) != {
+                        'version': JOURNAL_VERSION, 'sync': self.sync_id}:
+                    return
+            except ValueError:
+                return
+
+            size = len(header)
+
+            for line in fp:
+                # the last line may have been partially written
+                if not line.endswith(b'\n'):
+                    break
+                size += len(line)
+
+                try:
+                    path, sha1_hash, mime_type = json.loads(line.decode())
+                except (TypeError, ValueError):
+                    continue
+                self.entries[path] = (sha1_hash, mime_type)
+
+        self._loaded_size = size
+
+    def _write(self, data):
+        # every line is flushed to survive the process being killed
+        self._fp.write(json.dumps(data) + '\n')
+        self._fp.flush()
+
+    def is_synced(self, path: str, sha1_hash: str) -> bool:
+        entry = self.entries.get(path)
+        return entry is not None and entry[0] == sha1_hash
+
+    def get_mime_type(self, path: str):
+        return self.entries[path][1]
+
+    def record(
+            self, path: str, sha1_hash: str, mime_type: Union[str, None]):
+        with self._lock:
+            self._write([path, sha1_hash, mime_type])
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+    def discard(self):
+        """Closes and removes the journal, once the sync is complete."""
+        self.close()
+
+        if os.path.isfile(self.path):
+            os.remove(self.path)
@@ -0,0 +1,53 @@
+import gzip
+import json
+from collections import namedtuple
+from typing import BinaryIO, Dict
+
+MANIFEST_FILE_NAME = '.s3git-manifest'
+MANIFEST_VERSION = 1
+
+ManifestEntry = namedtuple('ManifestEntry', ('sha1', 'size', 'mime_type'))
+
+
+class Manifest:
+    """
+    Describes the files stored on a bucket after a given revision
+    was synced, as {path: (blob sha1, size, mime type)}.
+
+    It allows to compute the changes to sync without needing
+    the synced revision to be in the local repository.
+    """
+
+    def __init__(self, revision: str, files: Dict[str, ManifestEntry]=None):
+        self.revision = revision
+        self.files = files or {}
+
+    def dump(self, fp: BinaryIO):
+        """Writes the manifest as gzipped JSON into a binary file object."""
+        data = {
+            'version': MANIFEST_VERSION,
+            'revision': self.revision,
+            'files': self.files}
+
+        with gzip.GzipFile(fileobj=fp, mode='wb') as gzip_fp:
+            gzip_fp.write(json.dumps(data, separators=(',', ':')).encode())
+
+    @classmethod
+    def load(cls, fp: BinaryIO):
+        """
+        Reads a manifest written by `dump`,
+        or returns `None` if the manifest cannot be used.
+        """
+        try:
+            with gzip.GzipFile(fileobj=fp, mode='rb') as gzip_fp:
+                data = json.loads(gzip_fp.read().decode())
+        except (OSError, ValueError):
+            return None
+
+        if data.get('version') != MANIFEST_VERSION:
+            return None
+
+        files = {
+            path: ManifestEntry(*entry)
+            for path, entry in data['files'].items()}
+        return cls(data['revision'], files)
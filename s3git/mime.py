@@ -0,0 +1,110 @@
+import logging
+import mimetypes
+import os
+import threading
+from typing import TYPE_CHECKING, BinaryIO, Union
+
+from s3git.tracing import tracer
+
+if TYPE_CHECKING:
+    from magic import Magic
+
+logger = logging.getLogger(__name__)
+
+MIME_TYPE_READ_SIZE = 1024
+
+
+class MimeTypeDetector:
+    """
+    Detects the mime type of files, from their extension when it is known,
+    otherwise from their content through libmagic.
+
+    The mime types detected from the content are cached by blob hash,
+    and can be persisted to `cache_path` to be reused by the next syncs.
+
+    The detector can be shared between threads.
+    """
+
+    def __init__(self, cache_path: Union[str, None]=None):
+        self.cache_path = cache_path
+
+        # the mime types detected from the content, as {sha1: mime type}
+        self._cache = {}
+        self._new_entries = {}
+        self._lock = threading.Lock()
+
+        # libmagic instances cannot be shared between threads
+        self._local = threading.local()
+
+        if cache_path:
+            self._load_cache()
+
+    def _load_cache(self):
+        if not os.path.isfile(self.cache_path):
+            return
+
+        # every line is formatted as `sha1 mime_type`
+        with open(self.cache_path) as fp:
+            for line in fp:
+                entry = line.split()
+                if len(entry) == 2:
+                    self._cache[entry[0]] = entry[1]
+
+    def save(self):
+        """Appends the newly detected mime types to the cache file."""
+        with self._lock:
+            new_entries, self._new_entries = self._new_entries, {}
+
+            if not self.cache_path or not new_entries:
+                return
+
+            # the lock is held while writing, for detectors
+            # shared between several syncs
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            with open(self.cache_path, 'a') as fp:
+                for sha1_hash, mime_type in new_entries.items():
+                    fp.write('%s %s\n' % (sha1_hash, mime_type))
+
+    def _get_magic(self) -> 'Magic':
+        magic = getattr(self._local, 'magic', None)
+
+        if magic is None:
+            # libmagic is only loaded when a content needs sniffing
+            from magic import Magic
+            magic = self._local.magic = Magic(mime=True)
+        return magic
+
+    def guess(self, path: str, blob_sha: Union[str, None]=None):
+        """
+        Gets the mime type of a file without reading its content,
+        or `None` if it cannot be guessed.
+        """
+        mime_type, encoding = mimetypes.guess_type(path, strict=False)
+
+        # encoded files (e.g. `.tar.gz`) are described by their encoding,
+        # which is better left to libmagic
+        if mime_type and not encoding:
+            return mime_type
+
+        if blob_sha:
+            with self._lock:
+                return self._cache.get(blob_sha)
+        return None
+
+    def detect(
+            self, path: str, fp: BinaryIO, blob_sha: Union[str, None]=None):
+        """Gets the mime type of a file, sniffing its content if needed."""
+        mime_type = self.guess(path, blob_sha)
+
+        if mime_type is None:
+            with tracer.span('mime.sniff', path=path):
+                mime_type = self._get_magic().from_buffer(
+                    fp.read(MIME_TYPE_READ_SIZE))
+            fp.seek(0)
+
+            if blob_sha:
+                with self._lock:
+                    self._cache[blob_sha] = self._new_entries[blob_sha] = \
+                        mime_type
+
+        return mime_type
@@ -0,0 +1,162 @@
+import json
+import math
+from collections import Counter, namedtuple
+from typing import TYPE_CHECKING, Callable, List, TextIO
+
+from s3git.exceptions import InvalidPlan
+
+if TYPE_CHECKING:
+    from boto3.s3.transfer import TransferConfig
+
+PLAN_VERSION = 1
+
+# rough prices of S3 Standard (us-east-1) requests, in USD per request;
+# incoming transfers and deletions are free
+PUT_REQUEST_PRICE = 0.005 / 1000
+GET_REQUEST_PRICE = 0.0004 / 1000
+
+PUT_REQUEST_TYPES = frozenset((
+    'PutObject', 'CopyObject', 'CreateMultipartUpload', 'UploadPart',
+    'UploadPartCopy', 'CompleteMultipartUpload'))
+GET_REQUEST_TYPES = frozenset(('HeadObject',))
+
+PlannedUpload = namedtuple(
+    'PlannedUpload', ('path', 'sha1', 'size', 'mime_type'))
+PlannedCopy = namedtuple('PlannedCopy', ('path', 'source', 'sha1', 'size'))
+
+
+class SyncPlan:
+    """
+    Describes the requests of a sync computed beforehand,
+    to be reviewed and then applied as it is.
+
+    The sync is applied in this order: the `copies` of renamed files
+    from their previous remote location, the `uploads`, the copies of
+    the `duplicates` from the uploaded files, and the `deletions`.
+    """
+
+    def __init__(
+            self, bucket: str, location: str, remote_revision: str,
+            old_revision: str, target_revision: str,
+            uploads: List[PlannedUpload]=None,
+            copies: List[PlannedCopy]=None,
+            duplicates: List[PlannedCopy]=None,
+            deletions: List[str]=None, use_manifest=False, estimate=None):
+        self.bucket = bucket
+        self.location = location
+
+        # the revision read from the bucket, which must not change
+        # until the plan is applied
+        self.remote_revision = remote_revision
+        self.old_revision = old_revision
+        self.target_revision = target_revision
+
+        self.uploads = uploads or []
+        self.copies = copies or []
+        self.duplicates = duplicates or []
+        self.deletions = deletions or []
+        self.use_manifest = use_manifest
+        self.estimate = estimate
+
+    def dump(self, fp: TextIO):
+        data = {
+            'version': PLAN_VERSION,
+            'bucket': self.bucket,
+            'location': self.location,
+            'remote_revision': self.remote_revision,
+            'old_revision': self.old_revision,
+            'target_revision': self.target_revision,
+            'use_manifest': self.use_manifest,
+            'estimate': self.estimate,
+            'uploads': [entry._asdict() for entry in self.uploads],
+            'copies': [entry._asdict() for entry in self.copies],
+            'duplicates': [entry._asdict() for entry in self.duplicates],
+            'deletions': self.deletions}
+
+        json.dump(data, fp, indent=2)
+
+    @classmethod
+    def load(cls, fp: TextIO):
+        """Reads a plan written by `dump`, raises `InvalidPlan` otherwise."""
+        try:
+            data = json.load(fp)
+        except ValueError as exc:
+            raise InvalidPlan('it is not valid JSON') from exc
+
+        if not isinstance(data, dict) \
+                or data.get('version') != PLAN_VERSION:
+            raise InvalidPlan('its version is not supported')
+
+        try:
+            return cls(
+                data['bucket'], data['location'], data['remote_revision'],
+                data['old_revision'], data['target_revision'],
+                uploads=[PlannedUpload(**entry) for entry in data['uploads']],
+                copies=[PlannedCopy(**entry) for entry in data['copies']],
+                duplicates=[
+                    PlannedCopy(**entry) for entry in data['duplicates']],
+                deletions=data['deletions'],
+                use_manifest=data['use_manifest'],
+                estimate=data.get('estimate'))
+        except (KeyError, TypeError) as exc:
+            raise InvalidPlan('it is missing %s' % exc) from exc
+
+
+def _count_transfer_requests(
+        requests: Counter, size, config: 'TransferConfig', copy=False):
+    if size < config.multipart_threshold:
+        requests['CopyObject' if copy else 'PutObject'] += 1
+        return
+
+    requests['CreateMultipartUpload'] += 1
+    requests['UploadPartCopy' if copy else 'UploadPart'] += max(
+        1, math.ceil(size / config.multipart_chunksize))
+    requests['CompleteMultipartUpload'] += 1
+
+
+def estimate_plan(
+        plan: SyncPlan,
+        get_transfer_config: Callable[..., 'TransferConfig'],
+        delete_batch_size):
+    """
+    Estimates the bytes to upload, the S3 requests by type
+    and their cost, as the transfers would be split in parts
+    with the given transfer settings.
+    """
+    requests = Counter()
+
+    for upload in plan.uploads:
+        _count_transfer_requests(
+            requests, upload.size, get_transfer_config(upload.size))
+
+    # the source of every copy is read first
+    for copy in plan.copies + plan.duplicates:
+        requests['HeadObject'] += 1
+        _count_transfer_requests(
+            requests, copy.size, get_transfer_config(copy.size), copy=True)
+
+    # the content encoding of the files synced by previous syncs
+    # is read before copying them
+    requests['HeadObject'] += len(plan.copies)
+
+    if plan.deletions:
+        requests['DeleteObjects'] += math.ceil(
+            len(plan.deletions) / delete_batch_size)
+
+    # the revision, and manifest
+    requests['PutObject'] += 1 + bool(plan.use_manifest)
+
+    put_count = sum(
+        count for request_type, count in requests.items()
+        if request_type in PUT_REQUEST_TYPES)
+    get_count = sum(
+        count for request_type, count in requests.items()
+        if request_type in GET_REQUEST_TYPES)
+
+    return {
+        'upload_bytes': sum(upload.size for upload in plan.uploads),
+        'copy_bytes': sum(
+            copy.size for copy in plan.copies + plan.duplicates),
+        'requests': dict(sorted(requests.items())),
+        'cost_usd':
+            put_count * PUT_REQUEST_PRICE + get_count * GET_REQUEST_PRICE}
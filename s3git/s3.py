@@ -1,21 +1,140 @@
 import configparser
+import math
 import os
 import posixpath
+import threading
 from os.path import isfile
 from tempfile import SpooledTemporaryFile
+from typing import TYPE_CHECKING
 
-import boto3
 import botocore.exceptions
 
-from magic import from_buffer
+from s3git.compression import COMPRESSION_ENCODINGS
 from s3git.exceptions import *
-from s3git.utils import cached_property
+from s3git.tracing import tracer
+from s3git.utils import (
+    cached_property, parse_list, parse_positive_int, parse_size)
+
+if TYPE_CHECKING:
+    from boto3.s3.transfer import TransferConfig
 
 S3CONFIG_PATH = '.git/s3config.cfg'
 DEFAULT_SECTION = 'default'
 
 S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL', None)
 
+# the metadata key (`x-amz-meta-*`) holding the git blob hash of an object
+BLOB_SHA_METADATA_KEY = 'git-blob-sha'
+
+MiB = 1024 * 1024
+
+# S3 limits of multipart uploads
+MIN_PART_SIZE = 5 * MiB
+MAX_PART_SIZE = 5 * 1024 * MiB
+MAX_PART_COUNT = 10000
+
+DEFAULT_MULTIPART_THRESHOLD = 8 * MiB
+DEFAULT_MULTIPART_CHUNKSIZE = 8 * MiB
+DEFAULT_TRANSFER_CONCURRENCY = 10
+
+# the minimal number of parts per thread, when picking the part size
+PARTS_PER_THREAD = 4
+
+# the number of connections kept open to S3, botocore defaults to 10
+DEFAULT_MAX_POOL_CONNECTIONS = 10
+
+
+def get_adaptive_chunksize(size, concurrency):
+    """
+    Picks the part size of a multipart upload from the size of the file:
+    big enough to limit the request count, but small enough to keep
+    every thread busy, and within the S3 limits.
+    """
+    chunksize = max(
+        DEFAULT_MULTIPART_CHUNKSIZE,
+        size // (concurrency * PARTS_PER_THREAD),
+        math.ceil(size / MAX_PART_COUNT))
+
+    # round up to the next MiB
+    chunksize = math.ceil(chunksize / MiB) * MiB
+    return min(chunksize, MAX_PART_SIZE)
+
+
+class S3ResourcePool:
+    """
+    Keeps a session for every endpoint and credentials, and an S3 resource,
+    along with its client and connection pool, for every client settings
+    and scope; so the buckets sharing them reuse the same connections.
+
+    Resources of different scopes (e.g. of concurrent syncs) are never
+    shared, for the requests of every scope to be told apart and its
+    connection pool to be sized for its own workers.
+
+    The pool can be shared between threads.
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        self._resources = {}
+        self._lock = threading.Lock()
+
+    def _get_session(self, endpoint_url, access_key_id, secret_access_key):
+        key = (endpoint_url, access_key_id, secret_access_key)
+        session = self._sessions.get(key)
+
+        if session is None:
+            # boto3 is slow to import, it is only imported when needed
+            import boto3.session
+
+            session = self._sessions[key] = boto3.session.Session(
+                aws_access_key_id=access_key_id,
+                aws_secret_access_key=secret_access_key)
+        return session
+
+    def get(
+            self, endpoint_url, access_key_id, secret_access_key,
+            scope=None, **client_options):
+        """
+        Gets the resource of the given endpoint, credentials and scope,
+        `client_options` being passed to the botocore `Config`.
+        """
+        key = (
+            endpoint_url, access_key_id, secret_access_key, scope,
+            tuple(sorted(client_options.items())))
+
+        # sessions are not thread-safe, they are only used under the lock
+        with self._lock:
+            resource = self._resources.get(key)
+
+            if resource is None:
+                from botocore.config import Config
+
+                session = self._get_session(
+                    endpoint_url, access_key_id, secret_access_key)
+                resource = self._resources[key] = session.resource(
+                    service_name='s3', endpoint_url=endpoint_url,
+                    config=Config(**client_options))
+
+        return resource
+
+    def release(self, scope):
+        """
+        Forgets the resources of the given scope, which are then only
+        kept by the buckets using them, e.g. once their sync is over.
+        """
+        with self._lock:
+            self._resources = {
+                key: resource for key, resource in self._resources.items()
+                if key[3] != scope}
+
+    def clear(self):
+        with self._lock:
+            self._sessions = {}
+            self._resources = {}
+
+
+RESOURCE_POOL = S3ResourcePool()
+
 
 class ConfigParser(configparser.ConfigParser):
     def get_available_section(self, *sections: str):
@@ -35,45 +154,248 @@ class S3Bucket:
         'S3_BUCKET_NAME')
 
     OPTIONAL_KEYS = (
-        'S3_UPLOAD_LOCATION',)
+        'S3_UPLOAD_LOCATION',
+        'S3_UPLOAD_CONCURRENCY',
+        'S3_USE_MANIFEST',
+        'S3_MULTIPART_THRESHOLD',
+        'S3_MULTIPART_CHUNKSIZE',
+        'S3_TRANSFER_CONCURRENCY',
+        'S3_IO_CHUNKSIZE',
+        'S3_MAX_POOL_CONNECTIONS',
+        'S3_CONNECT_TIMEOUT',
+        'S3_READ_TIMEOUT',
+        'S3_TCP_KEEPALIVE',
+        'S3_COMPRESS',
+        'S3_COMPRESSION')
+
+    INTEGER_KEYS = (
+        'S3_UPLOAD_CONCURRENCY',
+        'S3_TRANSFER_CONCURRENCY',
+        'S3_MAX_POOL_CONNECTIONS',
+        'S3_CONNECT_TIMEOUT',
+        'S3_READ_TIMEOUT')
+
+    SIZE_KEYS = (
+        'S3_MULTIPART_THRESHOLD',
+        'S3_MULTIPART_CHUNKSIZE',
+        'S3_IO_CHUNKSIZE')
+
+    BOOLEAN_KEYS = (
+        'S3_USE_MANIFEST',
+        'S3_TCP_KEEPALIVE')
+
+    LIST_KEYS = (
+        'S3_COMPRESS',)
+
+    # the keys only taking one of the given values
+    CHOICE_KEYS = {
+        'S3_COMPRESSION': COMPRESSION_ENCODINGS}
+
+    OPTION_KEYS = REQUIRED_KEYS + OPTIONAL_KEYS
+
+    # cached properties are stored in `_cached_data`,
+    # as data classes don't use `__dict__`
+    __slots__ = OPTION_KEYS + ('pool_scope', '_cached_data')
 
-    __slots__ = REQUIRED_KEYS + OPTIONAL_KEYS
+    def __init__(self, **kwargs):
+        self._cached_data = {}
 
-    # cached properties are stored here as data classes don't use `__dict__`
-    CACHED_DATA = {}
+        # the buckets of different scopes don't share their S3 client
+        self.pool_scope = None
 
-    def __init__(self, **kwargs):
-        for k in self.__slots__:
+        for k in self.OPTION_KEYS:
             setattr(self, k, kwargs.get(k, None))
 
     @cached_property
     def base_path(self):
         return self.S3_UPLOAD_LOCATION or ''
 
+    def get_client_options(self):
+        """Gets the botocore client settings, as `Config` arguments."""
+        options = {
+            'max_pool_connections':
+                self.S3_MAX_POOL_CONNECTIONS or DEFAULT_MAX_POOL_CONNECTIONS}
+
+        # unset options are left to the botocore defaults,
+        # as older versions don't support all of them
+        if self.S3_CONNECT_TIMEOUT:
+            options['connect_timeout'] = self.S3_CONNECT_TIMEOUT
+        if self.S3_READ_TIMEOUT:
+            options['read_timeout'] = self.S3_READ_TIMEOUT
+        if self.S3_TCP_KEEPALIVE is not None:
+            options['tcp_keepalive'] = self.S3_TCP_KEEPALIVE
+
+        return options
+
     @cached_property
     def bucket(self):
-        s3 = boto3.resource(
-            service_name='s3',
-            aws_access_key_id=self.S3_ACCESS_KEY_ID,
-            aws_secret_access_key=self.S3_SECRET_ACCESS_KEY,
-            endpoint_url=S3_ENDPOINT_URL)
+        s3 = RESOURCE_POOL.get(
+            S3_ENDPOINT_URL, self.S3_ACCESS_KEY_ID,
+            self.S3_SECRET_ACCESS_KEY, scope=self.pool_scope,
+            **self.get_client_options())
 
         bucket = s3.Bucket(self.S3_BUCKET_NAME)
         return bucket
 
     def _get_mime_type(self, fp):
-        mime_type = from_buffer(fp.read(self.MIME_TYPE_READ_SIZE), mime=True)
+        from magic import from_buffer
+
+        with tracer.span('mime.sniff'):
+            mime_type = from_buffer(
+                fp.read(self.MIME_TYPE_READ_SIZE), mime=True)
         fp.seek(0)
         return mime_type
 
     def get_target_path(self, path):
         return posixpath.join(self.base_path, path)
 
-    def upload(self, fp, path):
+    def get_transfer_config(self, size=None) -> 'TransferConfig':
+        """
+        Gets the multipart settings to transfer a file of the given size.
+        Unless set, the part size is picked from the file size.
+        """
+        concurrency = \
+            self.S3_TRANSFER_CONCURRENCY or DEFAULT_TRANSFER_CONCURRENCY
+        chunksize = self.S3_MULTIPART_CHUNKSIZE
+
+        if not chunksize:
+            chunksize = get_adaptive_chunksize(size or 0, concurrency)
+
+        options = {
+            'multipart_threshold':
+                self.S3_MULTIPART_THRESHOLD or DEFAULT_MULTIPART_THRESHOLD,
+            'multipart_chunksize': max(chunksize, MIN_PART_SIZE),
+            'max_concurrency': concurrency}
+
+        if self.S3_IO_CHUNKSIZE:
+            options['io_chunksize'] = self.S3_IO_CHUNKSIZE
+
+        from boto3.s3.transfer import TransferConfig
+        return TransferConfig(**options)
+
+    def upload(
+            self, fp, path, blob_sha=None, mime_type=None,
+            content_encoding=None):
+        """
+        Uploads a file and returns the mime type it was uploaded with,
+        the mime type is detected from the content if not given.
+        """
         path = self.get_target_path(path)
-        mime_type = self._get_mime_type(fp)
-        return self.bucket.upload_fileobj(
-            Fileobj=fp, Key=path, ExtraArgs={'ContentType': mime_type})
+        mime_type = mime_type or self._get_mime_type(fp)
+        extra_args = {'ContentType': mime_type}
+
+        if blob_sha:
+            extra_args['Metadata'] = {BLOB_SHA_METADATA_KEY: blob_sha}
+        if content_encoding:
+            extra_args['ContentEncoding'] = content_encoding
+
+        size = fp.seek(0, os.SEEK_END)
+        fp.seek(0)
+
+        with tracer.span('s3.upload', path=path, size=size):
+            self.bucket.upload_fileobj(
+                Fileobj=fp, Key=path, ExtraArgs=extra_args,
+                Config=self.get_transfer_config(size))
+        return mime_type
+
+    def copy(
+            self, source_path, path, blob_sha=None, mime_type=None,
+            content_encoding=None, size=None):
+        """
+        Copies a file stored in the bucket to another path, server-side.
+        Big files are copied in multiple parts, sized from `size`
+        (at least the size of the source) if given.
+
+        The metadata of the source file are kept, unless a mime type is given;
+        the content encoding of the source must then be given as well.
+        """
+        copy_source = {
+            'Bucket': self.S3_BUCKET_NAME,
+            'Key': self.get_target_path(source_path)}
+        extra_args = {}
+
+        if mime_type:
+            extra_args = {
+                'ContentType': mime_type, 'MetadataDirective': 'REPLACE'}
+
+            if blob_sha:
+                extra_args['Metadata'] = {BLOB_SHA_METADATA_KEY: blob_sha}
+            if content_encoding:
+                extra_args['ContentEncoding'] = content_encoding
+
+        with tracer.span('s3.copy', source=source_path, path=path):
+            return self.bucket.copy(
+                CopySource=copy_source, Key=self.get_target_path(path),
+                ExtraArgs=extra_args, Config=self.get_transfer_config(size))
+
+    def list_files(self):
+        """
+        Lists every file stored under the upload location,
+        with paths relative to the upload location.
+        """
+        prefix = self.get_target_path('')
+        return {
+            obj.key[len(prefix):]
+            for obj in self.bucket.objects.filter(Prefix=prefix)}
+
+    def _head(self, path):
+        """Gets the headers of a file, or `None` if it doesn't exist."""
+        try:
+            return self.bucket.meta.client.head_object(
+                Bucket=self.S3_BUCKET_NAME, Key=self.get_target_path(path))
+        except botocore.exceptions.ClientError as exc:
+            if exc.response['Error']['Code'] == '404':
+                return None
+            raise exc
+
+    def get_blob_sha(self, path):
+        """
+        Gets the git blob hash stored in the metadata of a file,
+        or `None` if the file doesn't exist or doesn't have one.
+        """
+        response = self._head(path)
+        if response is None:
+            return None
+
+        return response['Metadata'].get(BLOB_SHA_METADATA_KEY)
+
+    def get_content_encoding(self, path):
+        """
+        Gets the content encoding of a file (e.g. `gzip`),
+        or `None` if the file doesn't exist or isn't encoded.
+        """
+        response = self._head(path)
+        if response is None:
+            return None
+
+        return response.get('ContentEncoding')
+
+    def get_file_if_modified(self, path, etag=None):
+        """
+        Reads a small file in a single request, unless its ETag
+        is still `etag`. Returns `(modified, content, etag)`,
+        the content being `None` if unmodified or if the file doesn't exist.
+        """
+        options = {
+            'Bucket': self.S3_BUCKET_NAME, 'Key': self.get_target_path(path)}
+        if etag:
+            options['IfNoneMatch'] = etag
+
+        try:
+            response = self.bucket.meta.client.get_object(**options)
+        except botocore.exceptions.ClientError as exc:
+            error_code = exc.response['Error']['Code']
+            if error_code in ('304', 'NotModified'):
+                return False, None, etag
+            if error_code in ('404', 'NoSuchKey'):
+                return True, None, None
+            raise exc
+
+        body = response['Body']
+        try:
+            return True, body.read(), response.get('ETag')
+        finally:
+            body.close()
 
     def get_file(self, path):
         path = self.get_target_path(path)
@@ -107,26 +429,67 @@ class S3Bucket:
         return self.bucket.delete_objects(Delete=payload)
 
     def delete_files(self, paths):
+        """
+        Deletes the given paths, by batches of the maximum count per request.
+
+        The files S3 failed to delete are returned as {path: error}.
+        """
+        prefix = self.get_target_path('')
+        errors = {}
         start_pos = 0
         end_pos = self.DELETE_MAX_COUNT_PER_REQUEST
 
         while start_pos < len(paths):
             to_delete = paths[start_pos:end_pos]
-            self._delete_objects(to_delete)
+
+            with tracer.span('s3.delete', count=len(to_delete)):
+                response = self._delete_objects(to_delete)
+
+            # the request succeeds even if some keys could not be deleted
+            for error in response.get('Errors', ()):
+                errors[error['Key'][len(prefix):]] = '{}: {}'.format(
+                    error.get('Code'), error.get('Message'))
 
             start_pos = end_pos
             end_pos += self.DELETE_MAX_COUNT_PER_REQUEST
 
+        return errors
+
     @property
     def as_dict(self):
-        return {k: getattr(self, k) for k in self.__slots__}
+        return {k: getattr(self, k) for k in self.OPTION_KEYS}
 
     def __repr__(self):
         return '<{self.__class__.__name__} @{id} {self.as_dict}>'.format(
             self=self, id=id(self))
 
     @classmethod
-    def read_config(cls, section):
+    def _read_option(cls, cfg, section, key):
+        value = cfg.get(section, key)
+
+        try:
+            if key in cls.BOOLEAN_KEYS:
+                return cfg.getboolean(section, key)
+            if key in cls.INTEGER_KEYS:
+                return parse_positive_int(value)
+            if key in cls.SIZE_KEYS:
+                return parse_size(value)
+            if key in cls.LIST_KEYS:
+                return parse_list(value)
+            if key in cls.CHOICE_KEYS and value not in cls.CHOICE_KEYS[key]:
+                raise ValueError('%s is not a valid choice' % value)
+        except ValueError as exc:
+            raise InvalidValueInConfigurationFile(
+                (section, key, value)) from exc
+
+        return value
+
+    @classmethod
+    def read_config(cls, section, use_default=True):
+        """
+        Reads the settings of the given section, or of the default section
+        if it doesn't exist and `use_default` is set.
+        """
         options = {}
         config_path = S3CONFIG_PATH
 
@@ -136,9 +499,13 @@ class S3Bucket:
         cfg = ConfigParser()
         cfg.read(config_path)
 
-        section = cfg.get_available_section(section, DEFAULT_SECTION)
-        if not section:
-            raise MissingSectionConfigurationFile(S3CONFIG_PATH)
+        if not use_default:
+            if not cfg.has_section(section):
+                raise UnknownConfigurationSection((S3CONFIG_PATH, section))
+        else:
+            section = cfg.get_available_section(section, DEFAULT_SECTION)
+            if not section:
+                raise MissingSectionConfigurationFile(S3CONFIG_PATH)
 
         for required_key in cls.REQUIRED_KEYS:
             if not cfg.has_option(section, required_key):
@@ -148,7 +515,8 @@ class S3Bucket:
 
         for optional_key in cls.OPTIONAL_KEYS:
             if cfg.has_option(section, optional_key):
-                options[optional_key] = cfg.get(section, optional_key)
+                options[optional_key] = cls._read_option(
+                    cfg, section, optional_key)
 
         result_instance = cls(**options)
         return result_instance
@@ -0,0 +1,216 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+REPORT_VERSION = 1
+
+# upper bounds (in seconds) of the buckets of the latency histograms
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+
+# the botocore events used to measure the S3 requests
+BEFORE_CALL_EVENT = 'before-call.s3'
+BEFORE_SEND_EVENT = 'before-send.s3'
+AFTER_CALL_EVENT = 'after-call.s3'
+AFTER_CALL_ERROR_EVENT = 'after-call-error.s3'
+
+CONTEXT_START_KEY = 's3git-start'
+CONTEXT_SENT_KEY = 's3git-sent'
+
+
+class Histogram:
+    """Counts values per bucket, as in `LATENCY_BUCKETS`."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+
+    def add(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                return
+
+    def as_dict(self):
+        return {
+            ('+Inf' if bound == float('inf') else str(bound)): count
+            for bound, count in zip(self.buckets, self.counts)}
+
+
+class StageStats:
+    __slots__ = ('count', 'seconds', 'bytes', 'saved_bytes')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0
+        self.bytes = 0
+
+        # the bytes the stage spared the next ones, e.g. by compressing
+        self.saved_bytes = 0
+
+    def as_dict(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+
+class RequestStats:
+    __slots__ = (
+        'count', 'errors', 'seconds', 'bytes_sent', 'bytes_received',
+        'latencies')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latencies = Histogram()
+
+    def as_dict(self):
+        data = {k: getattr(self, k) for k in self.__slots__}
+        data['latencies'] = self.latencies.as_dict()
+        return data
+
+
+class SyncStats:
+    """
+    Collects the counters and timings of a sync: the time spent
+    in every stage (summed over the threads), the changes synced
+    and the S3 requests sent by type.
+
+    The statistics can be shared between threads.
+    """
+
+    def __init__(self):
+        self.started_at = None
+        self.seconds = None
+        self.changes = {}
+        self.stages = {}
+        self.requests = {}
+        self.info = {}
+        self.error = None
+
+        self._start = None
+        self._lock = threading.Lock()
+
+    def start(self, **info):
+        """Starts timing the sync, `info` is added to the report."""
+        self.info.update(info)
+        self.started_at = datetime.now(timezone.utc)
+        self._start = time.monotonic()
+
+    def stop(self, error: BaseException=None):
+        self.seconds = time.monotonic() - self._start
+        if error is not None:
+            self.error = '%s: %s' % (error.__class__.__name__, error)
+
+    def record_change(self, status):
+        with self._lock:
+            self.changes[status] = self.changes.get(status, 0) + 1
+
+    def _get_stage(self, stage):
+        # the lock is held by the caller
+        stats = self.stages.get(stage)
+        if stats is None:
+            stats = self.stages[stage] = StageStats()
+        return stats
+
+    def record_stage(self, stage, seconds, count=1, size=0):
+        with self._lock:
+            stats = self._get_stage(stage)
+            stats.count += count
+            stats.seconds += seconds
+            stats.bytes += size
+
+    def record_saving(self, stage, size):
+        """Records bytes a stage saved, e.g. the ones compression saved."""
+        with self._lock:
+            self._get_stage(stage).saved_bytes += size
+
+    @contextmanager
+    def measure(self, stage, count=1, size=0):
+        """Times the enclosed code as a run of the given stage."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record_stage(stage, time.monotonic() - start, count, size)
+
+    def record_request(
+            self, request_type, seconds, failed=False,
+            bytes_sent=0, bytes_received=0):
+        with self._lock:
+            stats = self.requests.get(request_type)
+            if stats is None:
+                stats = self.requests[request_type] = RequestStats()
+
+            stats.count += 1
+            stats.errors += bool(failed)
+            stats.seconds += seconds
+            stats.bytes_sent += bytes_sent
+            stats.bytes_received += bytes_received
+            stats.latencies.add(seconds)
+
+    def _before_call(self, model, context, **kwargs):
+        context[CONTEXT_START_KEY] = (model.name, time.monotonic())
+
+    def _before_send(self, request, **kwargs):
+        # the requests may not give their context with old botocore versions
+        context = getattr(request, 'context', None)
+        if context is not None:
+            context[CONTEXT_SENT_KEY] = context.get(CONTEXT_SENT_KEY, 0) + int(
+                request.headers.get('Content-Length', 0))
+
+    def _after_call(self, context, http_response=None, **kwargs):
+        if CONTEXT_START_KEY not in context:
+            return
+
+        request_type, start = context[CONTEXT_START_KEY]
+        failed = http_response is None or http_response.status_code >= 300
+        bytes_received = 0
+        if http_response is not None:
+            bytes_received = int(
+                http_response.headers.get('Content-Length', 0))
+
+        self.record_request(
+            request_type, time.monotonic() - start, failed=failed,
+            bytes_sent=context.get(CONTEXT_SENT_KEY, 0),
+            bytes_received=bytes_received)
+
+    def _get_handlers(self):
+        return (
+            (BEFORE_CALL_EVENT, self._before_call),
+            (BEFORE_SEND_EVENT, self._before_send),
+            (AFTER_CALL_EVENT, self._after_call),
+            (AFTER_CALL_ERROR_EVENT, self._after_call))
+
+    def watch_client(self, client):
+        """Records every request sent by a botocore client."""
+        for event_name, handler in self._get_handlers():
+            client.meta.events.register(event_name, handler)
+
+    def unwatch_client(self, client):
+        for event_name, handler in self._get_handlers():
+            client.meta.events.unregister(event_name, handler)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'version': REPORT_VERSION,
+                'started_at': self.started_at and self.started_at.isoformat(),
+                'seconds': self.seconds,
+                'succeeded': self.error is None,
+                'error': self.error,
+                'info': dict(self.info),
+                'changes': dict(self.changes),
+                'stages': {
+                    name: stats.as_dict()
+                    for name, stats in sorted(self.stages.items())},
+                'requests': {
+                    name: stats.as_dict()
+                    for name, stats in sorted(self.requests.items())}}
+
+    def dump(self, path):
+        with open(path, 'w') as fp:
+            json.dump(self.as_dict(), fp, indent=2)
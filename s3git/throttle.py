@@ -0,0 +1,196 @@
+import logging
+import random
+import threading
+import time
+
+from botocore.exceptions import (
+    ClientError, ConnectTimeoutError, ReadTimeoutError)
+
+logger = logging.getLogger(__name__)
+
+# the error codes S3 answers when the requests should be slowed down
+THROTTLING_ERROR_CODES = frozenset((
+    'SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded',
+    'TooManyRequestsException', 'ServiceUnavailable', 'RequestTimeout'))
+THROTTLING_STATUS_CODES = frozenset((429, 503))
+
+MAX_ATTEMPTS = 5
+
+# the botocore event emitted after every attempt of a request,
+# including the attempts botocore retries by itself
+NEEDS_RETRY_EVENT = 'needs-retry.s3'
+
+# the retries are delayed by a random duration, up to an exponential limit
+BASE_RETRY_DELAY = 0.1
+MAX_RETRY_DELAY = 20
+
+# the concurrency is divided by this factor when throttled,
+# but not more than once per interval (in seconds) as the requests
+# already running are likely to be throttled as well
+DECREASE_FACTOR = 2
+DECREASE_INTERVAL = 1
+
+
+def is_throttling_error(exc: BaseException) -> bool:
+    """
+    Checks whether an error, or an error it was raised from,
+    means the requests should be slowed down (throttling or timeouts).
+    """
+    while exc is not None:
+        if isinstance(exc, (ConnectTimeoutError, ReadTimeoutError)):
+            return True
+
+        if isinstance(exc, ClientError):
+            code = exc.response.get('Error', {}).get('Code')
+            status = exc.response.get(
+                'ResponseMetadata', {}).get('HTTPStatusCode')
+            return code in THROTTLING_ERROR_CODES \
+                or status in THROTTLING_STATUS_CODES
+
+        # e.g. transfer errors are raised while handling the client errors
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+def get_retry_delay(attempt: int) -> float:
+    """Gets a random delay before retrying after the given attempt."""
+    max_delay = min(MAX_RETRY_DELAY, BASE_RETRY_DELAY * 2 ** (attempt - 1))
+    return random.uniform(0, max_delay)
+
+
+class AdaptiveThrottle:
+    """
+    Limits the number of concurrent requests to S3,
+    increasing the limit additively while requests succeed
+    and decreasing it multiplicatively when they are throttled (AIMD).
+
+    Throttled requests are retried after a jittered exponential delay.
+    The attempts botocore retries by itself are seen through the events
+    of the clients given to `watch_client`.
+
+    The throttle is meant to be shared between threads.
+    """
+
+    def __init__(
+            self, max_concurrency: int, min_concurrency=1,
+            max_attempts=MAX_ATTEMPTS):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_attempts = max_attempts
+
+        self.limit = float(max_concurrency)
+        self.running = 0
+        self.throttled_count = 0
+
+        self._last_decrease = None
+        self._condition = threading.Condition()
+
+    @property
+    def concurrency(self) -> int:
+        return int(self.limit)
+
+    def _acquire(self):
+        with self._condition:
+            while self.running >= self.concurrency:
+                self._condition.wait()
+            self.running += 1
+
+    def _release(self, succeeded=False, throttling_error=None):
+        with self._condition:
+            self.running -= 1
+
+            if succeeded:
+                self._increase()
+            elif throttling_error is not None:
+                self._decrease(throttling_error)
+
+            self._condition.notify_all()
+
+    def _increase(self):
+        # increases the limit by one after a full window of successes
+        previous_concurrency = self.concurrency
+        self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+        if self.concurrency > previous_concurrency:
+            logger.debug('Raising the concurrency to %d', self.concurrency)
+
+    def _decrease(self, exc):
+        self.throttled_count += 1
+        now = time.monotonic()
+
+        if self._last_decrease is not None \
+                and now - self._last_decrease < DECREASE_INTERVAL:
+            return
+
+        self._last_decrease = now
+        self.limit = max(self.min_concurrency, self.limit / DECREASE_FACTOR)
+        logger.warning(
+            'Requests are throttled (%s), lowering the concurrency to %d',
+            exc, self.concurrency)
+
+    def _on_attempt(self, response=None, caught_exception=None, **kwargs):
+        if caught_exception is not None:
+            if not is_throttling_error(caught_exception):
+                return
+            error = caught_exception
+        elif response is not None:
+            http_response, parsed = response
+            error = parsed.get('Error', {}).get('Code')
+            if error not in THROTTLING_ERROR_CODES \
+                    and http_response.status_code \
+                    not in THROTTLING_STATUS_CODES:
+                return
+            error = error or http_response.status_code
+        else:
+            return
+
+        # the handler must not return anything, not to alter the retries
+        with self._condition:
+            self._decrease(error)
+
+    def watch_client(self, client):
+        """
+        Lowers the concurrency on every throttled attempt
+        of the requests sent by a botocore client.
+        """
+        client.meta.events.register(NEEDS_RETRY_EVENT, self._on_attempt)
+
+    def unwatch_client(self, client):
+        client.meta.events.unregister(NEEDS_RETRY_EVENT, self._on_attempt)
+
+    def call(self, function, *args):
+        """
+        Calls `function(*args)` once a slot is available,
+        retrying it while it is throttled.
+        """
+        attempt = 1
+
+        while True:
+            self._acquire()
+
+            try:
+                result = function(*args)
+            except Exception as exc:
+                if not is_throttling_error(exc):
+                    self._release()
+                    raise
+
+                self._release(throttling_error=exc)
+                if attempt >= self.max_attempts:
+                    raise
+
+                delay = get_retry_delay(attempt)
+                attempt += 1
+
+                # the calls are described by their path if they have one
+                description = function.__name__
+                if args and isinstance(args[0], str):
+                    description = args[0]
+
+                logger.info(
+                    'Retrying %s in %.2fs (attempt %d of %d)',
+                    description, delay, attempt, self.max_attempts)
+                time.sleep(delay)
+            else:
+                self._release(succeeded=True)
+                return result
@@ -0,0 +1,124 @@
+import json
+import os
+import threading
+import time
+
+# the category of the recorded events, to filter them in trace viewers
+TRACE_CATEGORY = 's3git'
+
+
+class _NullSpan:
+    """The span returned while tracing is disabled, doing nothing."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'args', 'start')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter()
+
+        if exc_value is not None:
+            self.args['error'] = '%s: %s' % (exc_type.__name__, exc_value)
+
+        self.tracer._record(self.name, self.start, end, self.args)
+        return False
+
+
+class Tracer:
+    """
+    Records spans of the sync, with the thread they ran in,
+    to be written in the Chrome trace event format: the traces open
+    in `chrome://tracing`, Perfetto or speedscope.
+
+    Tracing is disabled until `start` is called; `span` then only
+    returns a shared span doing nothing.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+
+        self._origin = 0
+        self._thread_names = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Starts recording, dropping the previously recorded spans."""
+        with self._lock:
+            self.events = []
+            self._thread_names = {}
+            self._origin = time.perf_counter()
+            self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def span(self, name, **args):
+        """
+        Times the enclosed code as a span named `name`,
+        `args` being shown along with the span.
+        """
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, name, args)
+
+    def _record(self, name, start, end, args):
+        thread_id = threading.get_ident()
+
+        # timestamps are in microseconds since the trace started
+        event = {
+            'name': name, 'cat': TRACE_CATEGORY, 'ph': 'X',
+            'ts': (start - self._origin) * 1e6, 'dur': (end - start) * 1e6,
+            'pid': os.getpid(), 'tid': thread_id, 'args': args}
+
+        with self._lock:
+            if thread_id not in self._thread_names:
+                self._thread_names[thread_id] = \
+                    threading.current_thread().name
+            self.events.append(event)
+
+    def _get_metadata_events(self):
+        pid = os.getpid()
+        events = [{
+            'name': 'process_name', 'ph': 'M', 'pid': pid,
+            'args': {'name': 's3git'}}]
+
+        for thread_id, thread_name in sorted(self._thread_names.items()):
+            events.append({
+                'name': 'thread_name', 'ph': 'M', 'pid': pid,
+                'tid': thread_id, 'args': {'name': thread_name}})
+
+        return events
+
+    def dump(self, path):
+        """Writes the recorded spans to `path`."""
+        with self._lock:
+            events = self._get_metadata_events() + self.events
+
+        with open(path, 'w') as fp:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fp)
+
+
+# the tracer shared by the whole sync, including the S3 and mime modules
+tracer = Tracer()
@@ -1,10 +1,55 @@
+import re
+
+
 class cached_property(object):
+    """
+    Caches the value of a property in the `_cached_data` dict
+    of every instance, for classes using `__slots__`.
+    """
+
     def __init__(self, f):
         self._fname = f.__name__
         self._f = f
 
     def __get__(self, obj, owner):
-        if self._fname in obj.CACHED_DATA:
-            return obj.CACHED_DATA[self._fname]
-        ret = obj.CACHED_DATA[self._fname] = self._f(obj)
+        if obj is None:
+            return self
+
+        if self._fname in obj._cached_data:
+            return obj._cached_data[self._fname]
+        ret = obj._cached_data[self._fname] = self._f(obj)
         return ret
+
+
+SIZE_UNITS = ('', 'K', 'M', 'G', 'T')
+SIZE_PATTERN = re.compile(r'^\s*(\d+)\s*([KMGT]?)(?:i?B)?\s*$', re.IGNORECASE)
+
+
+def parse_positive_int(value) -> int:
+    """Parses a strictly positive integer, raises `ValueError` otherwise."""
+    number = int(value)
+    if number < 1:
+        raise ValueError('%s is not a positive integer' % value)
+    return number
+
+
+def parse_size(value) -> int:
+    """
+    Parses a size in bytes, optionally suffixed by a unit
+    (K, M, G or T, as powers of 1024), e.g. `8M`, `64KiB` or `1024`.
+    """
+    match = SIZE_PATTERN.match(str(value))
+    if not match:
+        raise ValueError('%s is not a valid size' % value)
+
+    number, unit = match.groups()
+    size = int(number) * 1024 ** SIZE_UNITS.index(unit.upper())
+
+    if size < 1:
+        raise ValueError('%s is not a valid size' % value)
+    return size
+
+
+def parse_list(value) -> tuple:
+    """Parses a list of values separated by commas or whitespaces."""
+    return tuple(item for item in re.split(r'[\s,]+', str(value)) if item)
@@ -38,6 +38,7 @@ setup(
     include_package_data=True,
     install_requires=requirements,
     extras_require=dict(
+        brotli=['brotli'],
         testing=['pytest', 'pytest-mock', 'moto']
     )
 )
@@ -8,7 +8,7 @@ import pytest
 import git
 from moto import mock_s3
 from s3git.core import S3GitSync
-from s3git.s3 import S3CONFIG_PATH, S3Bucket
+from s3git.s3 import RESOURCE_POOL, S3CONFIG_PATH, S3Bucket
 
 
 @pytest.fixture
@@ -158,8 +158,8 @@ def diff_commit(git_repo, s3git_tracked_files):
 
 
 @pytest.fixture(autouse=True)
-def _clear_caches():
-    S3Bucket.CACHED_DATA = {}
+def _clear_resource_pool():
+    RESOURCE_POOL.clear()
 
 
 @pytest.fixture(scope='function')
@@ -30,15 +30,18 @@ def test__init__with_given_branch(mocked_s3_commit, _, git_repo):
 
 @mock.patch('s3git.s3.S3Bucket.read_config')
 @mock.patch.object(S3GitSync, 'get_empty_tree')
-@mock.patch.object(S3GitSync, 'get_remote_tree')
+@mock.patch.object(S3GitSync, '_get_remote_tree')
+@mock.patch.object(S3GitSync, '_get_s3_current_commit')
 @pytest.mark.parametrize(
     'force_reupload,get_empty_tree_calls,get_remote_tree_calls', (
         (True, 1, 0), (False, 0, 1)))
 def test__init__force_reupload_takes_correct_tree(
-        mocked_get_remote_tree, mocked_get_empty_tree, _, git_repo,
-        force_reupload, get_empty_tree_calls, get_remote_tree_calls):
+        mocked_s3_commit, mocked_get_remote_tree, mocked_get_empty_tree, _,
+        git_repo, force_reupload, get_empty_tree_calls,
+        get_remote_tree_calls):
 
     S3GitSync(None, force_reupload=force_reupload)
+    assert mocked_s3_commit.call_count == get_remote_tree_calls
     assert mocked_get_remote_tree.call_count == get_remote_tree_calls
     assert mocked_get_empty_tree.call_count == get_empty_tree_calls
 
@@ -81,3 +84,14 @@ def test__get_diffs_with_dirty_tree(_, s3git, git_repo, s3git_tracked_files):
     git_repo.git.add(u=True)
 
     assert s3git._get_diffs() == expected_diff
+
+
+@mock.patch('s3git.core.logger')
+def test__get_diffs_records_blob_shas(_, s3git, git_repo, diff_commit):
+    s3git.old_tree, expected_diff, s3git.target_tree = diff_commit
+    s3git._get_diffs()
+
+    expected_paths = expected_diff['A'] + expected_diff['M']
+    assert sorted(s3git.blob_shas) == sorted(expected_paths)
+    for path in expected_paths:
+        assert s3git.blob_shas[path] == s3git.target_tree[path].hexsha
@@ -1,12 +1,28 @@
+import functools
+import gzip
+import io
+import json
+import os
 from unittest import mock
 
 import pytest
 
+from git import Git
 from s3git.core import (
     IGNORE_FILE_PATH, W_DIRTY_REPO_MSG, W_INEXISTING_IGNORE_FILE,
-    _retrieve_ignore_list, get_repo, logger, REV_FILE_NAME)
+    W_MISSING_REMOTE_REVISION, _retrieve_ignore_list, get_repo, logger,
+    REV_FILE_NAME)
+from s3git.compression import Compressor
 from s3git.exceptions import *
+from s3git.core import (
+    DIRTY_CHECK_INDEX, DIRTY_CHECK_OFF, DIRTY_CHECK_TRACKED, JOURNAL_FILE_NAME,
+    MIME_TYPES_CACHE_FILE_NAME, REVISIONS_CACHE_FILE_NAME, S3GitSync,
+    check_dirty, get_cache_path)
 from s3git.fileignore import get_parser
+from s3git.manifest import MANIFEST_FILE_NAME, Manifest
+from s3git.mime import MimeTypeDetector
+from s3git.plan import SyncPlan
+from s3git.s3 import RESOURCE_POOL, S3CONFIG_PATH, S3Bucket
 
 
 def test_get_repo_inexisting(tmpdir):
@@ -44,6 +60,31 @@ def test_get_repo_dirty(mocked_logger, git_repo):
     mocked_logger.assert_called_once_with(W_DIRTY_REPO_MSG)
 
 
+@mock.patch.object(logger, 'warn')
+@pytest.mark.parametrize('dirty_check,staged,expect_warning', (
+    (DIRTY_CHECK_TRACKED, False, True),
+    (DIRTY_CHECK_INDEX, False, False),
+    (DIRTY_CHECK_INDEX, True, True),
+    (DIRTY_CHECK_OFF, True, False)))
+def test_check_dirty(
+        mocked_logger, git_repo, dirty_check, staged, expect_warning):
+    open('text-file', 'w').close()
+    if staged:
+        git_repo.index.add(['text-file'])
+
+    check_dirty(git_repo, dirty_check)
+    assert mocked_logger.called is expect_warning
+
+
+@mock.patch.object(logger, 'warn')
+def test_synchronize_checks_the_repository_while_preparing(
+        mocked_logger, s3git_unpatched, s3_bucket, git_repo):
+    open('text-file', 'w').close()
+
+    S3GitSync(None)
+    mocked_logger.assert_called_once_with(W_DIRTY_REPO_MSG)
+
+
 @mock.patch('os.path.isfile')
 @mock.patch('s3git.core.retrieve_ignore_patterns')
 @mock.patch('s3git.core.logger.warn')
@@ -75,8 +116,8 @@ def test__retrieve_ignore_list_warns_on_inexisting_ignore_file(
 
 
 def test__get_diffs_raises_on_invalid_status(s3git):
-    s3git.repo = mock.MagicMock()
-    s3git.repo.git.diff.return_value = 'H\0filename'
+    s3git._iter_git_output = mock.MagicMock(
+        return_value=iter(['H', 'filename']))
     with pytest.raises(UnexpectedDiffStatus, message='H'):
         s3git._get_diffs()
 
@@ -110,19 +151,20 @@ def test_synchronize_from_empty_tree(
         s3git_unpatched, s3_bucket, s3git_tracked_files):
 
     s3git = s3git_unpatched
-    s3git._upload_diffs = mock.MagicMock(
-        wraps=s3git._upload_diffs, autospec=True)
+    s3git._upload_file = mock.MagicMock(
+        wraps=s3git._upload_file, autospec=True)
     s3git._upload_new_commit_value = mock.MagicMock(
         wraps=s3git._upload_new_commit_value, autospec=True)
 
     # launch the synchronization
     s3git.synchronize()
     s3git._upload_new_commit_value.assert_called_once_with()
-    s3git._upload_diffs.assert_called_once_with(
-        'A', sorted(s3git_tracked_files))
+    assert sorted(
+        call[0][0] for call in s3git._upload_file.call_args_list
+    ) == sorted(s3git_tracked_files)
 
     s3git._upload_new_commit_value.reset_mock()
-    s3git._upload_diffs.reset_mock()
+    s3git._upload_file.reset_mock()
 
     # the remote repo should be up to date, there is nothing to sync anymore
     # thus nothing should happen, except raising an exception
@@ -130,7 +172,7 @@ def test_synchronize_from_empty_tree(
     with pytest.raises(RemoteUpToDate):
         s3git.synchronize()
     assert not s3git._upload_new_commit_value.called
-    assert not s3git._upload_diffs.called
+    assert not s3git._upload_file.called
 
     # check everything was correctly uploaded to s3
     for filename in s3git_tracked_files:
@@ -150,20 +192,19 @@ def test_synchronize_edited_tree(s3git_unpatched, s3_bucket, diff_commit):
     s3git = s3git_unpatched
     s3git.old_tree, diffs, s3git.target_tree = diff_commit
 
-    mocked_upload_diffs = s3git._upload_diffs = mock.MagicMock(
-        wraps=s3git._upload_diffs)
+    mocked_upload_file = s3git._upload_file = mock.MagicMock(
+        wraps=s3git._upload_file)
     s3git._upload_new_commit_value = mock.MagicMock(
         wraps=s3git._upload_new_commit_value)
 
-    expected_calls = [
-        mock.call(status, files) for status, files in diffs.items()]
-
     # launch the synchronization
     s3git.synchronize()
 
     # check everything was correctly called
     s3git._upload_new_commit_value.assert_called_once_with()
-    mocked_upload_diffs.assert_has_calls(expected_calls, any_order=True)
+    assert sorted(
+        call[0][0] for call in mocked_upload_file.call_args_list
+    ) == sorted(diffs['A'] + diffs['M'])
 
     # check the s3 now has the new tree hash
     assert s3git.get_remote_tree().hexsha == s3git.target_tree.hexsha
@@ -185,3 +226,739 @@ def test_synchronize_edited_tree(s3git_unpatched, s3_bucket, diff_commit):
 
         with open(filename, 'rb') as local_fp:
             assert remote_data == local_fp.read()
+
+
+def test__upload_files_uploads_every_path(s3git_unpatched, s3_bucket):
+    s3git = s3git_unpatched
+    s3git.concurrency = 4
+    paths = ['image-file', 'text-file']
+
+    s3git._upload_files(paths)
+
+    for path in paths:
+        remote_fp = s3_bucket.get_file(path)
+        try:
+            with open(path, 'rb') as local_fp:
+                assert remote_fp.read() == local_fp.read()
+        finally:
+            remote_fp.close()
+
+
+def test__upload_files_aggregates_errors(s3git):
+    s3git.s3_settings = mock.MagicMock()
+    s3git.s3_settings.upload.side_effect = lambda fp, path, **kwargs: (
+        1 / 0 if path != 'image-file' else None)
+
+    with pytest.raises(UploadFailed) as exc_info:
+        s3git._upload_files(['text-file', 'image-file', '.s3ignore'])
+
+    assert sorted(exc_info.value.errors) == ['.s3ignore', 'text-file']
+    assert exc_info.value.msg == UploadFailed.MSG % (
+        2, '.s3ignore, text-file')
+
+
+def test_synchronize_failed_upload_does_not_write_revision(s3git):
+    s3git._upload_new_commit_value = mock.MagicMock()
+    s3git.s3_settings = mock.MagicMock()
+    s3git.s3_settings.upload.side_effect = OSError()
+
+    with pytest.raises(UploadFailed):
+        s3git.synchronize()
+    assert not s3git._upload_new_commit_value.called
+
+
+def test_synchronize_reconcile_only_uploads_outdated_files(
+        s3git_unpatched, s3_bucket, s3git_tracked_files):
+    s3git = s3git_unpatched
+    s3git.synchronize()
+
+    # outdate a single file on the remote
+    s3_bucket.upload(io.BytesIO(b'outdated'), 'text-file', blob_sha='abc')
+
+    s3git.__init__(None, reconcile=True)
+    with mock.patch.object(
+            S3Bucket, 'upload', autospec=True,
+            side_effect=S3Bucket.upload) as mocked_upload:
+        s3git.synchronize()
+
+    # only the outdated file and the revision file should be uploaded
+    mocked_upload.assert_has_calls([
+        mock.call(
+            s3git.s3_settings, mock.ANY, 'text-file',
+            blob_sha=s3git.target_tree['text-file'].hexsha,
+            mime_type='text/plain', content_encoding=None),
+        mock.call(s3git.s3_settings, mock.ANY, REV_FILE_NAME)])
+    assert mocked_upload.call_count == 2
+
+    remote_fp = s3_bucket.get_file('text-file')
+    assert remote_fp.read() == b'hello'
+    remote_fp.close()
+
+
+def _get_remote_manifest(s3_bucket):
+    fp = s3_bucket.get_file(MANIFEST_FILE_NAME)
+    try:
+        return Manifest.load(fp)
+    finally:
+        fp.close()
+
+
+def test_synchronize_uploads_manifest(
+        s3git_unpatched, s3_bucket, s3git_tracked_files):
+    s3git = s3git_unpatched
+    s3git.__init__(None, use_manifest=True)
+    s3git.synchronize()
+
+    manifest = _get_remote_manifest(s3_bucket)
+    assert manifest.revision == s3git.target_tree.hexsha
+    assert sorted(manifest.files) == sorted(s3git_tracked_files)
+
+    image_entry = manifest.files['image-file']
+    assert image_entry.sha1 == s3git.target_tree['image-file'].hexsha
+    assert image_entry.size == os.path.getsize('image-file')
+    assert image_entry.mime_type == 'image/gif'
+
+
+def test_synchronize_from_manifest_without_remote_revision(
+        s3git_unpatched, s3_bucket, git_repo):
+    s3git = s3git_unpatched
+    s3git.__init__(None, use_manifest=True)
+    s3git.synchronize()
+    remote_revision = s3git.target_tree.hexsha
+
+    os.remove('text-file')
+    with open('image-file', 'wb') as fp:
+        fp.write(b'Dummy')
+    with open('new-file', 'w') as fp:
+        fp.write('Another dummy')
+    git_repo.git.add(A=True)
+    git_repo.index.commit('Various changes')
+
+    # emulate a shallow clone not containing the remote revision
+    get_tree = S3GitSync.get_tree
+
+    def _get_tree(self, commit):
+        if commit == remote_revision:
+            raise ValueError(commit)
+        return get_tree(self, commit)
+
+    with mock.patch.object(S3GitSync, 'get_tree', new=_get_tree):
+        s3git.__init__(None, use_manifest=True)
+
+    assert s3git.old_tree is None
+    assert s3git._get_diffs() == {
+        'A': ['new-file'], 'M': ['image-file'], 'D': ['text-file']}
+
+    s3git.synchronize()
+    assert not s3_bucket.get_file('text-file')
+
+    manifest = _get_remote_manifest(s3_bucket)
+    assert manifest.revision == s3git.target_tree.hexsha
+    assert sorted(manifest.files) == ['.s3ignore', 'image-file', 'new-file']
+
+    # the mime type of the untouched file is kept from the previous manifest
+    assert manifest.files['.s3ignore'].mime_type == 'text/plain'
+
+
+def test__get_s3_current_commit_reuses_cached_revision(
+        s3git_unpatched, s3_bucket):
+    s3git = s3git_unpatched
+    s3_bucket.bucket.put_object(Key=REV_FILE_NAME, Body=b'a' * 40)
+
+    assert s3git._get_s3_current_commit() == 'a' * 40
+
+    # the revision is not downloaded again while it is unchanged
+    with mock.patch.object(
+            S3Bucket, 'get_file_if_modified', autospec=True,
+            side_effect=S3Bucket.get_file_if_modified) as mocked_get:
+        assert s3git._get_s3_current_commit() == 'a' * 40
+
+    etag = mocked_get.call_args[0][2]
+    assert etag
+    assert s3git.s3_settings.get_file_if_modified(REV_FILE_NAME, etag) == (
+        False, None, etag)
+
+    s3_bucket.bucket.put_object(Key=REV_FILE_NAME, Body=b'b' * 40)
+    assert s3git._get_s3_current_commit() == 'b' * 40
+
+    s3_bucket.bucket.Object(REV_FILE_NAME).delete()
+    assert s3git._get_s3_current_commit() is None
+
+
+def test__get_s3_current_commit_ignores_corrupt_cache(
+        s3git_unpatched, s3_bucket):
+    s3git = s3git_unpatched
+    s3_bucket.bucket.put_object(Key=REV_FILE_NAME, Body=b'a' * 40)
+
+    path = get_cache_path(s3git.repo, REVISIONS_CACHE_FILE_NAME)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as fp:
+        fp.write('{not json')
+
+    assert s3git._get_s3_current_commit() == 'a' * 40
+
+
+def test_up_to_date_remote_skips_the_manifest(
+        s3git_unpatched, s3_bucket, git_repo):
+    s3git_unpatched._upload_new_commit_value()
+
+    with mock.patch.object(S3Bucket, 'get_file', autospec=True) as mocked:
+        s3git = S3GitSync(None, use_manifest=True)
+        with pytest.raises(RemoteUpToDate):
+            s3git.synchronize()
+
+    assert s3git.old_tree == s3git.target_tree
+    mocked.assert_not_called()
+
+
+@mock.patch.object(logger, 'warn')
+def test_get_remote_tree_missing_revision_reuploads_everything(
+        mocked_warn, s3git_unpatched):
+    s3git = s3git_unpatched
+    s3git._get_s3_current_commit = mock.MagicMock(return_value='0' * 40)
+
+    assert s3git.get_remote_tree() == s3git.get_empty_tree()
+    mocked_warn.assert_called_once_with(W_MISSING_REMOTE_REVISION, '0' * 40)
+
+
+@pytest.fixture
+def rename_commit(git_repo, binary_image):
+    """Renames and copies the image, and partially renames the text file."""
+    os.mkdir('images')
+    git_repo.git.mv('image-file', 'images/renamed-image')
+    with open('images/copied-image', 'wb') as fp:
+        fp.write(binary_image)
+
+    with open('text-file', 'w') as fp:
+        fp.write('hello\n' * 100)
+    git_repo.git.add(A=True)
+    git_repo.index.commit('Add a long text')
+
+    git_repo.git.mv('text-file', 'renamed-text')
+    with open('renamed-text', 'a') as fp:
+        fp.write('world\n')
+    git_repo.git.add(A=True)
+    git_repo.index.commit('Rename files')
+
+
+def test__get_diffs_detect_renames(s3git, rename_commit):
+    s3git.__init__(None, detect_renames=True)
+    s3git.old_tree = s3git.get_tree('HEAD~2')
+
+    assert s3git._get_diffs() == {
+        'C': ['images/copied-image', 'images/renamed-image'],
+        'A': ['renamed-text'],
+        'D': ['image-file', 'text-file']}
+    assert s3git.copy_sources == {
+        'images/copied-image': 'image-file',
+        'images/renamed-image': 'image-file'}
+
+
+def test_synchronize_copies_renamed_files(
+        s3git_unpatched, s3_bucket, rename_commit, binary_image):
+    s3git = s3git_unpatched
+    s3git.target_tree = s3git.get_tree('HEAD~2')
+    s3git.synchronize()
+
+    s3git.__init__(None, detect_renames=True)
+    with mock.patch.object(
+            S3Bucket, 'upload', autospec=True,
+            side_effect=S3Bucket.upload) as mocked_upload:
+        s3git.synchronize()
+
+    uploaded_paths = [call[0][2] for call in mocked_upload.call_args_list]
+    assert uploaded_paths == ['renamed-text', REV_FILE_NAME]
+
+    for path in ('images/copied-image', 'images/renamed-image'):
+        remote_fp = s3_bucket.get_file(path)
+        assert remote_fp.read() == binary_image
+        remote_fp.close()
+
+    assert not s3_bucket.get_file('image-file')
+    assert not s3_bucket.get_file('text-file')
+
+
+def test__copy_files_aggregates_errors(s3git):
+    s3git.s3_settings = mock.MagicMock()
+    s3git.s3_settings.copy.side_effect = OSError
+    s3git.copy_sources = {'text-file': 'b', 'image-file': 'd'}
+
+    with pytest.raises(CopyFailed) as exc_info:
+        s3git._copy_files(['text-file', 'image-file'])
+    assert exc_info.value.msg == CopyFailed.MSG % (2, 'image-file, text-file')
+
+
+def test__copy_files_gives_the_size_of_the_copies(s3git, binary_image):
+    s3git.s3_settings = mock.MagicMock()
+    s3git.copy_sources = {'image-file': 'image'}
+
+    s3git._copy_files(['image-file'])
+
+    assert s3git.s3_settings.copy.call_args[1]['size'] == len(binary_image)
+
+
+@mock.patch.object(logger, 'info')
+def test_synchronize_uploads_duplicated_contents_once(
+        mocked_info, s3git_unpatched, s3_bucket, git_repo, binary_image):
+    s3git = s3git_unpatched
+    s3git.synchronize()
+
+    # add two copies of the image and edit the text file with the same content
+    for path in ('text-file', 'image-copy', 'other-image-copy'):
+        with open(path, 'wb') as fp:
+            fp.write(binary_image)
+    git_repo.git.add(A=True)
+    git_repo.index.commit('Duplicate the image')
+
+    s3git.__init__(None)
+    with mock.patch.object(
+            S3Bucket, 'upload', autospec=True,
+            side_effect=S3Bucket.upload) as mocked_upload:
+        s3git.synchronize()
+
+    uploaded_paths = [call[0][2] for call in mocked_upload.call_args_list]
+    assert uploaded_paths == ['image-copy', REV_FILE_NAME]
+
+    for path in ('text-file', 'image-copy', 'other-image-copy'):
+        remote_fp = s3_bucket.get_file(path)
+        assert remote_fp.read() == binary_image
+        remote_fp.close()
+
+    # the added copy and the edited file are both copied from the upload
+    mocked_info.assert_any_call(
+        'Copied %d duplicate files instead of uploading them, '
+        'saving %d bytes', 2, 2 * len(binary_image))
+    response = s3_bucket.bucket.meta.client.head_object(
+        Bucket='testBucket', Key='text-file')
+    assert response['ContentType'] == 'image/gif'
+
+    # the mime types are only kept for the manifest
+    assert not s3git.mime_types
+
+
+def _get_content_encoding(response):
+    # moto keeps the `aws-chunked` encoding of the requests, which S3 drops
+    encodings = [
+        encoding for encoding in response.get('ContentEncoding', '').split(',')
+        if encoding and encoding != 'aws-chunked']
+    return ','.join(encodings) or None
+
+
+def test_synchronize_compresses_matching_contents(
+        s3git_unpatched, s3_bucket, git_repo):
+    content = b'<p>hello</p>' * 1000
+    for path in ('page.html', 'page-copy.txt'):
+        with open(path, 'wb') as fp:
+            fp.write(content)
+    git_repo.git.add(A=True)
+    git_repo.index.commit('Add a page')
+
+    # the text contents are compressed
+    with open(S3CONFIG_PATH, 'a') as fp:
+        fp.write(
+            '[master]\n'
+            'S3_ACCESS_KEY_ID = id\n'
+            'S3_SECRET_ACCESS_KEY = secret\n'
+            'S3_BUCKET_NAME = testBucket\n'
+            'S3_COMPRESS = text/*\n')
+
+    s3git = S3GitSync(None)
+    s3git.synchronize()
+
+    client = s3_bucket.bucket.meta.client
+    for path in ('page.html', 'page-copy.txt'):
+        response = client.get_object(Bucket='testBucket', Key=path)
+        assert _get_content_encoding(response) == 'gzip'
+        assert gzip.decompress(response['Body'].read()) == content
+
+    # the copy is stored as its source, but keeps its own mime type
+    assert response['ContentType'] == 'text/plain'
+
+    # the content was only compressed and uploaded once
+    compressed_size = client.head_object(
+        Bucket='testBucket', Key='page.html')['ContentLength']
+    assert s3git.stats.stages['compress'].saved_bytes == \
+        len(content) - compressed_size
+
+    # contents too small to be worth compressing are uploaded as they are,
+    # as well as the contents not matching
+    for path in ('text-file', 'image-file'):
+        response = client.get_object(Bucket='testBucket', Key=path)
+        assert _get_content_encoding(response) is None
+
+    # the compressed contents are reused by the next syncs
+    s3git.__init__(None, force_reupload=True)
+    with mock.patch.object(
+            Compressor, '_compress_to', autospec=True) as mocked_compress:
+        s3git.synchronize()
+
+    mocked_compress.assert_not_called()
+    response = client.get_object(Bucket='testBucket', Key='page.html')
+    assert gzip.decompress(response['Body'].read()) == content
+
+
+def test_synchronize_renames_compressed_files_without_compression(
+        s3git_unpatched, s3_bucket, git_repo):
+    content = b'<p>hello</p>' * 1000
+    with open('page.html', 'wb') as fp:
+        fp.write(content)
+    git_repo.git.add(A=True)
+    git_repo.index.commit('Add a page')
+
+    with open(S3CONFIG_PATH) as fp:
+        config = fp.read()
+
+    with open(S3CONFIG_PATH, 'a') as fp:
+        fp.write(
+            '[master]\n'
+            'S3_ACCESS_KEY_ID = id\n'
+            'S3_SECRET_ACCESS_KEY = secret\n'
+            'S3_BUCKET_NAME = testBucket\n'
+            'S3_COMPRESS = *.html\n')
+    S3GitSync(None).synchronize()
+
+    # the compression is then disabled, and the page renamed
+    with open(S3CONFIG_PATH, 'w') as fp:
+        fp.write(config)
+    git_repo.git.mv('page.html', 'moved.html')
+    git_repo.index.commit('Move the page')
+
+    s3git = S3GitSync(None, detect_renames=True)
+    s3git.synchronize()
+    assert s3git.copy_sources == {'moved.html': 'page.html'}
+
+    response = s3_bucket.bucket.meta.client.get_object(
+        Bucket='testBucket', Key='moved.html')
+    assert _get_content_encoding(response) == 'gzip'
+    assert response['ContentType'] == 'text/html'
+    assert gzip.decompress(response['Body'].read()) == content
+
+
+def test_synchronize_caches_mime_types(s3git_unpatched, s3_bucket):
+    s3git = s3git_unpatched
+    s3git.synchronize()
+
+    image_sha = s3git.target_tree['image-file'].hexsha
+    cache = MimeTypeDetector(
+        get_cache_path(s3git.repo, MIME_TYPES_CACHE_FILE_NAME))
+    assert cache.guess('image-file', image_sha) == 'image/gif'
+
+
+def test__copy_file_sets_mime_type_of_new_extension(
+        s3git_unpatched, s3_bucket, binary_image):
+    s3git = s3git_unpatched
+    s3_bucket.upload(io.BytesIO(binary_image), 'image', blob_sha='abc')
+    s3git.copy_sources = {'image.txt': 'image', 'image-copy': 'image'}
+    s3git.blob_shas = {'image.txt': 'abc', 'image-copy': 'abc'}
+
+    s3git._copy_file('image.txt')
+    s3git._copy_file('image-copy')
+
+    client = s3_bucket.bucket.meta.client
+    for path, expected_mime_type in (
+            ('image.txt', 'text/plain'), ('image-copy', 'image/gif')):
+        response = client.head_object(Bucket='testBucket', Key=path)
+        assert response['ContentType'] == expected_mime_type
+        assert s3_bucket.get_blob_sha(path) == 'abc'
+
+
+def test__get_diffs_excludes_ignored_paths_through_git(s3git, git_repo):
+    os.makedirs('build/assets')
+    for path in ('build/assets/app.js', 'debug.log', 'docs.txt'):
+        with open(path, 'w') as fp:
+            fp.write('dummy')
+
+    with open('.s3ignore', 'w') as fp:
+        fp.write('build/.*\n.*\\.log$\ndocs\\.txt$\n')
+
+    git_repo.git.add(A=True)
+    git_repo.index.commit('Add ignored files')
+
+    s3git.__init__(None)
+    s3git.old_tree = s3git.get_tree('HEAD~1')
+
+    # git commands are resolved dynamically by GitPython
+    call_git_diff = functools.partial(s3git.repo.git._call_process, 'diff')
+    with mock.patch.object(
+            Git, 'diff', create=True, side_effect=call_git_diff) as diff:
+        assert s3git._get_diffs() == {'M': ['.s3ignore']}
+
+    # exact paths are left to the python matcher
+    assert diff.call_args[0][-3:] == (
+        '--',
+        ':(top,exclude,glob)build/**',
+        ':(top,exclude,glob)**/*.log')
+
+
+@mock.patch('s3git.core.DIFF_READ_SIZE', 3)
+def test__iter_git_output_joins_fields_split_across_reads(s3git, diff_commit):
+    s3git.old_tree, diffs, s3git.target_tree = diff_commit
+
+    assert s3git._get_diffs() == diffs
+
+
+def test__sync_diffs_uploads_while_reading_diffs(s3git):
+    s3git.concurrency = 1
+    s3git.s3_settings = mock.MagicMock(DELETE_MAX_COUNT_PER_REQUEST=2)
+    s3git._upload_file = mock.MagicMock()
+    deleted = s3git.s3_settings.delete_files
+    deleted.return_value = {}
+
+    def _diffs():
+        for index in range(10):
+            yield 'A', 'file-%d' % index, 'sha-%d' % index
+        # only a few uploads are waiting for the worker
+        assert s3git._upload_file.call_count >= 10 - 2 * 2
+
+        yield from [('D', 'a', None), ('D', 'b', None), ('D', 'c', None)]
+
+    s3git._sync_diffs(_diffs())
+
+    assert s3git._upload_file.call_count == 10
+    s3git._upload_file.assert_any_call('file-3', 'sha-3')
+    # the streamed blob hashes are not kept
+    assert not s3git.blob_shas
+    deleted.assert_has_calls([mock.call(['a', 'b']), mock.call(['c'])])
+
+
+def test_synchronize_resumes_interrupted_sync(
+        s3git_unpatched, s3_bucket, s3git_tracked_files):
+    s3git = s3git_unpatched
+    s3git.__init__(None, use_manifest=True)
+
+    # the sync is interrupted after uploading the image
+    upload = S3Bucket.upload
+
+    def _upload(self, fp, path, **kwargs):
+        if path != 'image-file':
+            raise OSError()
+        return upload(self, fp, path, **kwargs)
+
+    with mock.patch.object(
+            S3Bucket, 'upload', autospec=True, side_effect=_upload):
+        with pytest.raises(UploadFailed):
+            s3git.synchronize()
+
+    s3git.__init__(None, use_manifest=True)
+    with mock.patch.object(
+            S3Bucket, 'upload', autospec=True,
+            side_effect=S3Bucket.upload) as mocked_upload:
+        s3git.synchronize()
+
+    uploaded_paths = [call[0][2] for call in mocked_upload.call_args_list]
+    assert sorted(uploaded_paths) == sorted([
+        '.s3ignore', 'text-file', MANIFEST_FILE_NAME, REV_FILE_NAME])
+
+    # the mime type of the skipped file is still known
+    manifest = _get_remote_manifest(s3_bucket)
+    assert manifest.files['image-file'].mime_type == 'image/gif'
+
+    # the journal is removed once the sync is complete
+    assert not os.path.exists(
+        get_cache_path(s3git.repo, JOURNAL_FILE_NAME))
+
+
+@mock.patch('time.sleep')
+def test__delete_files_retries_failed_keys(mocked_sleep, s3git):
+    s3git.s3_settings = mock.MagicMock()
+    s3git.s3_settings.delete_files.side_effect = lambda paths: {
+        path: 'AccessDenied: Access Denied' if path == 'a'
+        else 'InternalError: Retry'
+        for path in paths if path == 'a' or mocked_sleep.call_count == 0}
+
+    with pytest.raises(DeleteFailed) as exc_info:
+        s3git._delete_files(iter([['a', 'b'], ['c']]))
+
+    # the transient failures were retried,
+    # the permanent one is reported once every attempt failed
+    assert exc_info.value.errors == {'a': 'AccessDenied: Access Denied'}
+    s3git.s3_settings.delete_files.assert_any_call(['a', 'b'])
+    s3git.s3_settings.delete_files.assert_any_call(['a'])
+
+
+def test_synchronize_failed_deletion_does_not_write_revision(
+        s3git_unpatched, s3_bucket, diff_commit):
+    s3git = s3git_unpatched
+    s3git.old_tree, diffs, s3git.target_tree = diff_commit
+    s3git._upload_new_commit_value = mock.MagicMock()
+    s3git.throttle.max_attempts = 1
+
+    with mock.patch.object(
+            S3Bucket, 'delete_files', autospec=True,
+            side_effect=lambda self, paths: dict.fromkeys(paths, 'Error')):
+        with pytest.raises(DeleteFailed):
+            s3git.synchronize()
+    assert not s3git._upload_new_commit_value.called
+
+
+def test_synchronize_writes_stats_report(
+        s3git_unpatched, s3_bucket, diff_commit, tmpdir):
+    s3git = s3git_unpatched
+    s3git.old_tree, diffs, s3git.target_tree = diff_commit
+    s3git.stats_path = tmpdir.join('stats.json').strpath
+
+    s3git.synchronize()
+
+    with open(s3git.stats_path) as fp:
+        report = json.load(fp)
+
+    assert report['succeeded']
+    assert report['info']['target_revision'] == s3git.target_tree.hexsha
+    assert report['changes'] == {
+        status: len(paths) for status, paths in diffs.items() if paths}
+
+    stages = report['stages']
+    for stage in ('diff', 'ignore', 'blob_read', 'mime', 'upload', 'rev'):
+        assert stages[stage]['count']
+    assert stages['upload']['count'] == len(diffs['A'] + diffs['M'])
+
+    requests = report['requests']
+    assert requests['PutObject']['count'] >= stages['upload']['count'] + 1
+    assert requests['DeleteObjects']['count'] == 1
+
+
+def test_synchronize_writes_stats_report_on_failure(
+        s3git_unpatched, s3_bucket, diff_commit, tmpdir):
+    s3git = s3git_unpatched
+    s3git.old_tree, diffs, s3git.target_tree = diff_commit
+    s3git.stats_path = tmpdir.join('stats.json').strpath
+    s3git.throttle.max_attempts = 1
+
+    with mock.patch.object(
+            S3Bucket, 'delete_files', autospec=True,
+            side_effect=lambda self, paths: dict.fromkeys(paths, 'Error')):
+        with pytest.raises(DeleteFailed):
+            s3git.synchronize()
+
+    with open(s3git.stats_path) as fp:
+        report = json.load(fp)
+
+    assert not report['succeeded']
+    assert report['error'].startswith('DeleteFailed')
+    assert 'rev' not in report['stages']
+
+
+def test_synchronize_writes_trace(
+        s3git_unpatched, s3_bucket, diff_commit, tmpdir):
+    s3git = s3git_unpatched
+    s3git.old_tree, diffs, s3git.target_tree = diff_commit
+    s3git.trace_path = tmpdir.join('trace.json').strpath
+
+    s3git.synchronize()
+
+    with open(s3git.trace_path) as fp:
+        events = json.load(fp)['traceEvents']
+
+    spans = {}
+    for event in events:
+        if event['ph'] == 'X':
+            spans.setdefault(event['name'], []).append(event)
+
+    assert len(spans['sync']) == 1
+    assert spans['git.read_output']
+
+    # the streamed diff is traced until it is read entirely
+    assert len(spans['sync.diff']) == 1
+    diff_span = spans['sync.diff'][0]
+    for span in spans['git.read_output']:
+        assert diff_span['ts'] <= span['ts']
+        assert span['ts'] + span['dur'] <= diff_span['ts'] + diff_span['dur']
+    assert len(spans['s3.delete']) == 1
+
+    # the file uploads, plus the revision
+    uploaded_paths = sorted(
+        span['args']['path'] for span in spans['s3.upload'])
+    assert uploaded_paths == sorted(
+        diffs['A'] + diffs['M'] + [REV_FILE_NAME])
+    assert len(spans['git.read_blob']) == len(diffs['A'] + diffs['M'])
+
+
+def test_plan_then_apply(s3git_unpatched, s3_bucket, diff_commit):
+    s3git = s3git_unpatched
+    s3git.old_tree, diffs, s3git.target_tree = diff_commit
+
+    plan = s3git.plan()
+
+    # nothing was synced yet
+    assert not s3_bucket.get_file(diffs['A'][0])
+    assert plan.remote_revision is None
+    assert plan.target_revision == s3git.target_tree.hexsha
+    assert sorted(upload.path for upload in plan.uploads) == sorted(
+        diffs['A'] + diffs['M'])
+    assert all(upload.mime_type for upload in plan.uploads)
+    assert plan.deletions == diffs['D']
+    assert plan.estimate['requests']['PutObject'] == len(plan.uploads) + 1
+
+    fp = io.StringIO()
+    plan.dump(fp)
+    fp.seek(0)
+
+    s3git = S3GitSync(None)
+    s3git._upload_file = mock.MagicMock(wraps=s3git._upload_file)
+    s3git.apply(SyncPlan.load(fp))
+
+    # the planned mime types are not detected again
+    for upload in plan.uploads:
+        s3git._upload_file.assert_any_call(
+            upload.path, upload.sha1, upload.mime_type)
+
+    assert s3git.get_remote_tree().hexsha == plan.target_revision
+    for path in diffs['A'] + diffs['M']:
+        remote_fp = s3_bucket.get_file(path)
+        assert remote_fp
+        remote_fp.close()
+
+    # the remote revision changed, the plan is outdated
+    with pytest.raises(InvalidPlan):
+        s3git.apply(plan)
+
+
+def test_apply_rejects_plan_when_remote_changed_while_planning(
+        s3git_unpatched, s3_bucket, diff_commit):
+    s3git = s3git_unpatched
+    s3git.old_tree, diffs, s3git.target_tree = diff_commit
+    get_diffs = s3git._get_diffs
+
+    def _get_diffs():
+        results = get_diffs()
+        # another sync moves the remote once the changes are computed
+        s3_bucket.upload(
+            io.BytesIO(s3git.target_tree.hexsha.encode()), REV_FILE_NAME)
+        return results
+
+    with mock.patch.object(s3git, '_get_diffs', side_effect=_get_diffs):
+        plan = s3git.plan()
+
+    # the plan keeps the revision its changes were computed against
+    assert plan.remote_revision is None
+
+    with pytest.raises(InvalidPlan):
+        S3GitSync(None).apply(plan)
+
+
+def test_apply_rejects_plan_of_another_location(s3git, diff_commit):
+    s3git.old_tree, diffs, s3git.target_tree = diff_commit
+    plan = s3git.plan()
+    plan.bucket = 'anotherBucket'
+
+    with pytest.raises(InvalidPlan):
+        s3git.apply(plan)
+
+
+def test_connection_pool_fits_the_concurrency(s3git):
+    # every upload worker can transfer 10 parts at once
+    assert S3GitSync(None).s3_settings.S3_MAX_POOL_CONNECTIONS == 84
+    assert S3GitSync(
+        None, concurrency=32).s3_settings.S3_MAX_POOL_CONNECTIONS == 324
+    assert S3GitSync(
+        None, transfer_concurrency=2).s3_settings.S3_MAX_POOL_CONNECTIONS == 20
+
+
+def test_synchronize_releases_its_client_from_the_pool(s3git_unpatched):
+    s3git = s3git_unpatched
+    s3git.synchronize()
+
+    # the pool does not keep the client of every finished sync
+    assert not [
+        key for key in RESOURCE_POOL._resources
+        if key[3] == s3git.s3_settings.pool_scope]
@@ -1,4 +1,6 @@
 import os
+import subprocess
+import sys
 from unittest import mock
 
 import pytest
@@ -8,14 +10,37 @@ from s3git.exceptions import BaseError, MissingConfigurationFile
 from s3git.s3 import S3CONFIG_PATH
 
 
-@mock.patch('s3git.__main__.S3GitSync', autospec=True)
+DEFAULT_KWARGS = {
+    'branch': None, 'force_reupload': False, 'use_wildcard': False,
+    'concurrency': None, 'reconcile': False, 'use_manifest': False,
+    'detect_renames': False, 'multipart_threshold': None,
+    'multipart_chunksize': None, 'transfer_concurrency': None,
+    'io_chunksize': None, 'stats_path': None,
+    'trace_path': None, 'dirty_check': 'tracked'}
+
+
+@mock.patch('s3git.core.S3GitSync', autospec=True)
 @pytest.mark.parametrize('argv,expected_kwargs', (
-    (['s3git'], {
-        'branch': None, 'force_reupload': False, 'use_wildcard': False}),
-    (['s3git', 'master'], {
-        'branch': 'master', 'force_reupload': False, 'use_wildcard': False}),
-    (['s3git', '-f', '-w', 'master'], {
-        'branch': 'master', 'force_reupload': True, 'use_wildcard': True})))
+    (['s3git'], DEFAULT_KWARGS),
+    (['s3git', 'master'], dict(DEFAULT_KWARGS, branch='master')),
+    (['s3git', '-f', '-w', 'master'], dict(
+        DEFAULT_KWARGS,
+        branch='master', force_reupload=True, use_wildcard=True)),
+    (['s3git', '-j', '4'], dict(DEFAULT_KWARGS, concurrency=4)),
+    (['s3git', '--reconcile'], dict(DEFAULT_KWARGS, reconcile=True)),
+    (['s3git', '--manifest'], dict(DEFAULT_KWARGS, use_manifest=True)),
+    (['s3git', '--renames'], dict(DEFAULT_KWARGS, detect_renames=True)),
+    (['s3git', '--stats-json', 'stats.json'], dict(
+        DEFAULT_KWARGS, stats_path='stats.json')),
+    (['s3git', '--trace', 'trace.json'], dict(
+        DEFAULT_KWARGS, trace_path='trace.json')),
+    (['s3git', '--dirty-check', 'off'], dict(
+        DEFAULT_KWARGS, dirty_check='off')),
+    (['s3git', '--multipart-threshold', '64M', '--multipart-chunksize', '16M',
+      '--transfer-concurrency', '32', '--io-chunksize', '1024'], dict(
+        DEFAULT_KWARGS, multipart_threshold=64 * 1024 * 1024,
+        multipart_chunksize=16 * 1024 * 1024, transfer_concurrency=32,
+        io_chunksize=1024))))
 def test_main_command_lines_arguments(mocked_S3GitSync, argv, expected_kwargs):
     with mock.patch('s3git.__main__.argv', new=argv, create=True):
         main()
@@ -32,7 +57,7 @@ def test_main_handles_internal_exceptions(mocked_error):
     def _wrapper(*args, **kwargs):
         raise BaseError(())
 
-    with mock.patch('s3git.__main__.S3GitSync.__init__', new=_wrapper):
+    with mock.patch('s3git.core.S3GitSync.__init__', new=_wrapper):
         with pytest.raises(SystemExit, message=1):
             main()
 
@@ -48,3 +73,87 @@ def test_main_missing_s3config_file_raises_error(mocked_error, s3git):
 
     mocked_error.assert_called_once_with(
         MissingConfigurationFile.MSG % S3CONFIG_PATH)
+
+
+@pytest.mark.parametrize('argv', (
+    ['-j', '0'], ['-j', '-1'], ['-j', 'abc'],
+    ['--multipart-chunksize', '8X'], ['--io-chunksize', '0']))
+def test_main_rejects_invalid_values(argv):
+    with mock.patch('s3git.__main__.argv', new=['s3git'] + argv):
+        with pytest.raises(SystemExit):
+            main()
+
+
+@mock.patch('s3git.core.S3GitSync', autospec=True)
+def test_main_writes_plan(mocked_S3GitSync, tmpdir):
+    path = tmpdir.join('plan.json').strpath
+    plan = mocked_S3GitSync.return_value.plan.return_value
+    plan.estimate = {
+        'upload_bytes': 0, 'requests': {'PutObject': 1}, 'cost_usd': 0}
+
+    with mock.patch('s3git.__main__.argv', new=['s3git', '--plan', path]):
+        main()
+
+    mocked_S3GitSync.assert_called_once_with(**DEFAULT_KWARGS)
+    plan.dump.assert_called_once_with(mock.ANY)
+    assert not mocked_S3GitSync.return_value.synchronize.called
+
+
+@mock.patch('s3git.core.S3GitSync', autospec=True)
+@mock.patch('s3git.plan.SyncPlan.load', autospec=True)
+def test_main_applies_plan(mocked_load, mocked_S3GitSync, tmpdir):
+    path = tmpdir.join('plan.json')
+    path.write('{}')
+
+    with mock.patch(
+            's3git.__main__.argv', new=['s3git', '--apply', path.strpath]):
+        main()
+
+    mocked_S3GitSync.return_value.apply.assert_called_once_with(
+        mocked_load.return_value)
+    assert not mocked_S3GitSync.return_value.synchronize.called
+
+
+@mock.patch('s3git.fanout.FanOutSync', autospec=True)
+def test_main_syncs_several_sections(mocked_FanOutSync):
+    argv = ['s3git', '-s', 'staging', '--section', 'prod']
+
+    with mock.patch('s3git.__main__.argv', new=argv):
+        main()
+
+    mocked_FanOutSync.assert_called_once_with(
+        sections=['staging', 'prod'], **DEFAULT_KWARGS)
+    mocked_FanOutSync.return_value.synchronize.assert_called_once_with()
+
+
+@pytest.mark.parametrize('argv', (
+    ['--plan', 'plan.json', '--reconcile'],
+    ['--plan', 'plan.json', '--section', 'prod'],
+    ['--plan', 'plan.json', '--apply', 'plan.json'],
+    ['--apply', 'inexisting-plan.json']))
+def test_main_rejects_invalid_plan_arguments(argv, tmpdir):
+    tmpdir.chdir()
+    tmpdir.join('plan.json').write('{}')
+
+    with mock.patch('s3git.__main__.argv', new=['s3git'] + argv):
+        with pytest.raises(SystemExit):
+            main()
+
+
+def test_dirty_check_modes_match_core():
+    from s3git.core import DIRTY_CHECK_MODES
+    from s3git.__main__ import DIRTY_CHECK_MODES as MAIN_DIRTY_CHECK_MODES
+
+    assert MAIN_DIRTY_CHECK_MODES == DIRTY_CHECK_MODES
+
+
+def test_importing_the_command_does_not_import_the_sync_modules():
+    # the modules are checked in a new interpreter, as they are already
+    # imported by the other tests
+    code = (
+        'import sys, s3git.__main__; '
+        'print(" ".join(sorted({"git", "boto3", "magic"} & set(sys.modules))))')
+    output = subprocess.check_output(
+        [sys.executable, '-c', code],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert output.decode().strip() == ''
@@ -0,0 +1,190 @@
+import os
+import threading
+from hashlib import sha1
+from io import BytesIO
+from tempfile import TemporaryFile
+from unittest import mock
+
+import pytest
+
+from s3git.blobs import BlobReader, BlobReaderPool, SharedBlobCache
+from s3git.exceptions import MissingGitObject
+
+
+def test_read_by_path_is_binary_safe(git_repo, binary_image):
+    reader = BlobReader(git_repo)
+    try:
+        fp = reader.read('master:image-file')
+        assert fp.read() == binary_image
+
+        # the process is reused for the next objects
+        fp = reader.read('master:text-file')
+        assert fp.read() == b'hello'
+    finally:
+        reader.close()
+
+
+def test_read_by_blob_sha(git_repo, binary_image):
+    blob_sha = git_repo.tree('master')['image-file'].hexsha
+
+    reader = BlobReader(git_repo)
+    try:
+        fp = reader.read(blob_sha)
+        assert sha1(fp.read()).hexdigest() == sha1(binary_image).hexdigest()
+    finally:
+        reader.close()
+
+
+def test_read_missing_object_raises_error(git_repo):
+    reader = BlobReader(git_repo)
+    try:
+        with pytest.raises(MissingGitObject):
+            reader.read('master:inexistent file')
+
+        # the reader is still usable afterwards
+        assert reader.read('master:text-file').read() == b'hello'
+    finally:
+        reader.close()
+
+
+def test_pool_gives_a_reader_per_thread(git_repo):
+    pool = BlobReaderPool(git_repo)
+    readers = []
+    processes = []
+
+    def _worker():
+        reader = pool.get()
+        readers.append(reader)
+        assert pool.get() is reader
+        assert pool.read('master:text-file').read() == b'hello'
+        processes.append(reader._process.proc)
+
+    threads = [threading.Thread(target=_worker) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(map(id, readers))) == 3
+
+    pool.close()
+    for process in processes:
+        assert process.poll() is not None
+
+    # the pool can still be used after being closed
+    assert pool.read('master:text-file').read() == b'hello'
+    pool.close()
+
+
+@pytest.mark.parametrize('spool_max_size,expected_type', (
+    (1024, BytesIO), (10, None)))
+def test_read_spools_big_objects(
+        git_repo, binary_image, spool_max_size, expected_type):
+    reader = BlobReader(git_repo, spool_max_size=spool_max_size)
+    try:
+        with mock.patch('s3git.blobs.COPY_BUFFER_SIZE', new=4):
+            fp = reader.read('master:image-file')
+
+        if expected_type is not None:
+            assert isinstance(fp, expected_type)
+        else:
+            assert not isinstance(fp, BytesIO)
+
+        assert fp.tell() == 0
+        assert fp.read() == binary_image
+        fp.close()
+
+        # the stream is still in sync for the next objects
+        assert reader.read('master:text-file').read() == b'hello'
+    finally:
+        reader.close()
+
+
+def test_read_failure_discards_the_process(git_repo):
+    reader = BlobReader(git_repo)
+    try:
+        reader.read('master:text-file')
+        process = reader._process
+
+        with mock.patch('s3git.blobs.BytesIO') as mocked_bytes_io:
+            mocked_bytes_io.return_value.write.side_effect = OSError
+            with pytest.raises(OSError):
+                reader.read('master:image-file')
+            mocked_bytes_io.return_value.close.assert_called_once_with()
+
+        assert process.proc.poll() is not None
+        assert reader.read('master:text-file').read() == b'hello'
+    finally:
+        reader.close()
+
+
+def _temporary_file(content):
+    fp = TemporaryFile()
+    fp.write(content)
+    fp.seek(0)
+    return fp
+
+
+@pytest.mark.parametrize('read_content', (BytesIO, _temporary_file))
+def test_shared_cache_reads_every_blob_once(read_content, binary_image):
+    reader = mock.MagicMock(
+        spec=BlobReaderPool,
+        **{'read.side_effect': lambda name: read_content(binary_image)})
+    cache = SharedBlobCache(reader)
+    cache.expect('sha')
+    cache.expect('sha')
+
+    first_fp, second_fp = cache.read('sha'), cache.read('sha')
+    reader.read.assert_called_once_with('sha')
+
+    # every consumer reads at its own position
+    assert first_fp.read(4) == binary_image[:4]
+    assert second_fp.seek(0, os.SEEK_END) == len(binary_image)
+    assert first_fp.read() == binary_image[4:]
+    second_fp.seek(0)
+    assert second_fp.read() == binary_image
+    first_fp.close()
+    second_fp.close()
+
+    # the blob was released, it is read again for unexpected consumers
+    cache.read('sha').close()
+    assert reader.read.call_count == 2
+
+
+@pytest.mark.parametrize('read_content', (BytesIO, _temporary_file))
+def test_shared_cache_evicts_blobs_released_by_their_consumers(
+        read_content, binary_image):
+    fp = read_content(binary_image)
+    reader = mock.MagicMock(spec=BlobReaderPool, **{'read.return_value': fp})
+    cache = SharedBlobCache(reader)
+    cache.expect('sha')
+    cache.expect('sha')
+
+    view = cache.read('sha')
+    cache.release('sha')
+
+    # the other consumer skipped the blob, it is evicted
+    assert not cache._blobs
+    assert view.read() == binary_image
+    view.close()
+    assert fp.closed
+
+    # releasing unexpected blobs is harmless
+    cache.release('other')
+
+
+def test_shared_cache_clear_releases_unread_blobs():
+    fp = _temporary_file(b'content')
+    reader = mock.MagicMock(spec=BlobReaderPool, **{'read.return_value': fp})
+    cache = SharedBlobCache(reader)
+    cache.expect('sha')
+    cache.expect('sha')
+
+    view = cache.read('sha')
+    cache.clear()
+
+    # the content is still readable until the last view is closed
+    assert view.read() == b'content'
+    assert not fp.closed
+    view.close()
+    assert fp.closed
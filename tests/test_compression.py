@@ -0,0 +1,85 @@
+import gzip
+import os
+import sys
+from io import BytesIO
+from unittest import mock
+
+import pytest
+
+from s3git.compression import ENCODING_BROTLI, SKIPPED_SUFFIX, Compressor
+from s3git.exceptions import MissingDependency
+
+CONTENT = b'<p>hello</p>' * 100
+
+
+@pytest.mark.parametrize('path,mime_type,expected', (
+    ('index.html', None, True),
+    ('static/app.js', None, True),
+    ('data', 'text/plain', True),
+    ('image.gif', 'image/gif', False),
+    ('app.js.map', None, False)))
+def test_match(path, mime_type, expected):
+    compressor = Compressor('cache', ('*.html', '*.js', 'text/*'))
+    assert compressor.match(path, mime_type) is expected
+
+
+def test_compress_caches_the_compressed_content(tmpdir):
+    compressor = Compressor(tmpdir.strpath, ('*',))
+    fp = BytesIO(CONTENT)
+
+    with compressor.compress('abc', fp) as compressed_fp:
+        assert gzip.decompress(compressed_fp.read()) == CONTENT
+
+    # the content is not read nor compressed again
+    with mock.patch.object(
+            compressor, '_compress_to', autospec=True) as mocked_compress:
+        with compressor.compress('abc', BytesIO()) as compressed_fp:
+            assert gzip.decompress(compressed_fp.read()) == CONTENT
+
+    mocked_compress.assert_not_called()
+    assert os.listdir(compressor.cache_dir) == ['abc']
+
+
+def test_compress_skips_poorly_compressed_contents(tmpdir):
+    compressor = Compressor(tmpdir.strpath, ('*',))
+    fp = BytesIO(os.urandom(1024))
+    fp.seek(0)
+
+    assert compressor.compress('abc', fp) is None
+    assert fp.tell() == 0
+
+    # the outcome is cached as well
+    with mock.patch.object(
+            compressor, '_compress_to', autospec=True) as mocked_compress:
+        assert compressor.compress('abc', fp) is None
+
+    mocked_compress.assert_not_called()
+    assert os.listdir(compressor.cache_dir) == ['abc' + SKIPPED_SUFFIX]
+
+
+def test_cache_is_keyed_by_settings(tmpdir):
+    with mock.patch('s3git.compression._import_brotli'):
+        gzip_compressor = Compressor(tmpdir.strpath, ('*',))
+        brotli_compressor = Compressor(
+            tmpdir.strpath, ('*',), ENCODING_BROTLI)
+
+    assert gzip_compressor.cache_dir != brotli_compressor.cache_dir
+
+
+def test_brotli_requires_brotli_package():
+    with mock.patch.dict(sys.modules, {'brotli': None}):
+        with pytest.raises(MissingDependency):
+            Compressor('cache', ('*',), ENCODING_BROTLI)
+
+
+def test_compress_with_brotli(tmpdir):
+    brotli = mock.MagicMock()
+    brotli.Compressor.return_value.process.side_effect = lambda data: data
+    brotli.Compressor.return_value.finish.return_value = b''
+
+    with mock.patch.dict(sys.modules, {'brotli': brotli}):
+        compressor = Compressor(tmpdir.strpath, ('*',), ENCODING_BROTLI)
+
+    # the content is passed through, thus is not worth compressing
+    assert compressor.compress('abc', BytesIO(CONTENT)) is None
+    brotli.Compressor.return_value.process.assert_called_once_with(CONTENT)
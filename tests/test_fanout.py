@@ -0,0 +1,167 @@
+import json
+from io import BytesIO
+from unittest import mock
+
+import boto3
+import pytest
+
+from s3git.blobs import BlobReaderPool, SharedBlobCache
+from s3git.core import REV_FILE_NAME, W_DIRTY_REPO_MSG
+from s3git.core import logger as core_logger
+from s3git.exceptions import *
+from s3git.fanout import FanOutSync
+from s3git.s3 import S3CONFIG_PATH, S3Bucket
+
+CONFIG = """\
+[staging]
+S3_ACCESS_KEY_ID = id
+S3_SECRET_ACCESS_KEY = secret
+S3_BUCKET_NAME = staging
+
+[prod]
+S3_ACCESS_KEY_ID = id
+S3_SECRET_ACCESS_KEY = secret
+S3_BUCKET_NAME = prod
+S3_UPLOAD_LOCATION = site
+"""
+
+
+@pytest.fixture
+def buckets(s3_bucket, git_repo):
+    with open(S3CONFIG_PATH, 'w') as fp:
+        fp.write(CONFIG)
+
+    s3 = boto3.resource('s3')
+    s3.create_bucket(Bucket='staging')
+    s3.create_bucket(Bucket='prod')
+
+    return {
+        'staging': S3Bucket(S3_BUCKET_NAME='staging'),
+        'prod': S3Bucket(S3_BUCKET_NAME='prod', S3_UPLOAD_LOCATION='site')}
+
+
+def _read(bucket: S3Bucket, path):
+    fp = bucket.get_file(path)
+    if fp is None:
+        return None
+
+    try:
+        return fp.read()
+    finally:
+        fp.close()
+
+
+def test_synchronize_reads_every_blob_once(
+        buckets, git_repo, s3git_tracked_files):
+    read = BlobReaderPool.read
+
+    with mock.patch.object(
+            BlobReaderPool, 'read', autospec=True, side_effect=read) \
+            as mocked_read:
+        FanOutSync(None, ['staging', 'prod']).synchronize()
+
+    read_names = [call[0][1] for call in mocked_read.call_args_list]
+    assert len(read_names) == len(s3git_tracked_files)
+    assert len(set(read_names)) == len(read_names)
+
+    for bucket in buckets.values():
+        assert _read(bucket, REV_FILE_NAME).decode() == \
+            git_repo.head.commit.tree.hexsha
+
+        for path in s3git_tracked_files:
+            with open(path, 'rb') as fp:
+                assert _read(bucket, path) == fp.read()
+
+
+def test_synchronize_releases_the_blobs_a_section_skips(buckets, git_repo):
+    fan_out = FanOutSync(None, ['staging', 'prod'])
+
+    # the prod section resumes a sync which already synced every file
+    fan_out.targets['prod']._resume_from_journal = \
+        lambda path, sha1_hash: True
+
+    left_blobs = []
+    clear = SharedBlobCache.clear
+
+    def _clear(cache):
+        left_blobs.extend(cache._blobs)
+        clear(cache)
+
+    with mock.patch.object(
+            SharedBlobCache, 'clear', autospec=True, side_effect=_clear):
+        fan_out.synchronize()
+
+    assert not left_blobs
+
+
+def test_synchronize_diffs_every_section_from_its_revision(
+        buckets, git_repo, diff_commit, tmpdir):
+    old_tree, diffs, new_tree = diff_commit
+
+    # only the staging bucket is at the previous revision
+    buckets['staging'].upload(
+        BytesIO(old_tree.hexsha.encode()), REV_FILE_NAME)
+    buckets['prod'].upload(BytesIO(new_tree.hexsha.encode()), REV_FILE_NAME)
+
+    stats_path = tmpdir.join('stats.json').strpath
+    FanOutSync(None, ['staging', 'prod'], stats_path=stats_path).synchronize()
+
+    assert _read(buckets['staging'], REV_FILE_NAME).decode() == \
+        new_tree.hexsha
+    for path in diffs['A'] + diffs['M']:
+        assert _read(buckets['staging'], path)
+        assert _read(buckets['prod'], path) is None
+
+    with open(stats_path) as fp:
+        report = json.load(fp)
+    assert report['up_to_date_sections'] == ['prod']
+    assert report['sections']['staging']['changes'] == {
+        'A': 1, 'M': 1, 'D': 1}
+
+
+def test_synchronize_raises_if_every_section_is_up_to_date(
+        buckets, git_repo):
+    for bucket in buckets.values():
+        bucket.upload(
+            BytesIO(git_repo.head.commit.tree.hexsha.encode()),
+            REV_FILE_NAME)
+
+    with pytest.raises(RemoteUpToDate):
+        FanOutSync(None, ['staging', 'prod']).synchronize()
+
+
+def test_synchronize_reports_failed_sections(buckets, git_repo):
+    fan_out = FanOutSync(None, ['staging', 'prod'])
+    fan_out.targets['prod']._upload_new_commit_value = mock.MagicMock(
+        side_effect=ValueError('failed'))
+
+    with pytest.raises(FanOutFailed) as exc_info:
+        fan_out.synchronize()
+
+    assert list(exc_info.value.errors) == ['prod']
+    assert _read(buckets['staging'], REV_FILE_NAME)
+
+
+def test_unknown_section_raises(buckets, git_repo):
+    with pytest.raises(UnknownConfigurationSection):
+        FanOutSync(None, ['staging', 'inexistent'])
+
+
+@mock.patch.object(core_logger, 'warn')
+def test_repository_is_checked_once(mocked_warn, buckets, git_repo):
+    open('text-file', 'w').close()
+
+    FanOutSync(None, ['staging', 'prod'])
+    mocked_warn.assert_called_once_with(W_DIRTY_REPO_MSG)
+
+
+def test_stats_only_count_the_requests_of_their_section(
+        buckets, s3git_tracked_files):
+    fan_out = FanOutSync(None, ['staging', 'prod'])
+    fan_out.synchronize()
+
+    # the sections share their credentials, but not their client;
+    # every file and the revision are uploaded to every section
+    for target in fan_out.targets.values():
+        assert target.stats.requests['PutObject'].count == \
+            len(s3git_tracked_files) + 1
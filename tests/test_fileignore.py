@@ -4,8 +4,8 @@ from unittest import mock
 import pytest
 
 from s3git.fileignore import (
-    REGEX_PARSER, compile_ignore_file, get_parser, retrieve_ignore_patterns,
-    wildcard_to_regex_parser)
+    REGEX_PARSER, IgnoreMatcher, compile_ignore_file, get_parser,
+    retrieve_ignore_patterns, wildcard_to_regex_parser)
 
 
 @pytest.mark.parametrize('use_wildcard,expected', (
@@ -48,3 +48,71 @@ def test_compile_ignore_file_with_invalid_extended_regexes(
 
     with pytest.raises(re.error, message='Failed to parse: *\.py[cod]'):
         compile_ignore_file(fp, parser)
+
+
+REGEX_RULES = (
+    r'node_modules/', r'build/.*', r'dist', r'[^\.]+\.pyc', r'file\d{3}',
+    r'.*\.log$', r'docs/index\.html$', r'(?i)readme', r'tmp|cache',
+    r'(a)\1', r'.*~', r'vendor/.*\.min\.js$', r'ab*c')
+
+WILDCARD_RULES = (
+    '*.pyc', 'node_modules/*', '*.py[cod]', 'a*b*c', 'build/', '?x',
+    'docs/index.html', '*/.DS_Store', '*.tar.gz', 'logs/*.log')
+
+PATHS = (
+    'node_modules/a/b.js', 'src/node_modules/a.js', 'build', 'build/a',
+    'builder/a', 'dist/a', 'distance', 'a.pyc', 'a/b.pyc', 'file123',
+    'file12', 'a/file123', 'debug.log', 'debug.log.1', 'docs/index.html',
+    'docs/index.htm', 'README.md', 'a/readme', 'tmp/a', 'cache', 'aa', 'ab',
+    'file~', 'vendor/a.min.js', 'vendor/a.js', 'ac', 'abbbc', 'x', 'xx',
+    'a.pyo', 'a/b/c/.DS_Store', '.DS_Store', 'a.tar.gz', 'logs/a.log',
+    'logs/a/b.log', 'abc', 'a/x', 'build/', 'a\nb.pyc', 'dist\n', '')
+
+
+@pytest.mark.parametrize('use_wildcard,rules', (
+    (False, REGEX_RULES), (True, WILDCARD_RULES)))
+def test_ignore_matcher_matches_like_patterns(use_wildcard, rules):
+    parser = get_parser(use_wildcard)
+    patterns = [parser(rule) for rule in rules]
+    matcher = IgnoreMatcher(patterns)
+
+    for path in PATHS:
+        expected = any(pattern.match(path) for pattern in patterns)
+        assert matcher.match(path) == expected, path
+
+
+def test_ignore_matcher_indexes_simple_patterns():
+    patterns = [
+        REGEX_PARSER(rule) for rule in (
+            r'node_modules/', r'build/.*', r'dist', r'exact$', r'.*\.log$',
+            r'.*\.min\.js$', r'file\d{3}', r'file\w+', r'[a-z]+\.txt')]
+    matcher = IgnoreMatcher(patterns)
+
+    assert matcher._directories == {'node_modules/', 'build/'}
+    assert matcher._prefixes == ('dist',)
+    assert matcher._exact_paths == {'exact'}
+    assert matcher._extensions == {'.log'}
+    assert matcher._suffixes == ('.min.js',)
+
+    # the remaining patterns are combined per first character
+    assert len(matcher._regexes['f']) == 1
+    assert len(matcher._any_start_regexes) == 1
+
+
+def test_ignore_matcher_without_patterns():
+    assert not IgnoreMatcher([]).match('file')
+
+
+def test_ignore_matcher_git_pathspecs():
+    patterns = [
+        REGEX_PARSER(rule) for rule in (
+            r'build/.*', r'dist', r'exact$', r'.*\.log$', r'.*/\.DS_Store$',
+            r'we\*rd/', r'file\d{3}')]
+
+    assert IgnoreMatcher(patterns).get_git_pathspecs() == [
+        ':(top,exclude,glob)build/**',
+        ':(top,exclude,glob)dist*',
+        ':(top,exclude,glob)dist*/**',
+        ':(top,exclude,glob)**/*.log',
+        ':(top,exclude,glob)**/*/.DS_Store',
+        ':(top,exclude,glob)we\\*rd/**']
@@ -0,0 +1,90 @@
+from s3git.journal import SyncJournal
+
+
+def test_journal_resumes_the_same_sync(tmpdir):
+    path = tmpdir.join('cache', 'journal').strpath
+
+    journal = SyncJournal.open(path, 'bucket a..b')
+    journal.record('image', 'abc', 'image/gif')
+    journal.record('empty', 'def', None)
+    journal.close()
+
+    journal = SyncJournal.open(path, 'bucket a..b')
+    assert journal.is_synced('image', 'abc')
+    assert journal.get_mime_type('image') == 'image/gif'
+    assert journal.is_synced('empty', 'def')
+
+    # the file was synced with another content
+    assert not journal.is_synced('image', 'def')
+    assert not journal.is_synced('other', 'abc')
+    journal.close()
+
+
+def test_journal_of_another_sync_is_not_resumed(tmpdir):
+    path = tmpdir.join('journal').strpath
+
+    journal = SyncJournal.open(path, 'bucket a..b')
+    journal.record('image', 'abc', 'image/gif')
+    journal.close()
+
+    journal = SyncJournal.open(path, 'bucket a..c')
+    assert not journal.entries
+    journal.close()
+
+    # the journal was restarted for the new sync
+    assert not SyncJournal.open(path, 'bucket a..b').entries
+
+
+def test_journal_ignores_partially_written_lines(tmpdir):
+    path = tmpdir.join('journal').strpath
+
+    journal = SyncJournal.open(path, 'bucket a..b')
+    journal.record('image', 'abc', 'image/gif')
+    journal.close()
+
+    with open(path, 'a') as fp:
+        fp.write('["text", "de')
+
+    journal = SyncJournal.open(path, 'bucket a..b')
+    assert list(journal.entries) == ['image']
+    journal.discard()
+    assert not tmpdir.join('journal').exists()
+
+
+def test_journal_resumes_twice_after_a_partial_write(tmpdir):
+    path = tmpdir.join('journal').strpath
+
+    journal = SyncJournal.open(path, 'bucket a..b')
+    journal.record('a', 'abc', None)
+    journal.close()
+
+    with open(path, 'a') as fp:
+        fp.write('["b", "de')
+
+    # the partial line is dropped, the next entries are kept
+    journal = SyncJournal.open(path, 'bucket a..b')
+    journal.record('c', 'ghi', 'text/plain')
+    journal.close()
+
+    journal = SyncJournal.open(path, 'bucket a..b')
+    journal.record('d', 'jkl', None)
+    journal.close()
+
+    journal = SyncJournal.open(path, 'bucket a..b')
+    assert list(journal.entries) == ['a', 'c', 'd']
+    journal.close()
+
+
+def test_journal_skips_invalid_lines(tmpdir):
+    path = tmpdir.join('journal').strpath
+
+    journal = SyncJournal.open(path, 'bucket a..b')
+    journal.record('a', 'abc', None)
+    journal.close()
+
+    with open(path, 'a') as fp:
+        fp.write('["b"]\n["c", "def", null]\n')
+
+    journal = SyncJournal.open(path, 'bucket a..b')
+    assert list(journal.entries) == ['a', 'c']
+    journal.close()
@@ -0,0 +1,29 @@
+import gzip
+from io import BytesIO
+
+import pytest
+
+from s3git.manifest import MANIFEST_VERSION, Manifest, ManifestEntry
+
+
+def test_dump_and_load():
+    files = {
+        'a': ManifestEntry('123', 10, 'text/plain'),
+        'b/c': ManifestEntry('456', 0, None)}
+    fp = BytesIO()
+
+    Manifest('abc', files).dump(fp)
+    fp.seek(0)
+    manifest = Manifest.load(fp)
+
+    assert manifest.revision == 'abc'
+    assert manifest.files == files
+    assert manifest.files['a'].mime_type == 'text/plain'
+
+
+@pytest.mark.parametrize('content', (
+    b'not gzip',
+    gzip.compress(b'not json'),
+    gzip.compress(b'{"version": %d}' % (MANIFEST_VERSION + 1))))
+def test_load_invalid_manifest_returns_none(content):
+    assert Manifest.load(BytesIO(content)) is None
@@ -0,0 +1,71 @@
+import threading
+from io import BytesIO
+from unittest import mock
+
+from s3git.mime import MimeTypeDetector
+
+
+def test_detect_from_extension_does_not_read_content(binary_image):
+    detector = MimeTypeDetector()
+    fp = BytesIO(binary_image)
+
+    assert detector.detect('style.css', fp, 'abc') == 'text/css'
+    assert fp.tell() == 0
+    assert detector.guess('style.css') == 'text/css'
+
+
+def test_detect_from_content(binary_image):
+    detector = MimeTypeDetector()
+    fp = BytesIO(binary_image)
+
+    assert detector.guess('image', 'abc') is None
+    assert detector.detect('image', fp, 'abc') == 'image/gif'
+    assert fp.tell() == 0
+
+    # the sniffed mime type is now cached for the blob
+    assert detector.guess('image', 'abc') == 'image/gif'
+    with mock.patch.object(detector, '_get_magic') as mocked_magic:
+        assert detector.detect('other-path', fp, 'abc') == 'image/gif'
+    mocked_magic.assert_not_called()
+
+
+def test_detect_encoded_files_from_content():
+    detector = MimeTypeDetector()
+    fp = BytesIO(b'\x1f\x8b\x08\x00' + b'\x00' * 16)
+    assert detector.detect('archive.tar.gz', fp) == 'application/gzip'
+
+
+def test_cache_is_persisted(tmpdir, binary_image):
+    cache_path = tmpdir.join('cache', 'mime-types').strpath
+
+    detector = MimeTypeDetector(cache_path)
+    detector.detect('image', BytesIO(binary_image), 'abc')
+    detector.detect('text', BytesIO(b'hello'), 'def')
+    detector.save()
+
+    # saving again only appends new entries
+    detector.save()
+    with open(cache_path) as fp:
+        assert sorted(fp.read().splitlines()) == [
+            'abc image/gif', 'def text/plain']
+
+    detector = MimeTypeDetector(cache_path)
+    assert detector.guess('image', 'abc') == 'image/gif'
+    assert detector.guess('text', 'def') == 'text/plain'
+
+
+def test_magic_instance_per_thread():
+    detector = MimeTypeDetector()
+    instances = []
+
+    def _worker():
+        instances.append(detector._get_magic())
+        assert detector._get_magic() is instances[-1]
+
+    threads = [threading.Thread(target=_worker) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert instances[0] is not instances[1]
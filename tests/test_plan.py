@@ -0,0 +1,64 @@
+import io
+import json
+
+import pytest
+from boto3.s3.transfer import TransferConfig
+
+from s3git.exceptions import InvalidPlan
+from s3git.plan import (
+    PLAN_VERSION, PlannedCopy, PlannedUpload, SyncPlan, estimate_plan)
+
+MiB = 1024 * 1024
+
+
+def _get_plan(**kwargs):
+    return SyncPlan('bucket', 'location/', 'abc', 'abc', 'def', **kwargs)
+
+
+def test_dump_and_load():
+    plan = _get_plan(
+        uploads=[PlannedUpload('a', '123', 10, 'text/plain')],
+        copies=[PlannedCopy('b', 'old-b', '456', 20)],
+        duplicates=[PlannedCopy('c', 'a', '123', 10)],
+        deletions=['d'], use_manifest=True, estimate={'cost_usd': 0.1})
+    fp = io.StringIO()
+
+    plan.dump(fp)
+    fp.seek(0)
+    loaded = SyncPlan.load(fp)
+
+    assert vars(loaded) == vars(plan)
+
+
+@pytest.mark.parametrize('content', (
+    'not json',
+    '[]',
+    json.dumps({'version': PLAN_VERSION + 1}),
+    json.dumps({'version': PLAN_VERSION, 'bucket': 'bucket'})))
+def test_load_invalid_plan_raises(content):
+    with pytest.raises(InvalidPlan):
+        SyncPlan.load(io.StringIO(content))
+
+
+def test_estimate_plan_counts_requests_by_type():
+    plan = _get_plan(
+        uploads=[
+            PlannedUpload('small', '1', MiB, None),
+            PlannedUpload('big', '2', 20 * MiB, None)],
+        copies=[PlannedCopy('copy', 'source', '3', MiB)],
+        deletions=['deleted-%d' % i for i in range(1500)])
+
+    def get_transfer_config(size=None):
+        return TransferConfig(
+            multipart_threshold=8 * MiB, multipart_chunksize=8 * MiB)
+
+    estimate = estimate_plan(plan, get_transfer_config, 1000)
+
+    assert estimate['upload_bytes'] == 21 * MiB
+    assert estimate['copy_bytes'] == MiB
+    assert estimate['requests'] == {
+        'CompleteMultipartUpload': 1, 'CopyObject': 1,
+        'CreateMultipartUpload': 1, 'DeleteObjects': 2, 'HeadObject': 2,
+        'PutObject': 2, 'UploadPart': 3}
+    assert estimate['cost_usd'] == pytest.approx(
+        8 * 0.005 / 1000 + 2 * 0.0004 / 1000)
@@ -6,38 +6,102 @@ import botocore.exceptions
 import pytest
 
 from s3git.exceptions import *
-from s3git.s3 import S3CONFIG_PATH, S3Bucket
+from s3git.s3 import (
+    BLOB_SHA_METADATA_KEY, DEFAULT_MULTIPART_CHUNKSIZE,
+    DEFAULT_MULTIPART_THRESHOLD, MAX_PART_COUNT, MAX_PART_SIZE, MiB,
+    S3CONFIG_PATH, S3Bucket, S3ResourcePool, get_adaptive_chunksize)
 
 
-@mock.patch('boto3.resource')
-def test_bucket_passes_correct_parameters(mocked_resource):
+@mock.patch('boto3.session.Session')
+def test_bucket_passes_correct_parameters(mocked_session):
     s3_bucket = S3Bucket()
     s3_bucket.S3_ACCESS_KEY_ID = 'keyid'
     s3_bucket.S3_SECRET_ACCESS_KEY = 'secret'
     s3_bucket.S3_BUCKET_NAME = 'mybucket'
+    s3_bucket.S3_MAX_POOL_CONNECTIONS = 32
+    s3_bucket.S3_READ_TIMEOUT = 30
 
-    bucket = mocked_resource.return_value
+    resource = mocked_session.return_value.resource
+    bucket = resource.return_value
 
     assert s3_bucket.bucket == bucket.Bucket.return_value
     bucket.Bucket.assert_called_once_with('mybucket')
 
-    mocked_resource.assert_called_once_with(
-        service_name='s3',
+    mocked_session.assert_called_once_with(
         aws_access_key_id='keyid',
-        aws_secret_access_key='secret',
-        endpoint_url=None)
+        aws_secret_access_key='secret')
+    resource.assert_called_once_with(
+        service_name='s3', endpoint_url=None, config=mock.ANY)
+
+    config = resource.call_args[1]['config']
+    assert config.max_pool_connections == 32
+    assert config.read_timeout == 30
+
+
+@mock.patch('boto3.session.Session')
+def test_bucket_is_cached_per_instance(mocked_session):
+    mocked_session.return_value.resource.return_value.Bucket.side_effect = \
+        lambda name: name
+    first_bucket = S3Bucket(S3_BUCKET_NAME='first')
+    second_bucket = S3Bucket(S3_BUCKET_NAME='second')
+
+    assert first_bucket.bucket == 'first'
+    assert second_bucket.bucket == 'second'
+    assert first_bucket.bucket == 'first'
+
+    # the buckets share the same credentials, thus the same resource
+    assert mocked_session.call_count == 1
+
+
+@mock.patch('boto3.session.Session')
+def test_resource_pool_is_keyed_by_credentials_and_settings(mocked_session):
+    mocked_session.return_value.resource.side_effect = \
+        lambda **kwargs: mock.MagicMock()
+    pool = S3ResourcePool()
+
+    resource = pool.get(None, 'id', 'secret', max_pool_connections=10)
+    assert pool.get(None, 'id', 'secret', max_pool_connections=10) \
+        is resource
+    assert pool.get(None, 'id', 'other', max_pool_connections=10) \
+        is not resource
+    assert pool.get(None, 'id', 'secret', max_pool_connections=20) \
+        is not resource
+    assert pool.get('http://s3', 'id', 'secret', max_pool_connections=10) \
+        is not resource
+
+    # the scopes don't share their resource, but share their session
+    session_count = mocked_session.call_count
+    assert pool.get(None, 'id', 'secret', scope=1, max_pool_connections=10) \
+        is not resource
+    assert mocked_session.call_count == session_count
+
+    # the released scopes get a new resource
+    scoped = pool.get(None, 'id', 'secret', scope=1, max_pool_connections=10)
+    pool.release(1)
+    assert pool.get(None, 'id', 'secret', scope=1, max_pool_connections=10) \
+        is not scoped
+    assert pool.get(None, 'id', 'secret', max_pool_connections=10) \
+        is resource
+
+    pool.clear()
+    assert pool.get(None, 'id', 'secret', max_pool_connections=10) \
+        is not resource
 
 
 def test__repr__():
     repr(S3Bucket())
 
 
+# every option is `None` unless set
+NO_OPTIONS = dict.fromkeys(S3Bucket.OPTION_KEYS)
+
+
 def test_as_dict():
-    kwargs = {
-        'S3_ACCESS_KEY_ID': 'keyid',
-        'S3_SECRET_ACCESS_KEY': 'secret',
-        'S3_BUCKET_NAME': 'mybucket',
-        'S3_UPLOAD_LOCATION': None}
+    kwargs = dict(
+        NO_OPTIONS,
+        S3_ACCESS_KEY_ID='keyid',
+        S3_SECRET_ACCESS_KEY='secret',
+        S3_BUCKET_NAME='mybucket')
     s3_bucket = S3Bucket(**kwargs)
     assert s3_bucket.as_dict == kwargs
 
@@ -63,7 +127,7 @@ def test_upload(binary_image, s3_bucket: S3Bucket, base_path, expected_key):
     s3_bucket.upload(in_fp, 'binary-image')
     mocked_upload_fileobj.assert_called_once_with(
         Fileobj=in_fp, Key=expected_key,
-        ExtraArgs={'ContentType': 'image/gif'})
+        ExtraArgs={'ContentType': 'image/gif'}, Config=mock.ANY)
 
     s3_bucket.bucket.download_fileobj(Key=expected_key, Fileobj=out_fp)
 
@@ -71,6 +135,103 @@ def test_upload(binary_image, s3_bucket: S3Bucket, base_path, expected_key):
     assert out_fp.read() == binary_image
 
 
+@pytest.mark.parametrize('size,concurrency,expected_chunksize', (
+    (0, 10, DEFAULT_MULTIPART_CHUNKSIZE),
+    (100 * MiB, 10, DEFAULT_MULTIPART_CHUNKSIZE),
+    (1024 * MiB, 10, 26 * MiB),
+    (1024 * MiB, 64, DEFAULT_MULTIPART_CHUNKSIZE),
+    (1024 * 1024 * MiB, 5000, 105 * MiB),
+    (50 * 1024 * 1024 * MiB, 1, MAX_PART_SIZE)))
+def test_get_adaptive_chunksize(size, concurrency, expected_chunksize):
+    chunksize = get_adaptive_chunksize(size, concurrency)
+    assert chunksize == expected_chunksize
+    assert chunksize % MiB == 0
+
+    if chunksize < MAX_PART_SIZE:
+        assert size / chunksize <= MAX_PART_COUNT
+
+
+def test_get_transfer_config_defaults():
+    config = S3Bucket().get_transfer_config(1024 * MiB)
+    assert config.multipart_threshold == DEFAULT_MULTIPART_THRESHOLD
+    assert config.multipart_chunksize == 26 * MiB
+    assert config.max_concurrency == 10
+
+
+def test_get_transfer_config_from_settings():
+    s3_bucket = S3Bucket(
+        S3_MULTIPART_THRESHOLD=64 * MiB, S3_MULTIPART_CHUNKSIZE=16 * MiB,
+        S3_TRANSFER_CONCURRENCY=20, S3_IO_CHUNKSIZE=MiB)
+    config = s3_bucket.get_transfer_config(1024 * MiB)
+
+    assert config.multipart_threshold == 64 * MiB
+    assert config.multipart_chunksize == 16 * MiB
+    assert config.max_concurrency == 20
+    assert config.io_chunksize == MiB
+
+
+def test_upload_stores_blob_sha(binary_image, s3_bucket: S3Bucket):
+    s3_bucket.upload(BytesIO(binary_image), 'binary-image', blob_sha='abc')
+
+    response = s3_bucket.bucket.meta.client.head_object(
+        Bucket=s3_bucket.S3_BUCKET_NAME, Key='binary-image')
+    assert response['Metadata'] == {BLOB_SHA_METADATA_KEY: 'abc'}
+    assert s3_bucket.get_blob_sha('binary-image') == 'abc'
+
+
+def test_upload_with_content_encoding(s3_bucket: S3Bucket):
+    s3_bucket.upload(
+        BytesIO(b'abc'), 'hello', mime_type='text/plain',
+        content_encoding='gzip')
+    # moto appends the `aws-chunked` encoding of the request
+    assert s3_bucket.get_content_encoding('hello').startswith('gzip')
+    assert s3_bucket.get_content_encoding('inexistent') is None
+
+
+def test_get_blob_sha_without_metadata(s3_bucket: S3Bucket):
+    s3_bucket.bucket.upload_fileobj(Fileobj=BytesIO(), Key='hello')
+    assert s3_bucket.get_blob_sha('hello') is None
+    assert s3_bucket.get_blob_sha('inexistent') is None
+
+
+@pytest.mark.parametrize('base_path,expected_key', (
+    (None, 'copied-image'),
+    ('abc', 'abc/copied-image')))
+def test_copy(binary_image, s3_bucket: S3Bucket, base_path, expected_key):
+    s3_bucket.S3_UPLOAD_LOCATION = base_path
+    s3_bucket.upload(BytesIO(binary_image), 'binary-image', blob_sha='abc')
+
+    s3_bucket.copy('binary-image', 'copied-image')
+
+    out_fp = BytesIO()
+    s3_bucket.bucket.download_fileobj(Key=expected_key, Fileobj=out_fp)
+    assert out_fp.getvalue() == binary_image
+    assert s3_bucket.get_blob_sha('copied-image') == 'abc'
+
+
+def test_copy_picks_the_part_size_from_the_size(s3_bucket: S3Bucket):
+    size = 100 * 1024 * MiB
+
+    with mock.patch.object(s3_bucket.bucket, 'copy') as mocked_copy:
+        s3_bucket.copy('big-file', 'copied-file', size=size)
+
+    # the default part size would need more parts than S3 allows
+    config = mocked_copy.call_args[1]['Config']
+    assert config.multipart_chunksize > DEFAULT_MULTIPART_THRESHOLD
+    assert size / config.multipart_chunksize <= MAX_PART_COUNT
+
+
+@pytest.mark.parametrize('base_path,expected_files', (
+    (None, {'a', 'b/c', 'base/d'}),
+    ('base', {'d'})))
+def test_list_files(s3_bucket: S3Bucket, base_path, expected_files):
+    for key in ('a', 'b/c', 'base/d'):
+        s3_bucket.bucket.upload_fileobj(Fileobj=BytesIO(), Key=key)
+
+    s3_bucket.S3_UPLOAD_LOCATION = base_path
+    assert s3_bucket.list_files() == expected_files
+
+
 @pytest.mark.parametrize('base_path,expected_key', (
     (None, 'binary-image'),
     ('abc', 'abc/binary-image')))
@@ -87,6 +248,27 @@ def test_get_file(binary_image, s3_bucket: S3Bucket, base_path, expected_key):
     assert out_fp.read() == binary_image
 
 
+def test_get_file_if_modified(s3_bucket: S3Bucket):
+    s3_bucket.bucket.put_object(Key='rev', Body=b'abc')
+
+    modified, content, etag = s3_bucket.get_file_if_modified('rev')
+    assert modified
+    assert content == b'abc'
+    assert etag
+
+    assert s3_bucket.get_file_if_modified('rev', etag) == (False, None, etag)
+
+    s3_bucket.bucket.put_object(Key='rev', Body=b'def')
+    modified, content, new_etag = s3_bucket.get_file_if_modified('rev', etag)
+    assert modified
+    assert content == b'def'
+    assert new_etag != etag
+
+
+def test_get_file_if_modified_inexistent(s3_bucket: S3Bucket):
+    assert s3_bucket.get_file_if_modified('rev', '"abc"') == (True, None, None)
+
+
 @mock.patch('s3git.s3.SpooledTemporaryFile')
 def test_get_file_404_returns_none(
         mocked_spooled, s3_bucket: S3Bucket):
@@ -173,11 +355,25 @@ def test__delete_objects_inexistent(s3_bucket: S3Bucket):
 ))
 def test_delete_files_slices_huge_amount(
         mocked__delete_objects, files, expected_calls):
+    mocked__delete_objects.return_value = {}
     s3_bucket = S3Bucket()
-    s3_bucket.delete_files(files)
+    assert s3_bucket.delete_files(files) == {}
     mocked__delete_objects.assert_has_calls(expected_calls)
 
 
+@mock.patch.object(S3Bucket, '_delete_objects')
+def test_delete_files_returns_failed_keys(mocked__delete_objects):
+    mocked__delete_objects.return_value = {
+        'Deleted': [{'Key': 'base/hello'}],
+        'Errors': [{
+            'Key': 'base/world', 'Code': 'AccessDenied',
+            'Message': 'Access Denied'}]}
+
+    s3_bucket = S3Bucket(S3_UPLOAD_LOCATION='base')
+    assert s3_bucket.delete_files(['hello', 'world']) == {
+        'world': 'AccessDenied: Access Denied'}
+
+
 @pytest.mark.parametrize('config_content,branch_name,expected_result', (
     ('[default]\n'
      'S3_ACCESS_KEY_ID = id\n'
@@ -189,11 +385,11 @@ def test_delete_files_slices_huge_amount(
      'S3_BUCKET_NAME = hi_bucket\n',
 
      'none',
-     {
-         'S3_ACCESS_KEY_ID': 'id',
-         'S3_SECRET_ACCESS_KEY': 'secret',
-         'S3_BUCKET_NAME': 'bucket',
-         'S3_UPLOAD_LOCATION': None}),
+     dict(
+         NO_OPTIONS,
+         S3_ACCESS_KEY_ID='id',
+         S3_SECRET_ACCESS_KEY='secret',
+         S3_BUCKET_NAME='bucket')),
 
     ('[default]\n'
      'S3_ACCESS_KEY_ID = id\n'
@@ -203,14 +399,39 @@ def test_delete_files_slices_huge_amount(
      'S3_ACCESS_KEY_ID = hi_id\n'
      'S3_SECRET_ACCESS_KEY = hi_secret\n'
      'S3_BUCKET_NAME = hi_bucket\n'
-     'S3_UPLOAD_LOCATION = bello',
+     'S3_UPLOAD_LOCATION = bello\n'
+     'S3_UPLOAD_CONCURRENCY = 16\n'
+     'S3_USE_MANIFEST = yes\n'
+     'S3_MULTIPART_THRESHOLD = 64MB\n'
+     'S3_MULTIPART_CHUNKSIZE = 16M\n'
+     'S3_TRANSFER_CONCURRENCY = 20\n'
+     'S3_IO_CHUNKSIZE = 1048576\n'
+     'S3_MAX_POOL_CONNECTIONS = 64\n'
+     'S3_CONNECT_TIMEOUT = 5\n'
+     'S3_READ_TIMEOUT = 30\n'
+     'S3_TCP_KEEPALIVE = yes\n'
+     'S3_COMPRESS = *.html, text/*\n'
+     'S3_COMPRESSION = br',
 
      'hello',
-     {
-         'S3_ACCESS_KEY_ID': 'hi_id',
-         'S3_SECRET_ACCESS_KEY': 'hi_secret',
-         'S3_BUCKET_NAME': 'hi_bucket',
-         'S3_UPLOAD_LOCATION': 'bello'}),
+     dict(
+         NO_OPTIONS,
+         S3_ACCESS_KEY_ID='hi_id',
+         S3_SECRET_ACCESS_KEY='hi_secret',
+         S3_BUCKET_NAME='hi_bucket',
+         S3_UPLOAD_LOCATION='bello',
+         S3_UPLOAD_CONCURRENCY=16,
+         S3_USE_MANIFEST=True,
+         S3_MULTIPART_THRESHOLD=64 * 1024 * 1024,
+         S3_MULTIPART_CHUNKSIZE=16 * 1024 * 1024,
+         S3_TRANSFER_CONCURRENCY=20,
+         S3_IO_CHUNKSIZE=1024 * 1024,
+         S3_MAX_POOL_CONNECTIONS=64,
+         S3_CONNECT_TIMEOUT=5,
+         S3_READ_TIMEOUT=30,
+         S3_TCP_KEEPALIVE=True,
+         S3_COMPRESS=('*.html', 'text/*'),
+         S3_COMPRESSION='br')),
 
 ))
 def test_read_config(s3git, config_content, branch_name, expected_result):
@@ -251,3 +472,34 @@ def test_read_config_missing_no_fit_section_found(s3git):
 
     with pytest.raises(expected_error_cls, message=expected_error_msg):
         S3Bucket.read_config('none')
+
+
+@pytest.mark.parametrize('key,value', (
+    ('S3_UPLOAD_CONCURRENCY', 'abc'),
+    ('S3_UPLOAD_CONCURRENCY', '0'),
+    ('S3_USE_MANIFEST', 'maybe'),
+    ('S3_MULTIPART_CHUNKSIZE', '8X'),
+    ('S3_COMPRESSION', 'zip')))
+def test_read_config_invalid_value_raises_error(s3git, key, value):
+    with open(S3CONFIG_PATH, 'w') as w:
+        w.write('[default]\n'
+                'S3_ACCESS_KEY_ID = id\n'
+                'S3_SECRET_ACCESS_KEY = secret\n'
+                'S3_BUCKET_NAME = bucket\n'
+                '%s = %s\n' % (key, value))
+
+    with pytest.raises(InvalidValueInConfigurationFile):
+        S3Bucket.read_config('none')
+
+
+def test_read_config_without_default_raises_on_missing_section(s3git):
+    with open(S3CONFIG_PATH, 'w') as w:
+        w.write('[default]\n'
+                'S3_ACCESS_KEY_ID = id\n'
+                'S3_SECRET_ACCESS_KEY = secret\n'
+                'S3_BUCKET_NAME = bucket\n')
+
+    assert S3Bucket.read_config('default', use_default=False).S3_BUCKET_NAME \
+        == 'bucket'
+    with pytest.raises(UnknownConfigurationSection):
+        S3Bucket.read_config('none', use_default=False)
@@ -0,0 +1,111 @@
+import json
+import threading
+from unittest import mock
+
+from s3git.stats import (
+    AFTER_CALL_EVENT, BEFORE_CALL_EVENT, BEFORE_SEND_EVENT, Histogram,
+    SyncStats)
+
+
+def test_histogram_counts_values_per_bucket():
+    histogram = Histogram((0.1, 1, float('inf')))
+
+    for value in (0.01, 0.1, 0.5, 3, 60):
+        histogram.add(value)
+
+    assert histogram.as_dict() == {'0.1': 2, '1': 1, '+Inf': 2}
+
+
+def test_measure_sums_the_stages():
+    stats = SyncStats()
+
+    with stats.measure('upload', size=10):
+        pass
+    with stats.measure('upload', size=5):
+        pass
+    with stats.measure('delete', count=100):
+        pass
+
+    stages = stats.as_dict()['stages']
+    assert stages['upload']['count'] == 2
+    assert stages['upload']['bytes'] == 15
+    assert stages['delete']['count'] == 100
+    assert stages['upload']['seconds'] >= 0
+
+
+def test_record_saving_adds_to_the_stage():
+    stats = SyncStats()
+
+    with stats.measure('compress', size=100):
+        pass
+    stats.record_saving('compress', 60)
+    stats.record_saving('compress', 10)
+
+    stages = stats.as_dict()['stages']
+    assert stages['compress']['count'] == 1
+    assert stages['compress']['bytes'] == 100
+    assert stages['compress']['saved_bytes'] == 70
+
+
+def test_record_change_is_thread_safe():
+    stats = SyncStats()
+
+    def record():
+        for _ in range(1000):
+            stats.record_change('A')
+
+    threads = [threading.Thread(target=record) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert stats.changes == {'A': 8000}
+
+
+def test_watch_client_records_the_requests():
+    stats = SyncStats()
+    client = mock.MagicMock()
+    stats.watch_client(client)
+
+    handlers = {
+        call[0][0]: call[0][1]
+        for call in client.meta.events.register.call_args_list}
+    context = {}
+    model = mock.MagicMock()
+    model.name = 'PutObject'
+
+    handlers[BEFORE_CALL_EVENT](model=model, context=context, params={})
+    handlers[BEFORE_SEND_EVENT](request=mock.MagicMock(
+        context=context, headers={'Content-Length': '42'}))
+    handlers[AFTER_CALL_EVENT](
+        context=context, http_response=mock.MagicMock(
+            status_code=503, headers={'Content-Length': '7'}))
+
+    request = stats.as_dict()['requests']['PutObject']
+    assert request['count'] == 1
+    assert request['errors'] == 1
+    assert request['bytes_sent'] == 42
+    assert request['bytes_received'] == 7
+    assert sum(request['latencies'].values()) == 1
+
+    stats.unwatch_client(client)
+    assert client.meta.events.unregister.call_count == len(handlers)
+
+
+def test_dump_writes_the_report(tmpdir):
+    path = tmpdir.join('stats.json').strpath
+    stats = SyncStats()
+
+    stats.start(bucket='bucket')
+    stats.record_change('D')
+    stats.stop(ValueError('failed'))
+    stats.dump(path)
+
+    with open(path) as fp:
+        report = json.load(fp)
+
+    assert report['info'] == {'bucket': 'bucket'}
+    assert report['changes'] == {'D': 1}
+    assert report['succeeded'] is False
+    assert report['error'] == 'ValueError: failed'
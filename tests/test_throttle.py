@@ -0,0 +1,167 @@
+import threading
+import time
+from io import BytesIO
+from unittest import mock
+
+import pytest
+from botocore.awsrequest import AWSResponse
+from botocore.exceptions import ClientError, ReadTimeoutError
+
+from s3git.throttle import (
+    MAX_RETRY_DELAY, AdaptiveThrottle, get_retry_delay, is_throttling_error)
+
+
+def _client_error(code, status=503):
+    return ClientError({
+        'Error': {'Code': code, 'Message': ''},
+        'ResponseMetadata': {'HTTPStatusCode': status}}, 'PutObject')
+
+
+def _wrapped_error(exc):
+    try:
+        raise exc
+    except ClientError:
+        try:
+            raise OSError('Failed to upload')
+        except OSError as wrapper:
+            return wrapper
+
+
+@pytest.mark.parametrize('exc,expected', (
+    (_client_error('SlowDown'), True),
+    (_client_error('InternalError', status=503), True),
+    (_client_error('NoSuchKey', status=404), False),
+    (_wrapped_error(_client_error('SlowDown')), True),
+    (ReadTimeoutError(endpoint_url='http://s3'), True),
+    (ValueError(), False)))
+def test_is_throttling_error(exc, expected):
+    assert is_throttling_error(exc) == expected
+
+
+def test_get_retry_delay_is_bounded():
+    for attempt in range(1, 30):
+        assert 0 <= get_retry_delay(attempt) <= MAX_RETRY_DELAY
+
+
+@mock.patch('time.sleep')
+def test_call_retries_throttled_calls(mocked_sleep):
+    throttle = AdaptiveThrottle(8)
+    function = mock.MagicMock(
+        __name__='upload', side_effect=[_client_error('SlowDown'), 'done'])
+
+    assert throttle.call(function, 'path') == 'done'
+    assert function.call_count == 2
+    assert mocked_sleep.call_count == 1
+
+    # the concurrency was halved, then started to increase again
+    assert throttle.concurrency == 4
+    assert throttle.throttled_count == 1
+
+
+@mock.patch('time.sleep')
+def test_call_gives_up_after_max_attempts(mocked_sleep):
+    throttle = AdaptiveThrottle(8, max_attempts=3)
+    function = mock.MagicMock(
+        __name__='upload', side_effect=_client_error('SlowDown'))
+
+    with pytest.raises(ClientError):
+        throttle.call(function, 'path')
+    assert function.call_count == 3
+    assert throttle.running == 0
+
+
+def test_call_does_not_retry_other_errors():
+    throttle = AdaptiveThrottle(8)
+    function = mock.MagicMock(side_effect=ValueError())
+
+    with pytest.raises(ValueError):
+        throttle.call(function)
+    assert function.call_count == 1
+    assert throttle.concurrency == 8
+
+
+@mock.patch('time.sleep')
+def test_concurrency_is_decreased_once_per_interval(mocked_sleep):
+    throttle = AdaptiveThrottle(16, max_attempts=1)
+    function = mock.MagicMock(
+        __name__='upload', side_effect=_client_error('SlowDown'))
+
+    for _ in range(3):
+        with pytest.raises(ClientError):
+            throttle.call(function, 'path')
+
+    assert throttle.concurrency == 8
+    assert throttle.throttled_count == 3
+
+
+def test_concurrency_increases_back_to_the_maximum():
+    throttle = AdaptiveThrottle(4)
+    throttle.limit = 1
+
+    for _ in range(20):
+        throttle.call(lambda: None)
+    assert throttle.concurrency == 4
+
+
+def test_call_limits_the_concurrency():
+    throttle = AdaptiveThrottle(2)
+    running = []
+    max_running = []
+    lock = threading.Lock()
+
+    def _function():
+        with lock:
+            running.append(None)
+            max_running.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.pop()
+
+    threads = [
+        threading.Thread(target=throttle.call, args=(_function,))
+        for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max(max_running) == 2
+
+
+class _RawResponse:
+    def __init__(self, content):
+        self.content = content
+
+    def stream(self, **kwargs):
+        yield self.content
+
+
+def test_throttle_sees_the_attempts_retried_by_botocore(s3_bucket):
+    client = s3_bucket.bucket.meta.client
+    attempts = []
+
+    # S3 slows down the first two attempts, which botocore retries
+    def _slow_down(request, **kwargs):
+        attempts.append(request)
+        if len(attempts) <= 2:
+            return AWSResponse(request.url, 503, {}, _RawResponse(
+                b'<Error><Code>SlowDown</Code>'
+                b'<Message>Please reduce your request rate.</Message></Error>'))
+
+    client.meta.events.register_first('before-send.s3.PutObject', _slow_down)
+
+    throttle = AdaptiveThrottle(8)
+    throttle.watch_client(client)
+
+    with mock.patch('botocore.endpoint.time.sleep'):
+        throttle.call(s3_bucket.upload, BytesIO(b'abc'), 'hello')
+
+    assert len(attempts) == 3
+    assert throttle.throttled_count == 2
+    assert throttle.concurrency == 4
+
+    throttle.unwatch_client(client)
+    attempts.clear()
+    with mock.patch('botocore.endpoint.time.sleep'):
+        s3_bucket.upload(BytesIO(b'abc'), 'hello')
+    assert throttle.throttled_count == 2
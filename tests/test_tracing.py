@@ -0,0 +1,68 @@
+import json
+import threading
+
+import pytest
+
+from s3git.tracing import NULL_SPAN, Tracer
+
+
+def test_span_does_nothing_while_disabled():
+    tracer = Tracer()
+
+    assert tracer.span('upload', path='file') is NULL_SPAN
+    with tracer.span('upload'):
+        pass
+    assert tracer.events == []
+
+
+def test_span_records_complete_events():
+    tracer = Tracer()
+    tracer.start()
+
+    with tracer.span('upload', path='file'):
+        pass
+    with pytest.raises(ValueError):
+        with tracer.span('delete'):
+            raise ValueError('failed')
+
+    tracer.stop()
+    with tracer.span('ignored'):
+        pass
+
+    upload, delete = tracer.events
+    assert upload['name'] == 'upload'
+    assert upload['ph'] == 'X'
+    assert upload['args'] == {'path': 'file'}
+    assert upload['tid'] == threading.get_ident()
+    assert upload['dur'] >= 0
+    assert delete['ts'] >= upload['ts']
+    assert delete['args'] == {'error': 'ValueError: failed'}
+
+
+def test_dump_names_the_threads(tmpdir):
+    path = tmpdir.join('trace.json').strpath
+    tracer = Tracer()
+    tracer.start()
+
+    def upload():
+        with tracer.span('upload'):
+            pass
+
+    thread = threading.Thread(target=upload, name='worker')
+    thread.start()
+    thread.join()
+    upload()
+    tracer.dump(path)
+
+    with open(path) as fp:
+        events = json.load(fp)['traceEvents']
+
+    thread_names = {
+        event['tid']: event['args']['name']
+        for event in events if event['name'] == 'thread_name'}
+    spans = [event for event in events if event['ph'] == 'X']
+
+    assert len(spans) == 2
+    assert thread_names[threading.get_ident()] == \
+        threading.current_thread().name
+    assert 'worker' in thread_names.values()
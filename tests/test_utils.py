@@ -1,13 +1,16 @@
-from s3git.utils import cached_property
+import pytest
+
+from s3git.utils import (
+    cached_property, parse_list, parse_positive_int, parse_size)
 
 
 def test_cached_property():
     class TestClass:
-        __slots__ = '_a',
-        CACHED_DATA = {}
+        __slots__ = '_a', '_cached_data'
 
-        def __init__(self):
-            self._a = 1
+        def __init__(self, a=1):
+            self._a = a
+            self._cached_data = {}
 
         @cached_property
         def a(self):
@@ -18,3 +21,36 @@ def test_cached_property():
 
     instance._a = 2
     assert instance.a == 1
+
+    # every instance has its own cache
+    assert TestClass(3).a == 3
+
+
+@pytest.mark.parametrize('value,expected', (
+    ('1', 1), (12, 12), ('8M', 8 * 1024 * 1024), ('8 MB', 8 * 1024 * 1024),
+    ('64KiB', 64 * 1024), ('1g', 1024 ** 3)))
+def test_parse_size(value, expected):
+    assert parse_size(value) == expected
+
+
+@pytest.mark.parametrize('value', ('', '0', '-1', '8X', '1.5M', 'M'))
+def test_parse_size_invalid_value(value):
+    with pytest.raises(ValueError):
+        parse_size(value)
+
+
+def test_parse_positive_int():
+    assert parse_positive_int('3') == 3
+
+    for value in ('0', '-1', 'abc'):
+        with pytest.raises(ValueError):
+            parse_positive_int(value)
+
+
+@pytest.mark.parametrize('value,expected', (
+    ('*.html', ('*.html',)),
+    ('*.html, *.css,text/*', ('*.html', '*.css', 'text/*')),
+    ('*.html\n  *.css', ('*.html', '*.css')),
+    ('', ())))
+def test_parse_list(value, expected):
+    assert parse_list(value) == expected